@@ -3,13 +3,26 @@ from . import iobeam
 
 ClientBuilder = iobeam.ClientBuilder
 DataStore = iobeam.DataStore
+ConcurrentDataStore = iobeam.ConcurrentDataStore
 DataPoint = iobeam.DataPoint
 DataSeries = iobeam.DataSeries
 Timestamp = iobeam.Timestamp
 TimeUnit = iobeam.TimeUnit
+Priority = iobeam.Priority
 QueryReq = iobeam.QueryReq
+GatewayClient = iobeam.GatewayClient
+BufferBudget = iobeam.BufferBudget
+RateLimiter = iobeam.RateLimiter
+BackpressurePolicy = iobeam.BackpressurePolicy
+LRUCache = iobeam.LRUCache
+RangeCache = iobeam.RangeCache
+Watermark = iobeam.Watermark
 
 # pylint:disable=invalid-name
 makeQuery = iobeam.makeQuery
+makeQueries = iobeam.makeQueries
+iterQuery = iobeam.iterQuery
+pollQuery = iobeam.pollQuery
+makeSplitQuery = iobeam.makeSplitQuery
 fetchDeviceToken = iobeam.fetchDeviceToken
 # pylint:enable=invalid-name
@@ -0,0 +1,332 @@
+"""Functionality shared by iobeam clients."""
+import threading
+
+from .endpoints import devices
+from .endpoints import imports
+from .endpoints import tokens
+from .http import request
+from .utils import utils
+from .workers import flusher
+from .workers import refresher
+
+
+class BaseClient(object):
+    """Base for clients that send data to iobeam under one project token.
+
+    Handles the project token, endpoint services, hooks, and background
+    sending. Subclasses implement `_send()`, which is called with the send
+    lock held, `_pendingStats()`, which the background sender uses to
+    decide when to send, and `_allStores()`.
+    """
+
+    def __init__(self, projectId, projectToken, backend):
+        """Constructor for the shared client state.
+
+        Params:
+            projectId - iobeam project ID
+            projectToken - iobeam project token with write access for sending data
+            backend - Requester to use; if None, requests go to
+                      https://api.iobeam.com/v1/
+
+        Raises:
+            ValueError - If projectId or projectToken are invalid.
+        """
+        utils.checkValidProjectId(projectId)
+        utils.checkValidProjectToken(projectToken)
+
+        self.projectId = projectId
+        self.projectToken = projectToken
+        self._sendLock = threading.Lock()
+        self._flusher = None
+        self._tokenLock = threading.Lock()
+        self._refresher = None
+        self._budget = None
+
+        # Setup services; a client gets its own requester, so its hooks and
+        # rate limiter do not apply to other clients
+        if backend is None:
+            backend = request.getRequester()
+        if hasattr(backend, "scoped"):
+            backend = backend.scoped()
+        self._deviceService = devices.DeviceService(projectToken,
+                                                    requester=backend)
+        self._importService = imports.ImportService(projectToken,
+                                                    requester=backend)
+        self._tokenService = tokens.TokenService(requester=backend)
+
+    def _services(self):
+        """Return the endpoint services used by this client."""
+        return [self._deviceService, self._importService, self._tokenService]
+
+    def addHook(self, hook):
+        """Report timing spans for this client's requests to `hook`.
+
+        The hook is called as `hook(name, seconds, info)`, where `info` is a
+        dict of details such as byte counts. Spans include building import
+        requests ("imports.build"), each import chunk ("imports.chunk"), and
+        the HTTP phases of each request ("http.encode", "http.send",
+        "http.parse"). Only this client's requests are reported, even if
+        other clients use the same backend.
+
+        Params:
+            hook - Callable taking `(name, seconds, info)`
+        """
+        requesters = []
+        for service in self._services():
+            service.addHook(hook)
+            if service.requester() not in requesters:
+                requesters.append(service.requester())
+        for r in requesters:
+            if hasattr(r, "addHook"):
+                r.addHook(hook)
+
+    def removeHook(self, hook):
+        """Stop reporting timing spans to a hook added with `addHook`."""
+        for service in self._services():
+            service.removeHook(hook)
+            if hasattr(service.requester(), "removeHook"):
+                service.requester().removeHook(hook)
+
+    def setRateLimiter(self, limiter):
+        """Limit the rate of this client's requests.
+
+        The limiter is set on this client's HTTP requester, so it applies to
+        all of the client's threads but not to other clients using the same
+        backend. To limit several clients together, give them the same
+        limiter.
+
+        Params:
+            limiter - A ratelimit.RateLimiter, or None to remove limiting
+        """
+        for service in self._services():
+            if hasattr(service.requester(), "setRateLimiter"):
+                service.requester().setRateLimiter(limiter)
+
+    def _checkToken(self):
+        """Check if token is expired, and refresh if necessary.
+
+        The token's expiry is decoded once and cached, so this is cheap to
+        call before every request.
+        """
+        if utils.isExpiredToken(self.projectToken):
+            self._refreshIfNeeded(False)
+
+    def _refreshIfNeeded(self, force):
+        """Refresh the project token, unless another thread already has.
+
+        Params:
+            force - Refresh even if the token is not yet considered expired.
+        """
+        with self._tokenLock:
+            if not force and not utils.isExpiredToken(self.projectToken):
+                return
+            newToken = self._refreshToken()
+            if newToken is not None:
+                self._setToken(newToken)
+
+    def _refreshToken(self):
+        """Refresh expired project token."""
+        return self._tokenService.refreshToken(self.projectToken)
+
+    def _setToken(self, token):
+        """Use a new project token for this client and its services."""
+        self.projectToken = token
+        self._deviceService.token = token
+        self._importService.token = token
+
+    def startTokenRefresh(self, margin=60 * 60):
+        """Refresh the project token in the background before it expires.
+
+        Params:
+            margin - Seconds before the token would be considered expired
+                     (i.e., before expiry less `utils.EXPIRY_FUDGE`) to
+                     refresh it.
+
+        Raises:
+            ValueError - If margin is negative.
+        """
+        newRefresher = refresher.TokenRefresher(self, margin=margin)
+        self.stopTokenRefresh()
+        self._refresher = newRefresher
+        self._refresher.start()
+
+    def stopTokenRefresh(self, timeout=None):
+        """Stop refreshing the token in the background, if running.
+
+        Returns:
+            True if stopped successfully; False otherwise.
+        """
+        if self._refresher is None:
+            return True
+        ret = self._refresher.stop(timeout=timeout)
+        self._refresher = None
+        return ret
+
+    # pylint: disable=too-many-arguments
+    def startAutoFlush(self, maxRows=None, maxBytes=None, maxAge=None,
+                       checkInterval=1.0):
+        """Start sending data in the background when thresholds are crossed.
+
+        Any previously started background sender is stopped first.
+
+        Params:
+            maxRows - Send when at least this many rows are buffered
+            maxBytes - Send when buffered data is estimated at this many bytes
+            maxAge - Send when the oldest buffered row is this many seconds old
+            checkInterval - Seconds between threshold checks
+
+        Raises:
+            ValueError - If no threshold is set or any is not positive.
+        """
+        newFlusher = flusher.AutoFlusher(self, maxRows=maxRows, maxBytes=maxBytes,
+                                         maxAge=maxAge, checkInterval=checkInterval)
+        self.stopAutoFlush(drain=False)
+        self._flusher = newFlusher
+        self._flusher.start()
+    # pylint: enable=too-many-arguments
+
+    def stopAutoFlush(self, drain=True, timeout=None):
+        """Stop the background sender, if running.
+
+        Params:
+            drain - If True, send any remaining data before returning.
+            timeout - Max seconds to wait for an in-progress send.
+
+        Returns:
+            True if stopped (and drained) successfully; False otherwise.
+        """
+        if self._flusher is None:
+            return True
+        ret = self._flusher.stop(drain=drain, timeout=timeout)
+        self._flusher = None
+        return ret
+
+    def setBufferBudget(self, budget):
+        """Limit the memory used by this client's unsent data.
+
+        The budget covers every store tracked by this client, including ones
+        created later. When it is full, the background sender (if running) is
+        asked to send right away, and the budget's policy is applied to new
+        rows. With BLOCK and no background sender, adding to a full buffer
+        raises BufferFullError at once, since nothing would free space.
+
+        Params:
+            budget - A budget.BufferBudget, or None to remove the limit
+        """
+        old = self._budget
+        if old is not None:
+            for store in self._allStores():
+                old.untrack(store)
+            if old.onFull == self._requestFlush:
+                old.onFull = None
+        self._budget = budget
+        if budget is not None:
+            if budget.onFull is None:
+                budget.onFull = self._requestFlush
+            for store in self._allStores():
+                budget.track(store)
+
+    def bufferStats(self):
+        """Report how full this client's buffer budget is.
+
+        Returns:
+            Dict from `BufferBudget.stats()`, or None if no budget is set.
+        """
+        if self._budget is None:
+            return None
+        return self._budget.stats()
+
+    def _trackStore(self, store):
+        """Account for a newly tracked store in the buffer budget."""
+        if self._budget is not None:
+            self._budget.track(store)
+
+    def _requestFlush(self):
+        """Ask the background sender, if running, to send now.
+
+        Returns:
+            True if a background sender was asked; False if none is running.
+        """
+        flush = self._flusher
+        if flush is None:
+            return False
+        flush.requestFlush()
+        return True
+
+    def close(self, drain=True, timeout=None):
+        """Shut down the client's background work.
+
+        Params:
+            drain - If True, send any remaining data before returning.
+            timeout - Max seconds to wait for an in-progress send.
+
+        Returns:
+            True if shut down (and drained) successfully; False otherwise.
+        """
+        refreshStopped = self.stopTokenRefresh(timeout=timeout)
+        return self.stopAutoFlush(drain=drain, timeout=timeout) and refreshStopped
+
+    def send(self):
+        """Sends stored data to the iobeam backend.
+
+        Only one send runs at a time; concurrent calls (e.g., from the
+        background sender) wait for the current one to finish.
+
+        Raises:
+            Exception - if sending the data fails.
+        """
+        with self._sendLock:
+            self._send()
+
+    def _send(self):
+        """Sends stored data; called with `_sendLock` held."""
+        raise NotImplementedError()
+
+    def _pendingStats(self):
+        """Summarize data waiting to be sent.
+
+        Returns:
+            Tuple of (number of rows, estimated size in bytes, wall clock time
+            the oldest row was added or None if there are no rows).
+        """
+        raise NotImplementedError()
+
+    def _allStores(self):
+        """Return the DataStores tracked by this client."""
+        raise NotImplementedError()
+
+    def _importSnapshot(self, deviceId, snapshot, restore, onFailure=None):
+        """Import a snapshot, handing anything not accepted to `restore`.
+
+        Only the rows the server has not acknowledged are restored, so the
+        next send resumes where this one stopped.
+
+        Params:
+            deviceId - Device the data belongs to
+            snapshot - DataStore to send, usually taken with `swap()`
+            restore - Called with a DataStore of the rows not accepted
+            onFailure - Optional callable run after `restore` on failure
+
+        Raises:
+            Exception - if sending the data fails.
+        """
+        try:
+            result = self._importService.importBatch(self.projectId, deviceId,
+                                                     snapshot)
+        except imports.PartialImportError as e:
+            restore(e.result.remaining)
+            if onFailure is not None:
+                onFailure()
+            raise
+        except Exception:
+            restore(snapshot)
+            if onFailure is not None:
+                onFailure()
+            raise
+        success, extra = result
+        if not success:
+            remaining = getattr(result, "remaining", None)
+            restore(remaining if remaining is not None else snapshot)
+            if onFailure is not None:
+                onFailure()
+            raise Exception("send failed. server sent: {}".format(extra))
@@ -0,0 +1,249 @@
+"""Command line tool for long, resumable imports of historical data.
+
+Works like `iobeam-import`, but records which rows were accepted in a
+checkpoint file, so an interrupted backfill continues where it stopped
+without re-sending data, and limits its upload rate.
+
+Example:
+    iobeam-backfill --project 1 --device-column device --time-column ts \\
+        --checkpoint backfill.json --max-rate 5000 2016-*.csv
+"""
+import json
+import os.path
+import sys
+import time
+
+from iobeam.cli import importer
+from iobeam.http import ratelimit
+from iobeam.http import request
+from iobeam.utils import utils
+
+
+class Checkpoint(object):
+    """Committed offsets of a backfill, kept in a JSON file.
+
+    For each input file it records, per device, the number of leading rows
+    of the file whose rows for that device were accepted, and whether the
+    whole file is done.
+    """
+
+    def __init__(self, path):
+        """Constructor for a Checkpoint.
+
+        Params:
+            path - File to keep the checkpoint in
+        """
+        self.path = path
+
+    def load(self):
+        """Return the saved dictionary of file to {"devices", "done"}."""
+        if not os.path.isfile(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f).get("files") or {}
+
+    def save(self, files):
+        """Save a dictionary of file to {"devices", "done"}."""
+        utils.atomicWrite(self.path, json.dumps({"files": files}, sort_keys=True))
+
+    def clear(self):
+        """Delete the checkpoint, e.g., to start a backfill over."""
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+class Backfill(importer.Importer):
+    """Importer that checkpoints accepted rows and throttles its uploads.
+
+    After each round of uploads the position of the last accepted row of
+    each device is saved to the checkpoint. When a chunk fails the backfill
+    stops; running it again skips the rows already accepted, including
+    those of a partly accepted chunk, and retries from the first row that
+    was not. A device has at most one chunk in flight, so no accepted row
+    is sent again.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, service, projectId, mapping, checkpoint, rowsPerSec=None,
+                 chunkRows=1000, concurrency=4, progress=None, maxBufferedRows=None):
+        """Constructor for a Backfill.
+
+        Params:
+            service - ImportService to upload with
+            projectId - Project to import into
+            mapping - ColumnMapping of the input rows
+            checkpoint - Checkpoint to record progress in
+            rowsPerSec - Max sustained rows uploaded per second; None for
+                         no limit
+            chunkRows - Max rows per upload
+            concurrency - Max uploads in flight
+            progress - Optional stream to write progress reports to
+            maxBufferedRows - Max rows in partly filled chunks (see
+                              `Importer`)
+
+        Raises:
+            ValueError - If rowsPerSec, chunkRows, concurrency, or
+                         maxBufferedRows are not positive.
+        """
+        importer.Importer.__init__(self, service, projectId, mapping, chunkRows=chunkRows,
+                                   concurrency=concurrency, progress=progress,
+                                   maxBufferedRows=maxBufferedRows)
+        self._checkpoint = checkpoint
+        self._bucket = None
+        if rowsPerSec is not None:
+            self._bucket = ratelimit.TokenBucket(rowsPerSec, burst=max(rowsPerSec, chunkRows))
+        self._files = checkpoint.load()
+        self._state = None
+        self._halted = set()
+        self._sleep = time.sleep
+        self.stopped = False
+        self.rowsResumed = 0
+    # pylint: enable=too-many-arguments
+
+    def runFile(self, path, fmt=None):
+        """Import a file, skipping rows the checkpoint says were accepted.
+
+        Params:
+            path - Input file
+            fmt - "csv" or "jsonl"; None to guess from the file name
+
+        Returns:
+            True if the whole file is done, False if the backfill stopped.
+        """
+        fmt = importer.formatOf(path, fmt)
+        state = self._files.setdefault(os.path.abspath(path), {"devices": {}, "done": False})
+        if state["done"]:
+            return True
+        self._state = state
+        self._halted = set()
+        committed = state["devices"]
+        skipUntil = max(committed.values()) if len(committed) > 0 else 0
+        with importer.openInput(path, fmt) as f:
+            for i, row in enumerate(importer.iterRows(f, fmt)):
+                pos = i + 1
+                if pos <= skipUntil and self._isCommitted(row, pos):
+                    self.rowsResumed += 1
+                    continue
+                self.add(row, position=pos)
+                if self.stopped:
+                    break
+        if not self.stopped:
+            self.flush()
+        if self.stopped:
+            # drop rows not uploaded yet; the next run reads them again
+            self._stores = {}
+            self._positions = {}
+            self._buffered = 0
+            self._full = []
+            return False
+        state["done"] = True
+        state["devices"] = {}
+        self._checkpoint.save(self._files)
+        return True
+
+    def _isCommitted(self, row, position):
+        """Tells whether a row was accepted by an earlier run."""
+        try:
+            did = self._mapping.parse(row)[0]
+        except (ValueError, TypeError):
+            return True  # skipped (and counted) by the earlier run
+        return position <= self._state["devices"].get(did, 0)
+
+    def _takeRound(self):
+        if self.stopped:
+            # nothing is committed past a failure; the next run resends it
+            self._full = []
+            return []
+        chunks = importer.Importer._takeRound(self)
+        if self._bucket is not None and len(chunks) > 0:
+            wait = self._bucket.reserve(sum(s.numRows() for _, s, _ in chunks))
+            if wait > 0:
+                self._sleep(wait)
+        return chunks
+
+    def _uploaded(self, outcomes):
+        committed = self._state["devices"]
+        for did, position, ok in outcomes:
+            if position is not None and did not in self._halted:
+                committed[did] = max(committed.get(did, 0), position)
+            if not ok:
+                self._halted.add(did)
+                self.stopped = True
+        self._checkpoint.save(self._files)
+
+    def stats(self):
+        """Summarize the backfill so far.
+
+        Returns:
+            The Importer stats, plus "rowsResumed" (rows skipped because an
+            earlier run imported them).
+        """
+        ret = importer.Importer.stats(self)
+        ret["rowsResumed"] = self.rowsResumed
+        return ret
+
+
+def makeParser():
+    """Return the argument parser of the command."""
+    parser = importer.makeParser()
+    parser.prog = "iobeam-backfill"
+    parser.description = "Resumable, rate limited import of CSV or JSON Lines files."
+    parser.add_argument("--checkpoint", required=True,
+                        help="file recording progress; reused to resume")
+    parser.add_argument("--max-rate", type=float, help="max rows uploaded per second")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore an existing checkpoint and start over")
+    return parser
+
+
+def run(args, requester=None, out=sys.stderr):
+    """Run a backfill with parsed arguments.
+
+    Params:
+        args - Namespace from `makeParser().parse_args()`
+        requester - Optional requester to use instead of the backend's
+        out - Stream for progress reports
+
+    Returns:
+        Dictionary of backfill stats, with "complete" telling whether
+        every file is done.
+
+    Raises:
+        ValueError - If an input is stdin, which cannot be resumed.
+    """
+    if "-" in args.files:
+        raise ValueError("backfill cannot read stdin")
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.clear()
+    runner = Backfill(importer.makeService(args, requester), args.project,
+                      importer.makeMapping(args), checkpoint, rowsPerSec=args.max_rate,
+                      chunkRows=args.chunk_rows, concurrency=args.concurrency,
+                      progress=None if args.quiet else out,
+                      maxBufferedRows=args.max_buffered_rows)
+    complete = all(runner.runFile(path, args.format) for path in args.files)
+    stats = runner.finish()
+    stats["complete"] = complete
+    return stats
+
+
+def main(argv=None):
+    """Entry point of the `iobeam-backfill` command."""
+    parser = makeParser()
+    args = parser.parse_args(argv)
+    if not args.token:
+        parser.error("a token is required (--token or ${})".format(importer.TOKEN_ENV))
+    try:
+        stats = run(args)
+    except (ValueError, IOError, request.Error, request.UnauthorizedError) as e:
+        sys.stderr.write("iobeam-backfill: {}\n".format(e))
+        return 1
+    if not stats["complete"]:
+        sys.stderr.write("iobeam-backfill: stopped after a failed upload; "
+                         "run again to resume\n")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""Command line tool that exports iobeam data to CSV, JSON Lines, or Parquet.
+
+Example:
+    iobeam-export --project 1 --device dev1 --from 1451606400000 \\
+        --format csv --output dev1.csv --resume
+"""
+import argparse
+import os
+import sys
+
+from iobeam.endpoints import exports
+from iobeam.http import request
+from iobeam.resources import data
+from iobeam.resources import query
+from iobeam.resources import sinks
+
+TOKEN_ENV = "IOBEAM_TOKEN"
+
+
+def makeParser():
+    """Return the argument parser of the command."""
+    parser = argparse.ArgumentParser(
+        prog="iobeam-export", description="Export iobeam data to a file.")
+    parser.add_argument("--token", default=os.environ.get(TOKEN_ENV),
+                        help="project token with read access (default: ${})".format(TOKEN_ENV))
+    parser.add_argument("--project", type=int, required=True, help="project ID")
+    parser.add_argument("--device", help="device ID (default: all devices)")
+    parser.add_argument("--series", help="series name (default: all series)")
+    parser.add_argument("--from", dest="start", type=int, help="start time, in --time-unit")
+    parser.add_argument("--to", dest="end", type=int, help="end time, in --time-unit")
+    parser.add_argument("--time-unit", default=data.TimeUnit.MILLISECONDS.value,
+                        choices=[u.value for u in data.TimeUnit],
+                        help="unit of --from/--to and of exported times")
+    parser.add_argument("--format", default="csv", choices=sorted(sinks.FORMATS),
+                        help="output format; parquet requires pyarrow")
+    parser.add_argument("--output", required=True,
+                        help="output file (a directory for parquet)")
+    parser.add_argument("--page-size", type=int, default=10000,
+                        help="max points per series per request")
+    parser.add_argument("--window", type=int,
+                        help="fetch the time range in windows of this length")
+    parser.add_argument("--buffer-rows", type=int,
+                        help="rows to buffer before writing to the output")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted export of the same output")
+    parser.add_argument("--backend", help="base URL of the iobeam API")
+    return parser
+
+
+def run(args, requester=None, out=sys.stderr):
+    """Run an export with parsed arguments.
+
+    Params:
+        args - Namespace from `makeParser().parse_args()`
+        requester - Optional requester to use instead of the backend's
+        out - Stream for the summary line
+
+    Returns:
+        Number of rows written.
+    """
+    unit = data.TimeUnit(args.time_unit)
+    qry = query.Query(args.project, deviceId=args.device, seriesName=args.series,
+                      timeUnit=unit)
+    qry.fromTime(args.start).toTime(args.end)
+
+    if requester is None and args.backend is not None:
+        requester = request.getRequester(url=args.backend)
+    service = exports.ExportService(args.token, requester=requester)
+
+    checkpoint = sinks.Checkpoint(args.output.rstrip("/\\") + ".checkpoint")
+    if not args.resume:
+        checkpoint.clear()
+    resuming = checkpoint.load() is not None
+    with sinks.makeSink(args.format, args.output, append=resuming,
+                        bufferRows=args.buffer_rows) as sink:
+        rows = service.exportTo(qry, sink, checkpoint=checkpoint,
+                                pageSize=args.page_size, window=args.window)
+    out.write("exported {} rows to {}\n".format(rows, args.output))
+    return rows
+
+
+def main(argv=None):
+    """Entry point of the `iobeam-export` command."""
+    parser = makeParser()
+    args = parser.parse_args(argv)
+    if not args.token:
+        parser.error("a token is required (--token or ${})".format(TOKEN_ENV))
+    if args.format == "parquet" and not sinks.hasParquet():
+        parser.error("parquet output requires pyarrow")
+    try:
+        run(args)
+    except (ValueError, request.Error, request.UnauthorizedError) as e:
+        sys.stderr.write("iobeam-export: {}\n".format(e))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,486 @@
+"""Command line tool that bulk imports CSV or JSON Lines files into iobeam.
+
+Example:
+    iobeam-import --project 1 --device-column device --time-column ts \\
+        --time-unit sec --map temp=temperature readings.csv
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+
+from iobeam.endpoints import imports
+from iobeam.http import request
+from iobeam.resources import data
+from iobeam.utils import utils
+from iobeam.workers import pool
+
+# For compatibility with both Python 2 and 3.
+# pylint: disable=redefined-builtin,invalid-name
+if utils.IS_PY3:
+    unicode = str
+# pylint: enable=redefined-builtin,invalid-name
+
+TOKEN_ENV = "IOBEAM_TOKEN"
+
+# time units as multiples of a microsecond
+_USEC = {
+    data.TimeUnit.SECONDS: 1000000,
+    data.TimeUnit.MILLISECONDS: 1000,
+    data.TimeUnit.MICROSECONDS: 1
+}
+
+
+def parseValue(text):
+    """Convert a field to an int or float if it looks like one."""
+    if not isinstance(text, (str, unicode)):
+        return text
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+class ColumnMapping(object):
+    """Maps the fields of input rows to a device, time, and series values."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, timeColumn="time", timeUnit=data.TimeUnit.MILLISECONDS,
+                 deviceId=None, deviceColumn=None, series=None):
+        """Constructor for a ColumnMapping.
+
+        Params:
+            timeColumn - Field holding the time of a row
+            timeUnit - TimeUnit of the times
+            deviceId - Device every row belongs to
+            deviceColumn - Field holding the device of a row, instead of
+                           `deviceId`
+            series - Dictionary of field to series name; None imports every
+                     other field as a series of the same name
+
+        Raises:
+            ValueError - If not exactly one of deviceId and deviceColumn is set.
+        """
+        if (deviceId is None) == (deviceColumn is None):
+            raise ValueError("exactly one of deviceId and deviceColumn must be set")
+        if not isinstance(timeUnit, data.TimeUnit):
+            raise ValueError("timeUnit must be a TimeUnit")
+        self.timeColumn = timeColumn
+        self.timeUnit = timeUnit
+        self.deviceId = deviceId
+        self.deviceColumn = deviceColumn
+        self.series = series
+    # pylint: enable=too-many-arguments
+
+    def parse(self, row):
+        """Turn an input row into (deviceId, Timestamp, values).
+
+        Empty fields are left out of `values`.
+
+        Raises:
+            ValueError - If the row is malformed (e.g., None), or has no
+                         valid time or device, or no values.
+        """
+        if not isinstance(row, dict):
+            raise ValueError("malformed row")
+        rawTime = parseValue(row.get(self.timeColumn))
+        if rawTime is None or rawTime == "" or isinstance(rawTime, (str, unicode)):
+            raise ValueError("missing or invalid time: {}".format(rawTime))
+        usec = int(round(rawTime * _USEC[self.timeUnit]))
+
+        did = self.deviceId
+        if self.deviceColumn is not None:
+            did = row.get(self.deviceColumn)
+            if did is None or did == "":
+                raise ValueError("missing device")
+
+        values = {}
+        if self.series is None:
+            skip = (self.timeColumn, self.deviceColumn)
+            fields = [(f, f) for f in row if f not in skip]
+        else:
+            fields = self.series.items()
+        for field, name in fields:
+            val = row.get(field)
+            if val is None or val == "":
+                continue
+            values[name] = parseValue(val)
+        if len(values) == 0:
+            raise ValueError("row has no values")
+        return str(did), data.Timestamp(usec, unit=data.TimeUnit.MICROSECONDS), values
+
+
+def iterRows(stream, fmt):
+    """Iterate over the rows of a CSV (with a header) or JSON Lines stream.
+
+    Params:
+        stream - Text file object
+        fmt - "csv" or "jsonl"
+
+    Returns:
+        Generator of dictionaries, one per row. Lines of a JSON Lines stream
+        that are not a JSON object are yielded as None, which `Importer`
+        counts as skipped.
+    """
+    if fmt == "csv":
+        for row in csv.DictReader(stream):
+            yield row
+    elif fmt == "jsonl":
+        for line in stream:
+            if len(line.strip()) == 0:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else None
+    else:
+        raise ValueError("unknown format: {}".format(fmt))
+
+
+class Importer(object):
+    """Streams rows into DataStores and uploads them concurrently.
+
+    Rows are collected per device into chunks of at most `chunkRows` rows.
+    Once `concurrency` chunks are full they are uploaded in parallel, so at
+    most about `chunkRows * (concurrency + devices)` rows are in memory.
+    With `maxBufferedRows`, whenever more rows than that are in partly
+    filled chunks, the largest of those chunks are uploaded early, so
+    memory use does not grow with the number of devices.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+    def __init__(self, service, projectId, mapping, chunkRows=1000, concurrency=4,
+                 progress=None, reportEvery=5.0, maxBufferedRows=None):
+        """Constructor for an Importer.
+
+        Params:
+            service - ImportService to upload with
+            projectId - Project to import into
+            mapping - ColumnMapping of the input rows
+            chunkRows - Max rows per upload
+            concurrency - Max uploads in flight
+            progress - Optional stream to write progress reports to
+            reportEvery - Seconds between progress reports
+            maxBufferedRows - Max rows in partly filled chunks across all
+                              devices; None for no limit
+
+        Raises:
+            ValueError - If chunkRows, concurrency, or maxBufferedRows are
+                         not positive ints.
+        """
+        for val, name in ((chunkRows, "chunkRows"), (concurrency, "concurrency")):
+            if not isinstance(val, int) or val <= 0:
+                raise ValueError("{} must be a positive int".format(name))
+        if maxBufferedRows is not None and \
+                (not isinstance(maxBufferedRows, int) or maxBufferedRows <= 0):
+            raise ValueError("maxBufferedRows must be a positive int")
+        self._service = service
+        self._projectId = projectId
+        self._mapping = mapping
+        self._chunkRows = chunkRows
+        self._concurrency = concurrency
+        self._progress = progress
+        self._reportEvery = reportEvery
+        self._maxBuffered = maxBufferedRows
+        self._buffered = 0  # rows in self._stores
+        self._stores = {}  # deviceId -> DataStore being filled
+        self._positions = {}  # deviceId -> positions of the rows being filled
+        self._full = []  # (deviceId, DataStore, positions) ready to upload
+        self._start = None
+        self._lastReport = None
+        self.rowsRead = 0
+        self.rowsImported = 0
+        self.rowsFailed = 0
+        self.rowsSkipped = 0
+        self.errors = []
+    # pylint: enable=too-many-arguments
+
+    def add(self, row, position=None):
+        """Add one input row; invalid rows are counted and skipped.
+
+        Params:
+            row - Dictionary of field to value
+            position - Position of the row in its input, reported to
+                       `_uploaded` once the row is accepted; defaults to
+                       the number of rows read
+        """
+        if self._start is None:
+            self._start = self._lastReport = utils.timer()
+        self.rowsRead += 1
+        try:
+            did, ts, values = self._mapping.parse(row)
+        except (ValueError, TypeError) as e:
+            self.rowsSkipped += 1
+            utils.getLogger().warning("skipping row %d: %s", self.rowsRead, e)
+            return
+        store = self._stores.get(did)
+        if store is not None and any(k not in store.columns() for k in values):
+            # a new series appeared; upload what has the old columns
+            self._queue(did, store)
+            store = None
+        if store is None:
+            columns = list(self._mapping.series.values()) \
+                if self._mapping.series is not None else sorted(values)
+            store = data.DataStore(columns)
+            self._stores[did] = store
+        store.add(ts, values)
+        self._buffered += 1
+        self._positions.setdefault(did, []).append(
+            position if position is not None else self.rowsRead)
+        if store.numRows() >= self._chunkRows:
+            self._queue(did, store)
+        while self._maxBuffered is not None and self._buffered > self._maxBuffered:
+            largest = max(self._stores, key=lambda d: self._stores[d].numRows())
+            self._queue(largest, self._stores[largest])
+        if len(self._full) >= self._concurrency:
+            self._uploadFull()
+
+    def addAll(self, rows):
+        """Add every row of an iterable."""
+        for row in rows:
+            self.add(row)
+
+    def _queue(self, deviceId, store):
+        """Mark a chunk as ready to upload."""
+        if self._stores.get(deviceId) is store:
+            del self._stores[deviceId]
+            self._buffered -= store.numRows()
+        self._full.append((deviceId, store, self._positions.pop(deviceId, [])))
+
+    def _takeRound(self):
+        """Remove and return the ready chunks to upload in the next round.
+
+        At most one chunk per device is uploaded in a round, so each
+        device's chunks are accepted in the order they were filled; the
+        others wait for a later round.
+        """
+        chunks = []
+        later = []
+        devices = set()
+        for chunk in self._full:
+            if chunk[0] in devices:
+                later.append(chunk)
+            else:
+                devices.add(chunk[0])
+                chunks.append(chunk)
+        self._full = later
+        return chunks
+
+    def _uploadFull(self):
+        """Upload a round of ready chunks concurrently."""
+        chunks = self._takeRound()
+        if len(chunks) == 0:
+            return
+
+        def makeTask(did, store):
+            """Bind the chunk of a task."""
+            return lambda: self._service.importBatch(self._projectId, did, store)
+
+        done = pool.runAll([makeTask(d, s) for d, s, _ in chunks], self._concurrency)
+        outcomes = []
+        for (did, store, positions), (result, err) in zip(chunks, done):
+            if err is not None:
+                acked = err.result.acked if isinstance(err, imports.PartialImportError) else 0
+                self._recordFailure(did, store.numRows() - acked, err)
+            elif not result.success:
+                acked = result.acked
+                self._recordFailure(did, store.numRows() - acked, result.extra)
+            else:
+                acked = store.numRows()
+            self.rowsImported += acked
+            # rows are acknowledged in the order they were added
+            outcomes.append((did, positions[acked - 1] if acked > 0 else None,
+                             err is None and result.success))
+        self._uploaded(outcomes)
+        self._report(False)
+
+    def _uploaded(self, outcomes):
+        """Called after each round of uploads; no-op by default.
+
+        Params:
+            outcomes - List of (deviceId, position of the chunk's last
+                       accepted row or None if none was, whether the chunk
+                       was fully accepted), in the order the chunks were
+                       filled
+        """
+        pass
+
+    def _recordFailure(self, deviceId, rows, error):
+        """Count rows of a chunk that were not accepted."""
+        self.rowsFailed += rows
+        self.errors.append((deviceId, error))
+        utils.getLogger().warning("import of %d rows for %s failed: %s", rows, deviceId, error)
+
+    def flush(self):
+        """Upload all rows added so far, including partly filled chunks."""
+        for did in list(self._stores):
+            self._queue(did, self._stores[did])
+        while len(self._full) > 0:
+            self._uploadFull()
+
+    def finish(self):
+        """Upload all remaining rows and write a final report.
+
+        Returns:
+            Dictionary of stats (see `stats`).
+        """
+        self.flush()
+        self._report(True)
+        return self.stats()
+
+    def stats(self):
+        """Summarize the import so far.
+
+        Returns:
+            Dict with "rowsRead", "rowsImported", "rowsFailed",
+            "rowsSkipped", "seconds", and "rowsPerSec".
+        """
+        secs = utils.timer() - self._start if self._start is not None else 0.0
+        return {
+            "rowsRead": self.rowsRead,
+            "rowsImported": self.rowsImported,
+            "rowsFailed": self.rowsFailed,
+            "rowsSkipped": self.rowsSkipped,
+            "seconds": secs,
+            "rowsPerSec": self.rowsImported / secs if secs > 0 else 0.0
+        }
+
+    def _report(self, final):
+        """Write a progress line if one is due (or this is the final one)."""
+        if self._progress is None or self._start is None:
+            return
+        now = utils.timer()
+        if not final and now - self._lastReport < self._reportEvery:
+            return
+        self._lastReport = now
+        s = self.stats()
+        self._progress.write(
+            "{}{} rows imported ({:.0f} rows/s), {} failed, {} skipped, {:.1f}s\n".format(
+                "done: " if final else "", s["rowsImported"], s["rowsPerSec"],
+                s["rowsFailed"], s["rowsSkipped"], s["seconds"]))
+
+
+def formatOf(path, fmt):
+    """Return the input format, guessing it from the file name if not given."""
+    if fmt is not None:
+        return fmt
+    if path.endswith(".jsonl") or path.endswith(".json"):
+        return "jsonl"
+    return "csv"
+
+
+def openInput(path, fmt):
+    """Open an input file for `iterRows`."""
+    return io.open(path, "r", newline="" if fmt == "csv" else None)
+
+
+def _parseMap(pairs):
+    """Turn a list of COLUMN=SERIES strings into a dictionary."""
+    if not pairs:
+        return None
+    ret = {}
+    for pair in pairs:
+        if "=" in pair:
+            col, name = pair.split("=", 1)
+        else:
+            col, name = pair, pair
+        ret[col] = name
+    return ret
+
+
+def makeParser():
+    """Return the argument parser of the command."""
+    parser = argparse.ArgumentParser(
+        prog="iobeam-import", description="Import CSV or JSON Lines files into iobeam.")
+    parser.add_argument("files", nargs="+", help="input files; - for stdin")
+    parser.add_argument("--token", default=os.environ.get(TOKEN_ENV),
+                        help="project token with write access (default: ${})".format(TOKEN_ENV))
+    parser.add_argument("--project", type=int, required=True, help="project ID")
+    device = parser.add_mutually_exclusive_group(required=True)
+    device.add_argument("--device", help="device ID of every row")
+    device.add_argument("--device-column", help="column holding the device ID of a row")
+    parser.add_argument("--time-column", default="time", help="column holding the time")
+    parser.add_argument("--time-unit", default=data.TimeUnit.MILLISECONDS.value,
+                        choices=[u.value for u in data.TimeUnit], help="unit of the times")
+    parser.add_argument("--map", action="append", metavar="COLUMN=SERIES",
+                        help="import COLUMN as SERIES; may repeat (default: all columns)")
+    parser.add_argument("--format", choices=["csv", "jsonl"],
+                        help="input format (default: from the file extension)")
+    parser.add_argument("--chunk-rows", type=int, default=1000, help="max rows per upload")
+    parser.add_argument("--concurrency", type=int, default=4, help="max uploads in flight")
+    parser.add_argument("--max-buffered-rows", type=int, default=100000,
+                        help="max rows held in partly filled chunks; the largest are "
+                        "uploaded early when exceeded")
+    parser.add_argument("--quiet", action="store_true", help="do not report progress")
+    parser.add_argument("--backend", help="base URL of the iobeam API")
+    return parser
+
+
+def makeMapping(args):
+    """Return the ColumnMapping described by parsed arguments."""
+    return ColumnMapping(timeColumn=args.time_column,
+                         timeUnit=data.TimeUnit(args.time_unit),
+                         deviceId=args.device, deviceColumn=args.device_column,
+                         series=_parseMap(args.map))
+
+
+def makeService(args, requester=None):
+    """Return an ImportService for parsed arguments, sized for --concurrency."""
+    if requester is None and args.backend is not None:
+        requester = request.getRequester(url=args.backend)
+    service = imports.ImportService(args.token, requester=requester)
+    if hasattr(service.requester(), "ensurePoolSize"):
+        service.requester().ensurePoolSize(args.concurrency)
+    return service
+
+
+def run(args, requester=None, out=sys.stderr):
+    """Run an import with parsed arguments.
+
+    Params:
+        args - Namespace from `makeParser().parse_args()`
+        requester - Optional requester to use instead of the backend's
+        out - Stream for progress reports
+
+    Returns:
+        Dictionary of import stats.
+    """
+    mapping = makeMapping(args)
+    service = makeService(args, requester)
+    importer = Importer(service, args.project, mapping, chunkRows=args.chunk_rows,
+                        concurrency=args.concurrency,
+                        progress=None if args.quiet else out,
+                        maxBufferedRows=args.max_buffered_rows)
+    for path in args.files:
+        fmt = formatOf(path, args.format)
+        if path == "-":
+            importer.addAll(iterRows(sys.stdin, fmt))
+        else:
+            with openInput(path, fmt) as f:
+                importer.addAll(iterRows(f, fmt))
+    return importer.finish()
+
+
+def main(argv=None):
+    """Entry point of the `iobeam-import` command."""
+    parser = makeParser()
+    args = parser.parse_args(argv)
+    if not args.token:
+        parser.error("a token is required (--token or ${})".format(TOKEN_ENV))
+    try:
+        stats = run(args)
+    except (ValueError, IOError, request.Error, request.UnauthorizedError) as e:
+        sys.stderr.write("iobeam-import: {}\n".format(e))
+        return 1
+    return 0 if stats["rowsFailed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
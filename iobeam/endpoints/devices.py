@@ -2,6 +2,8 @@
 from iobeam.endpoints import service
 from iobeam.http import request
 from iobeam.resources import device
+from iobeam.utils import utils
+from iobeam.workers import pool
 
 
 class DuplicateIdError(request.Error):
@@ -11,6 +13,34 @@ class DuplicateIdError(request.Error):
         request.Error.__init__(self, "Device ID already registered.")
 
 
+class RegistrationResult(object):
+    """Outcome of registering one device as part of a bulk registration."""
+
+    def __init__(self, deviceId, dev=None, existed=False, error=None):
+        """Constructor for a RegistrationResult.
+
+        Params:
+            deviceId - Device ID that was requested
+            dev - Device object if registered (or already existed)
+            existed - True if the ID was already registered and treated as
+                      success
+            error - Exception raised while registering, or None
+        """
+        self.deviceId = deviceId
+        self.device = dev
+        self.existed = existed
+        self.error = error
+
+    def ok(self):
+        """Tells whether the device is registered."""
+        return self.error is None
+
+    def __str__(self):
+        """Prints out: RegistrationResult{id: <id>, existed: <bool>, error: <err>}"""
+        return "RegistrationResult{{id: {}, existed: {}, error: {}}}".format(
+            self.deviceId, self.existed, self.error)
+
+
 class DeviceService(service.EndpointService):
     """Communicates with the backend and exposes available Devices API methods."""
 
@@ -82,3 +112,58 @@ class DeviceService(service.EndpointService):
             self.raiseUnknownCodeError(r)
 
         return ret
+
+    def registerDevices(self, projectId, devices, setOnDupe=False,
+                        maxConcurrency=8):
+        """Registers many devices, several at a time.
+
+        Each device is registered with its own `POST /devices` call, with at
+        most `maxConcurrency` calls in flight. A failure for one device does
+        not stop the others.
+
+        Params:
+            projectId - Project ID to register devices in
+            devices - List of (deviceId, deviceName) pairs; deviceName may be
+                      None, and plain device ID strings are also accepted.
+            setOnDupe - If True, a device ID that is already registered is
+                        treated as success ("existed") instead of an error.
+            maxConcurrency - Max number of registrations in flight
+
+        Returns:
+            List of RegistrationResult, in the same order as `devices`.
+        """
+        utils.checkValidProjectId(projectId)
+        if not self.token:
+            raise request.UnauthorizedError.noTokenSet()
+        if hasattr(self.requester(), "ensurePoolSize"):
+            self.requester().ensurePoolSize(maxConcurrency)
+
+        def makeTask(deviceId, deviceName):
+            """Bind the arguments of one registration."""
+            def task():
+                utils.checkValidDeviceId(deviceId)
+                try:
+                    dev = self.registerDevice(projectId, deviceId=deviceId,
+                                              deviceName=deviceName)
+                    return RegistrationResult(deviceId, dev=dev)
+                except DuplicateIdError:
+                    if not setOnDupe:
+                        raise
+                    dev = device.Device(projectId, deviceId, deviceName=deviceName)
+                    return RegistrationResult(deviceId, dev=dev, existed=True)
+            return task
+
+        pairs = []
+        for d in devices:
+            if isinstance(d, (tuple, list)):
+                pairs.append((d[0], d[1] if len(d) > 1 else None))
+            else:
+                pairs.append((d, None))
+
+        tasks = [makeTask(did, dname) for did, dname in pairs]
+        ret = []
+        for (did, _), (result, err) in zip(pairs, pool.runAll(tasks, maxConcurrency)):
+            if err is not None:
+                result = RegistrationResult(did, error=err)
+            ret.append(result)
+        return ret
@@ -1,19 +1,56 @@
 """Used to communicate with iobeam's Exports API"""
+from time import time
+
 from iobeam.endpoints import service
 from iobeam.http import request
+from iobeam.resources import columns
+from iobeam.resources import data
+from iobeam.resources import results
+from iobeam.resources import watermark
+from iobeam.utils import utils
+from iobeam.workers import pool
 
 
 class ExportService(service.EndpointService):
     """Communicates with the backend and exposes available Exports API methods."""
 
-    def __init__(self, token, requester=None):
+    def __init__(self, token, requester=None, cache=None, rangeCache=None):
+        """Constructor for an ExportService.
+
+        Params:
+            token - Token with read access to the queried projects
+            requester - Requester to make HTTP requests with
+            cache - Optional cache (e.g., utils.cache.LRUCache) of results
+                    from `getData`; it may be shared by services with
+                    different tokens, as entries are keyed by token
+            rangeCache - Optional utils.rangecache.RangeCache; `getData` then
+                         only requests time ranges it does not hold
+        """
         service.EndpointService.__init__(self, token, requester=requester)
+        self._cache = cache
+        self._rangeCache = rangeCache
+
+    def _makeRequest(self, query):
+        """Create the request for a query."""
+        endpoint = self.makeEndpoint("exports/{}".format(query.getUrl()))
+
+        r = self.requester().get(endpoint).token(self.token)
+        params = query.getParams()
+        for p in params:
+            r.setParam(p, params[p])
+        return r
 
     def getData(self, query):
         """Wraps API call `POST /exports`
 
         Queries data from the iobeam backend.
 
+        If this service has a cache, results of an identical query (same
+        backend, token, target, and parameters) are returned from it while
+        fresh; successful results are added to it. With a range cache, only the
+        parts of the query's time range not on disk are requested, and
+        failed requests raise UnknownCodeError.
+
         Params:
             query - A iobeam.resources.Query object that contains the parameters
                     for the query.
@@ -28,13 +65,419 @@ class ExportService(service.EndpointService):
             raise request.UnauthorizedError.noTokenSet()
         if query is None:
             raise Exception("query cannot be None")
+        return self._getData(query, False)
 
-        endpoint = self.makeEndpoint("exports/{}".format(query.getUrl()))
+    def _getData(self, query, strict):
+        """Run a query through this service's caches.
 
-        r = self.requester().get(endpoint).token(self.token)
-        params = query.getParams()
-        for p in params:
-            r.setParam(p, params[p])
+        Params:
+            query - Query to run
+            strict - If True, raise UnknownCodeError if the request fails
+                     instead of returning the error response
+        """
+        key = None
+        if self._cache is not None:
+            key = (self.makeEndpoint("exports"), utils.tokenHash(self.token),
+                   query.cacheKey())
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+
+        if self._rangeCache is not None:
+            resp = self._rangeCache.getData(query, self.token, self._fetch)
+            if key is not None:
+                self._cache.put(key, resp)
+            return resp
+
+        r = self._makeRequest(query)
         r.execute()
 
+        if r.getResponseCode() != 200:
+            if strict:
+                raise request.UnknownCodeError(r)
+        elif key is not None:
+            self._cache.put(key, r.getResponse())
+        return r.getResponse()
+
+    def getColumns(self, query, useNumpy=None):
+        """Run a query and decode its results into columns.
+
+        Times are normalized to the query's TimeUnit. See
+        `columns.decodeColumns`.
+
+        Params:
+            query - A iobeam.resources.Query
+            useNumpy - True for NumPy arrays, False for `array.array`s, or
+                       None to use NumPy when it is installed
+
+        Returns:
+            List of columns.SeriesColumns, one per series in the results.
+
+        Raises:
+            ValueError - If `query` is None, or useNumpy is True without NumPy.
+            request.UnknownCodeError - If the request fails.
+        """
+        if not self.token:
+            raise request.UnauthorizedError.noTokenSet()
+        if query is None:
+            raise ValueError("query cannot be None")
+        if useNumpy and not columns.hasNumpy():
+            raise ValueError("numpy is not installed")
+        resp = self._getData(query, True)
+        return columns.decodeColumns(resp, timeUnit=query.getTimeUnit(), useNumpy=useNumpy)
+
+    def getDataMany(self, queries, maxConcurrency=8, raiseOnError=True):
+        """Run many queries concurrently.
+
+        Queries share this service's connection pool, which is grown to fit
+        `maxConcurrency` requests at once. Unlike `getData`, a response with
+        an unexpected status code counts as a failed query.
+
+        Params:
+            queries - List of iobeam.resources.Query objects
+            maxConcurrency - Max number of queries in flight
+            raiseOnError - If True, raise the first error after all queries
+                           finish; otherwise failed queries map to the
+                           exception they raised (request.UnknownCodeError
+                           for an unexpected status code).
+
+        Returns:
+            Dictionary mapping each Query object to its results (as returned
+            by `getData`).
+
+        Raises:
+            ValueError - If queries contains None.
+            Exception - The first error of any query, if raiseOnError.
+        """
+        if not self.token:
+            raise request.UnauthorizedError.noTokenSet()
+        queries = list(queries)
+        if any(q is None for q in queries):
+            raise ValueError("queries cannot contain None")
+        if len(queries) == 0:
+            return {}
+        if hasattr(self.requester(), "ensurePoolSize"):
+            self.requester().ensurePoolSize(maxConcurrency)
+
+        def makeTask(query):
+            """Bind the query of a task."""
+            return lambda: self._getData(query, True)
+
+        done = pool.runAll([makeTask(q) for q in queries], maxConcurrency)
+        ret = {}
+        for q, (result, err) in zip(queries, done):
+            if err is not None:
+                if raiseOnError:
+                    raise err
+                result = err
+            ret[q] = result
+        return ret
+
+    def getDataSplit(self, query, parts=None, window=None, maxConcurrency=8):
+        """Run a query with a large time range as concurrent sub-range queries.
+
+        The query's range is split into `parts` equal sub-ranges, or into
+        sub-ranges `window` long (in the query's TimeUnit). They are fetched
+        concurrently and merged into one result with each series in time
+        order, as if the query had been run at once. With a `limit`, each
+        sub-range is limited too and only the first `limit` points of each
+        series are kept.
+
+        Params:
+            query - A iobeam.resources.Query with a from time (the to time
+                    defaults to now)
+            parts - Number of sub-ranges to split the range into
+            window - Length of each sub-range, instead of `parts`
+            maxConcurrency - Max number of sub-range queries in flight
+
+        Returns:
+            A dictionary representing the query results.
+
+        Raises:
+            ValueError - If the query has no from time, or not exactly one
+                         of parts and window is a positive int.
+            request.UnknownCodeError - If any sub-range request fails.
+        """
+        if not self.token:
+            raise request.UnauthorizedError.noTokenSet()
+        if query is None:
+            raise ValueError("query cannot be None")
+        if (parts is None) == (window is None):
+            raise ValueError("exactly one of parts and window must be given")
+        for val, name in ((parts, "parts"), (window, "window")):
+            if val is not None and (not isinstance(val, int) or val <= 0):
+                raise ValueError("{} must be a positive int".format(name))
+        if query.getMillisRange()[0] is None:
+            raise ValueError("query must have a from time")
+
+        if window is not None:
+            subs = list(ExportService._windows(query, window))
+        else:
+            subs = ExportService._split(query, parts)
+        if hasattr(self.requester(), "ensurePoolSize"):
+            self.requester().ensurePoolSize(maxConcurrency)
+
+        def makeTask(sub):
+            """Bind the query of a task."""
+            return lambda: self._getData(sub, True)
+
+        done = pool.runAll([makeTask(q) for q in subs], maxConcurrency)
+        for _, err in done:
+            if err is not None:
+                raise err
+        return ExportService._merge([resp for resp, _ in done], query.getLimit())
+
+    @staticmethod
+    def _split(query, parts):
+        """Split a query's time range into at most `parts` equal sub-ranges."""
+        start, end = query.getMillisRange()
+        if end is None:
+            end = int(time() * 1000)
+        span = end - start + 1
+        step = max(1, -(-span // parts))  # ceiling division
+        subs = []
+        while start <= end:
+            subs.append(query.withMillisRange(start, min(start + step - 1, end)))
+            start += step
+        return subs
+
+    @staticmethod
+    def _merge(responses, limit):
+        """Merge results of consecutive sub-ranges, keeping time order."""
+        merged = {}
+        order = []
+        template = None
+        for resp in responses:
+            if resp is None:
+                continue
+            template = template or resp
+            for did, name, pts in results.iterSeries(resp):
+                key = (did, name)
+                if key not in merged:
+                    merged[key] = []
+                    order.append(key)
+                merged[key].extend(pts)
+        series = []
+        for did, name in order:
+            pts = sorted(merged[(did, name)], key=lambda p: p["time"])
+            if limit is not None:
+                pts = pts[:limit]
+            series.append((did, name, pts))
+        devices = []
+        for resp in responses:
+            devices.extend((resp or {}).get("result") or [])
+        return results.makeResponse(dict(template or {}, result=devices), series)
+
+    def _fetch(self, query):
+        """Run a query, raising if the backend does not return results."""
+        r = self._makeRequest(query)
+        r.execute()
+        if r.getResponseCode() != 200:
+            raise request.UnknownCodeError(r)
         return r.getResponse()
+
+    def iterData(self, query, pageSize=None, window=None):
+        """Run a query in pieces, yielding results as they arrive.
+
+        The query's time range is walked in windows of `window` (in the
+        query's TimeUnit), and each window is fetched in pages of at most
+        `pageSize` points per series; the next page starts where the last
+        full page ended. Only one page is held at a time, so large exports
+        can be processed in constant memory.
+
+        A `limit` set on the query caps the total points yielded per series.
+
+        Params:
+            query - A iobeam.resources.Query; with `window`, it must have a
+                    from time (the to time defaults to now)
+            pageSize - Max points per series in each request; None to fetch
+                       each window in one request
+            window - Length of the time windows; None for a single window
+
+        Returns:
+            Generator of response dictionaries, in the same format as
+            `getData`, without points already yielded. Empty pages are
+            skipped.
+
+        Raises:
+            ValueError - If pageSize or window are not positive ints, or
+                         window is given without a from time.
+            request.UnknownCodeError - If a request fails.
+        """
+        if not self.token:
+            raise request.UnauthorizedError.noTokenSet()
+        if query is None:
+            raise ValueError("query cannot be None")
+        for val, name in ((pageSize, "pageSize"), (window, "window")):
+            if val is not None and (not isinstance(val, int) or val <= 0):
+                raise ValueError("{} must be a positive int".format(name))
+        if window is not None and query.getMillisRange()[0] is None:
+            raise ValueError("window requires a query with a from time")
+
+        return self._iterData(query, pageSize, window)
+
+    def _iterData(self, query, pageSize, window):
+        """Generator behind `iterData`; arguments are already validated."""
+        counts = {}
+        if window is None:
+            windows = [query]
+        else:
+            windows = ExportService._windows(query, window)
+        for q in windows:
+            for page in self._iterPages(q, pageSize, counts):
+                yield page
+
+    # pylint: disable=too-many-arguments
+    def exportTo(self, query, sink, checkpoint=None, pageSize=10000, window=None):
+        """Stream the results of a query into a sink.
+
+        Results are fetched in pages (see `iterData`) and written to the
+        sink as they arrive, so memory use is bounded by the page and the
+        sink's buffer. With a checkpoint, progress is saved whenever the
+        sink writes out its buffer; if a checkpoint exists when the export
+        starts, the sink is truncated to the saved position and the export
+        continues after the last points saved.
+
+        Params:
+            query - A iobeam.resources.Query
+            sink - sinks.Sink to write to (opened with append when resuming)
+            checkpoint - Optional sinks.Checkpoint; cleared when the export
+                         completes
+            pageSize - Max points per series in each request
+            window - Length of the time windows to fetch, as in `iterData`
+
+        Returns:
+            Number of rows written by this call.
+
+        Raises:
+            ValueError - If the query is None or paging arguments are invalid.
+            request.UnknownCodeError - If a request fails.
+        """
+        if query is None:
+            raise ValueError("query cannot be None")
+        mark = watermark.Watermark(timeUnit=query.getTimeUnit())
+        saved = checkpoint.load() if checkpoint is not None else None
+        if saved is not None:
+            position, marks = saved
+            sink.truncate(position)
+            for did, name, t in marks:
+                mark.set(did, name, t)
+            utils.getLogger().info("resuming export at position %s", position)
+
+        start = sink.rowsWritten + sink.pending()
+        flushed = sink.rowsWritten
+        for q in mark.applyEach(query):
+            for page in self.iterData(q, pageSize=pageSize, window=window):
+                sink.writeResponse(mark.advance(page))
+                if checkpoint is not None and sink.rowsWritten != flushed:
+                    # only rows up to the sink's last flush are on disk
+                    sink.flush()
+                    flushed = sink.rowsWritten
+                    checkpoint.save(sink.tell(), mark.marks())
+        sink.flush()
+        if checkpoint is not None:
+            checkpoint.clear()
+        return sink.rowsWritten + sink.pending() - start
+    # pylint: enable=too-many-arguments
+
+    @staticmethod
+    def _windows(query, window):
+        """Split a query's time range into consecutive windows."""
+        start, end = query.getMillisRange()
+        if end is None:
+            end = int(time() * 1000)
+        step = max(1, data.Timestamp(window, unit=query.getTimeUnit()).asMilliseconds())
+        while start <= end:
+            yield query.withMillisRange(start, min(start + step - 1, end))
+            start += step
+
+    def _iterPages(self, query, pageSize, counts):
+        """Fetch one window in pages of `pageSize` points per series.
+
+        A full page resumes at the msec of its last point, since more points
+        may share it, and the points already yielded there are skipped. The
+        next page asks for that many more points, so it always gets past
+        them.
+
+        Params:
+            query - Query for the window
+            pageSize - Max points per series per request, or None
+            counts - Points yielded so far per (device, series), shared
+                     across windows to apply the query's limit
+        """
+        limit = query.getLimit()
+        unit = query.getTimeUnit()
+        end = query.getMillisRange()[1]
+        last = {}  # (device, series) -> time of the last point yielded
+        atLast = {}  # (device, series) -> points yielded at exactly that time
+        inLastMs = {}  # (device, series) -> points yielded in that msec
+        q = query if pageSize is None else query.copy().limit(pageSize)
+        while True:
+            resp = self._fetch(q)
+            series = []
+            resume = None
+            overlap = 0
+            for did, name, pts in results.iterSeries(resp):
+                key = (did, name)
+                new = ExportService._unseen(pts, last.get(key), atLast.get(key, 0))
+                if limit is not None:
+                    new = new[:max(0, limit - counts.get(key, 0))]
+                if len(new) > 0:
+                    series.append((did, name, new))
+                    counts[key] = counts.get(key, 0) + len(new)
+                    self._markLast(key, new, unit, (last, atLast, inLastMs))
+
+                capped = limit is not None and counts.get(key, 0) >= limit
+                if pageSize is not None and key in last and len(pts) >= q.getLimit() \
+                        and not capped:
+                    lastMs = data.Timestamp(last[key], unit=unit).asMilliseconds()
+                    resume = lastMs if resume is None else min(resume, lastMs)
+                    overlap = max(overlap, inLastMs[key])
+
+            if len(series) > 0:
+                yield results.makeResponse(resp, series)
+            if resume is None:
+                return
+            utils.getLogger().debug("export page full; resuming at %s", resume)
+            q = q.withMillisRange(resume, end).limit(pageSize + overlap)
+
+    @staticmethod
+    def _markLast(key, new, unit, marks):
+        """Record the last point yielded for a series and how many share it.
+
+        Params:
+            key - (device, series) of the points
+            new - Points just yielded
+            unit - TimeUnit of the point times
+            marks - Tuple of the dictionaries of last time, points at that
+                    time, and points in that msec, updated in place
+        """
+        last, atLast, inLastMs = marks
+        toMs = lambda t: data.Timestamp(t, unit=unit).asMilliseconds()
+        newLast = max(p["time"] for p in new)
+        newMs = toMs(newLast)
+        sameTime = len([p for p in new if p["time"] == newLast])
+        sameMs = len([p for p in new if toMs(p["time"]) == newMs])
+        if key in last and last[key] == newLast:
+            sameTime += atLast[key]
+        if key in last and toMs(last[key]) == newMs:
+            sameMs += inLastMs[key]
+        last[key] = newLast
+        atLast[key] = sameTime
+        inLastMs[key] = sameMs
+
+    @staticmethod
+    def _unseen(points, last, atLast):
+        """Return the points after the first `atLast` at time `last`."""
+        if last is None:
+            return list(points)
+        ret = []
+        skip = atLast
+        for p in points:
+            if p["time"] < last:
+                continue
+            if p["time"] == last and skip > 0:
+                skip -= 1
+                continue
+            ret.append(p)
+        return ret
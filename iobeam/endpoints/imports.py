@@ -4,6 +4,63 @@ from iobeam.http import request
 from iobeam.utils import utils
 
 
+class ImportResult(tuple):
+    """Result of an import, which may only have been partially accepted.
+
+    Unpacks like the `(success, extra)` tuple returned by earlier versions.
+    Imports stop at the first chunk that fails, so the accepted data is
+    always a prefix of what was given; `remaining` holds the rest, ready to
+    be sent again without duplicating what the server already has.
+
+    Attributes:
+        success - True if every chunk was accepted
+        extra - Error response from the server, or None if successful
+        ackedChunks - Number of chunks (requests) accepted by the server
+        totalChunks - Number of chunks the import was split into
+        acked - Number of rows (`importBatch`) or points (`importData`)
+                accepted by the server
+        remaining - Data not yet accepted, in the same form as given: a
+                    DataStore for `importBatch`, or a dict of series names
+                    to lists of DataPoints for `importData`. None if
+                    successful.
+        status - HTTP status code of the failed request, or None
+    """
+
+    # pylint: disable=too-many-arguments
+    def __new__(cls, success, extra, ackedChunks=0, totalChunks=0, acked=0,
+                remaining=None, status=None):
+        ret = tuple.__new__(cls, (success, extra))
+        ret.success = success
+        ret.extra = extra
+        ret.ackedChunks = ackedChunks
+        ret.totalChunks = totalChunks
+        ret.acked = acked
+        ret.remaining = remaining
+        ret.status = status
+        return ret
+    # pylint: enable=too-many-arguments
+
+    def isPartial(self):
+        """Tells whether some, but not all, chunks were accepted."""
+        return not self.success and self.ackedChunks > 0
+
+
+class PartialImportError(request.Error):
+    """Error raised when a request fails after earlier chunks were accepted.
+
+    Attributes:
+        result - ImportResult describing what was accepted and what remains
+        cause - The exception raised by the failing request
+    """
+
+    def __init__(self, result, cause):
+        request.Error.__init__(
+            self, "import failed after {} of {} chunks: {}".format(
+                result.ackedChunks, result.totalChunks, cause))
+        self.result = result
+        self.cause = cause
+
+
 class ImportService(service.EndpointService):
     """Communicates with the backend and exposes available Imports API methods."""
 
@@ -74,34 +131,24 @@ class ImportService(service.EndpointService):
         return req
 
     @staticmethod
-    def _makeListOfReqs(projectId, deviceId, dataset):
-        """Creates a list of import requests from a data set.
-
-        If the data set is under _BATCH_SIZE, it will be one request. Otherwise
-        it will be split into multiple requests as follows:
-        (1) if a single series has less than ImportService._BATCH_SIZE points,
-            it will be a request.
-        (2) if a single series has more, it will be broken into multiple requests of
-            ImportService._BATCH_SIZE size.
+    def _splitDataset(dataset):
+        """Splits a data set into the chunks sent by `_makeListOfReqs`.
 
         Params:
-            projectId - Project ID of the requests
-            deviceId - Device ID of the requests
-            dataset - The data set that will be broken into requests.
+            dataset - The data set to split, a map of names to DataPoints
 
         Returns:
-            A list of import request bodies.
+            A list of data sets, one per import request.
         """
         totalLen = sum(len(dataset[k]) for k in dataset)
 
-        reqs = []
+        chunks = []
         # No series, no requests
         if totalLen == 0:
             pass
         # Everything can fit in one request
         elif totalLen <= ImportService._BATCH_SIZE:
-            reqs.append(
-                ImportService._makeRequest(projectId, deviceId, dataset))
+            chunks.append(dataset)
         # Need to create multiple requests
         else:
             for series in dataset:
@@ -110,8 +157,7 @@ class ImportService(service.EndpointService):
                 if seriesLen <= ImportService._BATCH_SIZE:
                     temp = {}
                     temp[series] = dataset[series]
-                    reqs.append(
-                        ImportService._makeRequest(projectId, deviceId, temp))
+                    chunks.append(temp)
                 # Split series into chunks of up to _BATCH_SIZE
                 else:
                     idx = 0
@@ -121,11 +167,32 @@ class ImportService(service.EndpointService):
                         vals = valsList[idx:end]
                         temp = {}
                         temp[series] = vals
-                        reqs.append(ImportService._makeRequest(
-                            projectId, deviceId, temp))
+                        chunks.append(temp)
                         idx += ImportService._BATCH_SIZE
 
-        return reqs
+        return chunks
+
+    @staticmethod
+    def _makeListOfReqs(projectId, deviceId, dataset):
+        """Creates a list of import requests from a data set.
+
+        If the data set is under _BATCH_SIZE, it will be one request. Otherwise
+        it will be split into multiple requests as follows:
+        (1) if a single series has less than ImportService._BATCH_SIZE points,
+            it will be a request.
+        (2) if a single series has more, it will be broken into multiple requests of
+            ImportService._BATCH_SIZE size.
+
+        Params:
+            projectId - Project ID of the requests
+            deviceId - Device ID of the requests
+            dataset - The data set that will be broken into requests.
+
+        Returns:
+            A list of import request bodies.
+        """
+        return [ImportService._makeRequest(projectId, deviceId, chunk)
+                for chunk in ImportService._splitDataset(dataset)]
 
     @staticmethod
     def _makeListOfBatchReqs(projectId, deviceId, dataBatch):
@@ -174,12 +241,16 @@ class ImportService(service.EndpointService):
             `iobeam.iobeam.DataPoint`s.
 
         Returns:
-            A tuple where the first item is the success of all of the requests (True if
-            all succeed, False otherwise); the second item is any error message or None
-            if successful.
+            An ImportResult, which unpacks as a tuple where the first item is
+            the success of all of the requests (True if all succeed, False
+            otherwise) and the second is any error message or None if
+            successful. Requests stop at the first failure; the points not
+            sent are in the result's `remaining`.
 
         Raises:
             Exception - If any of projectId, deviceId, or dataSeries is None.
+            PartialImportError - If a request raises after earlier requests
+                                 were accepted.
         """
         if not self.token:
             raise request.UnauthorizedError.noTokenSet()
@@ -190,21 +261,52 @@ class ImportService(service.EndpointService):
         elif dataSeries is None:
             raise Exception("Dataset cannot be None")
         elif len(dataSeries) == 0:
-            return (True, None)
+            return ImportResult(True, None)
         endpoint = self.makeEndpoint("imports")
 
-        reqs = ImportService._makeListOfReqs(projectId, deviceId, dataSeries)
-        success = True
-        extra = None
-        for req in reqs:
+        start = utils.timer() if self._hooks else None
+        chunks = ImportService._splitDataset(dataSeries)
+        reqs = [ImportService._makeRequest(projectId, deviceId, c) for c in chunks]
+        if start is not None:
+            utils.emitSpan(self._hooks, "imports.build", start,
+                           {"chunks": len(reqs)})
+
+        def _result(i, extra, status=None):
+            """Make the result when request `i` failed (or all succeeded)."""
+            acked = 0
+            for req in reqs[:i]:
+                acked += sum(len(src["data"]) for src in req["sources"])
+            remaining = None
+            if i < len(reqs):
+                remaining = {}
+                for chunk in chunks[i:]:
+                    for series in chunk:
+                        remaining.setdefault(series, []).extend(chunk[series])
+            return ImportResult(i == len(reqs), extra, ackedChunks=i,
+                                totalChunks=len(reqs), acked=acked,
+                                remaining=remaining, status=status)
+
+        for i, req in enumerate(reqs):
+            start = utils.timer() if self._hooks else None
             r = self.requester().post(endpoint).token(self.token)
             r.setBody(req)
-            r.execute()
-            success = success and (r.getResponseCode() == 200)
+            try:
+                r.execute()
+            except Exception as e:
+                if i == 0:
+                    raise
+                raise PartialImportError(_result(i, None), e)
+            if start is not None:
+                utils.emitSpan(self._hooks, "imports.chunk", start, {
+                    "index": i,
+                    "chunks": len(reqs),
+                    "points": sum(len(src["data"]) for src in req["sources"]),
+                    "status": r.getResponseCode()
+                })
             if r.getResponseCode() != 200:
-                extra = r.getResponse()
+                return _result(i, r.getResponse(), status=r.getResponseCode())
 
-        return (success, extra)
+        return _result(len(reqs), None)
 
     def importBatch(self, projectId, deviceId, dataStore):
         """Wraps API call `POST /imports?fmt=table`
@@ -217,31 +319,61 @@ class ImportService(service.EndpointService):
             dataStore - A `DataStore` object containing the the data to be imported
 
         Returns:
-            A tuple where the first item is the success of all of the requests (True if
-            all succeed, False otherwise); the second item is any error message or None
-            if successful.
+            An ImportResult, which unpacks as a tuple where the first item is
+            the success of all of the requests (True if all succeed, False
+            otherwise) and the second is any error message or None if
+            successful. Requests stop at the first failure; the rows not
+            sent are in the result's `remaining` DataStore.
 
         Raises:
             ValueError - If validity checks fail for the token, project id, or device id.
+            PartialImportError - If a request raises after earlier requests
+                                 were accepted.
         """
         utils.checkValidProjectId(projectId)
         utils.checkValidProjectToken(self.token)
         utils.checkValidDeviceId(deviceId)
         if dataStore is None or len(dataStore) == 0:
             utils.getLogger().warning("Attempted to send with no data")
-            return (True, None)
+            return ImportResult(True, None)
         endpoint = self.makeEndpoint("imports")
 
+        start = utils.timer() if self._hooks else None
         reqs = ImportService._makeListOfBatchReqs(projectId, deviceId, dataStore)
-        success = True
-        extra = None
-        for req in reqs:
+        if start is not None:
+            utils.emitSpan(self._hooks, "imports.build", start,
+                           {"chunks": len(reqs), "points": len(dataStore)})
+
+        def _result(i, extra, status=None):
+            """Make the result when request `i` failed (or all succeeded)."""
+            acked = sum(len(req["sources"]["data"]) for req in reqs[:i])
+            remaining = None
+            if i < len(reqs):
+                remaining = dataStore.slice(acked)
+            return ImportResult(i == len(reqs), extra, ackedChunks=i,
+                                totalChunks=len(reqs), acked=acked,
+                                remaining=remaining, status=status)
+
+        for i, req in enumerate(reqs):
+            start = utils.timer() if self._hooks else None
             r = self.requester().post(endpoint).token(self.token) \
                 .setParam("fmt", "table") \
                 .setBody(req)
-            r.execute()
-            success = success and (r.getResponseCode() == 200)
+            try:
+                r.execute()
+            except Exception as e:
+                if i == 0:
+                    raise
+                raise PartialImportError(_result(i, None), e)
+            if start is not None:
+                rows = req["sources"]["data"]
+                utils.emitSpan(self._hooks, "imports.chunk", start, {
+                    "index": i,
+                    "chunks": len(reqs),
+                    "rows": len(rows),
+                    "status": r.getResponseCode()
+                })
             if r.getResponseCode() != 200:
-                extra = r.getResponse()
+                return _result(i, r.getResponse(), status=r.getResponseCode())
 
-        return (success, extra)
+        return _result(len(reqs), None)
@@ -10,11 +10,26 @@ class EndpointService(object):
             self._requester = request.getRequester()
         else:
             self._requester = requester
+        self._hooks = []
 
     def requester(self):
         """Return this service's HTTP requester object"""
         return self._requester
 
+    def addHook(self, hook):
+        """Register a hook to receive this service's timing spans.
+
+        Hooks are called as `hook(name, seconds, info)`. Spans for the
+        underlying HTTP requests are reported by hooks on the requester.
+        """
+        if hook not in self._hooks:
+            self._hooks.append(hook)
+
+    def removeHook(self, hook):
+        """Unregister a hook previously added with `addHook`."""
+        if hook in self._hooks:
+            self._hooks.remove(hook)
+
     def makeEndpoint(self, endpoint):
         """Create a string of the full API endpoint"""
         return self._requester.makeEndpoint(endpoint)
@@ -0,0 +1,281 @@
+"""Client for gateways that send data on behalf of many devices."""
+import threading
+
+from . import base
+from .endpoints import devices
+from .endpoints import imports
+from .resources import data
+from .resources import device
+from .utils import registry
+from .utils import utils
+from .workers import pool
+
+
+class GatewayClient(base.BaseClient):
+    """Client that sends data for many devices under one project token.
+
+    All devices share the client's token, services, HTTP connection pool,
+    and background sender. On `send()`, devices are sent concurrently (up to
+    `maxConcurrency` at a time), and a device's small stores are merged so
+    they go out in a single request.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, projectId, projectToken, backend, maxConcurrency=8,
+                 path=None):
+        """Constructor for a gateway client.
+
+        Params:
+            projectId - iobeam project ID
+            projectToken - iobeam project token with write access for sending data
+            backend - Requester to use; if None, requests go to
+                      https://api.iobeam.com/v1/
+            maxConcurrency - Max number of devices to send at once
+            path - Directory for the on-disk device registry; if None,
+                   registrations are not remembered across restarts
+
+        Raises:
+            ValueError - If projectId or projectToken are invalid, or
+                         maxConcurrency is not a positive int.
+        """
+        base.BaseClient.__init__(self, projectId, projectToken, backend)
+        if not isinstance(maxConcurrency, int) or maxConcurrency < 1:
+            raise ValueError("maxConcurrency must be a positive int")
+
+        self._maxConcurrency = maxConcurrency
+        self._stores = {}
+        self._storesLock = threading.Lock()
+        self._registry = registry.DeviceRegistry(path) if path is not None else None
+
+        requester = self._importService.requester()
+        if hasattr(requester, "ensurePoolSize"):
+            requester.ensurePoolSize(maxConcurrency)
+
+        self._checkToken()
+    # pylint: enable=too-many-arguments
+
+    def registerDevice(self, deviceId, deviceName=None, setOnDupe=True):
+        """Registers a device with iobeam.
+
+        Params:
+            deviceId - Device ID to register
+            deviceName - Desired device name; otherwise randomly generated
+            setOnDupe - If the device ID is already registered, treat it as
+                        registered rather than raising an error; default True.
+
+        Devices in the on-disk registry are returned without contacting
+        iobeam.
+
+        Returns:
+            Device object for the registered device.
+
+        Raises:
+            devices.DuplicateIdError - If id is a duplicate and `setOnDupe` is
+                                       False.
+        """
+        utils.checkValidDeviceId(deviceId)
+        if self._registry is not None:
+            known = self._registry.get(self.projectId, deviceId)
+            if known is not None:
+                return known
+
+        self._checkToken()
+        try:
+            dev = self._deviceService.registerDevice(self.projectId,
+                                                     deviceId=deviceId,
+                                                     deviceName=deviceName)
+        except devices.DuplicateIdError:
+            if not setOnDupe:
+                raise
+            dev = device.Device(self.projectId, deviceId, deviceName=deviceName)
+        if self._registry is not None:
+            self._registry.add(dev)
+        return dev
+
+    def registerDevices(self, deviceList, setOnDupe=True, maxConcurrency=None):
+        """Registers many devices with iobeam, several at a time.
+
+        Params:
+            deviceList - List of (deviceId, deviceName) pairs; deviceName may
+                         be None, and plain device ID strings are also accepted.
+            setOnDupe - If True (default), already registered IDs count as
+                        registered rather than errors.
+            maxConcurrency - Max registrations in flight; defaults to this
+                             client's maxConcurrency.
+
+        Devices in the on-disk registry are reported as existing without
+        contacting iobeam, and newly registered ones are added to it.
+
+        Returns:
+            List of devices.RegistrationResult, in the same order as
+            `deviceList`.
+        """
+        if maxConcurrency is None:
+            maxConcurrency = self._maxConcurrency
+        results = [None] * len(deviceList)
+        pending = []
+        for i, dev in enumerate(deviceList):
+            did = dev[0] if isinstance(dev, (tuple, list)) else dev
+            known = None
+            if self._registry is not None:
+                known = self._registry.get(self.projectId, did)
+            if known is not None:
+                results[i] = devices.RegistrationResult(did, dev=known, existed=True)
+            else:
+                pending.append(i)
+        if len(pending) == 0:
+            return results
+
+        self._checkToken()
+        registered = self._deviceService.registerDevices(
+            self.projectId, [deviceList[i] for i in pending], setOnDupe=setOnDupe,
+            maxConcurrency=maxConcurrency)
+        for i, result in zip(pending, registered):
+            results[i] = result
+        if self._registry is not None:
+            self._registry.addAll(r.device for r in registered if r.ok())
+        return results
+
+    def devices(self):
+        """Return the IDs of devices that have stores in this client."""
+        with self._storesLock:
+            return list(self._stores)
+
+    def createDataStore(self, deviceId, columns, concurrent=False,
+                        priority=data.Priority.NORMAL):
+        """Create a DataStore for a device that is tracked by this client.
+
+        Params:
+            deviceId - Device the data in the store belongs to
+            columns - List of stream names for the DataStore
+            concurrent - If True, create a ConcurrentDataStore
+            priority - Priority of the store's data; devices with HIGH
+                       priority data are sent first, and a device's stores
+                       are sent in priority order.
+
+        Returns:
+            DataStore object with those columns, tracked by this client for
+            sending as `deviceId`. An existing store is returned if the device
+            already has one with the same columns.
+        """
+        utils.checkValidDeviceId(deviceId)
+        with self._storesLock:
+            stores = self._stores.setdefault(deviceId, [])
+            for store in stores:
+                isConcurrent = isinstance(store, data.ConcurrentDataStore)
+                if store.hasSameColumns(columns) and isConcurrent == concurrent \
+                        and store.priority() == priority:
+                    return store
+
+            if concurrent:
+                ds = data.ConcurrentDataStore(columns, priority=priority)
+            else:
+                ds = data.DataStore(columns, priority=priority)
+            stores.append(ds)
+        self._trackStore(ds)
+        return ds
+
+    def addDataStore(self, deviceId, store):
+        """Add a DataStore for a device to this client.
+
+        Params:
+            deviceId - Device the data in the store belongs to
+            store - The DataStore to add
+
+        Raises:
+            ValueError - If deviceId is invalid or store is not a DataStore.
+        """
+        utils.checkValidDeviceId(deviceId)
+        if not isinstance(store, data.DataStore):
+            raise ValueError("store must be a DataStore")
+        with self._storesLock:
+            self._stores.setdefault(deviceId, []).append(store)
+        self._trackStore(store)
+
+    def removeDevice(self, deviceId):
+        """Stop tracking a device's stores.
+
+        Returns:
+            List of the device's DataStores, which may still hold unsent data.
+            They no longer count against the client's buffer budget.
+        """
+        with self._storesLock:
+            removed = self._stores.pop(deviceId, [])
+        if self._budget is not None:
+            for store in removed:
+                self._budget.untrack(store)
+        return removed
+
+    def _pendingStats(self):
+        """Summarize data waiting to be sent across all devices."""
+        rows = 0
+        size = 0
+        oldest = None
+        for store in self._allStores():
+            spilled, spilledAdded = store.spilled()
+            rows += store.numRows() + spilled
+            size += store.estimatedSize() + spilled * store._rowBytes()  # pylint: disable=protected-access
+            for added in (store.firstAddedTime(), spilledAdded):
+                if added is not None and (oldest is None or added < oldest):
+                    oldest = added
+        return (rows, size, oldest)
+
+    def _allStores(self):
+        """Return the DataStores of every device."""
+        with self._storesLock:
+            return [s for did in self._stores for s in self._stores[did]]
+
+    def _sendDevice(self, deviceId, stores):
+        """Send the stores of one device, restoring anything not accepted."""
+        snapshots = []
+        for store in sorted(stores, key=lambda s: s.priority().value):
+            snap = store.swap()
+            if snap.numRows() > 0:
+                snapshots.append((store, snap))
+        if len(snapshots) == 0:
+            return
+
+        def restoreAll(pending):
+            """Make a callback that puts unsent snapshots back."""
+            def restore(_remaining=None):
+                for store, snap in pending:
+                    store.restore(snap)
+            return restore
+
+        if len(snapshots) > 1:
+            merged = data.mergeStores([snap for _, snap in snapshots])
+            # pylint: disable=protected-access
+            if len(merged) <= imports.ImportService._BATCH_SIZE:
+                # single request, so on failure nothing was accepted
+                self._importSnapshot(deviceId, merged, restoreAll(snapshots))
+                return
+            # pylint: enable=protected-access
+
+        for i, (store, snap) in enumerate(snapshots):
+            self._importSnapshot(deviceId, snap, store.restore,
+                                 onFailure=restoreAll(snapshots[i + 1:]))
+
+    def _send(self):
+        """Sends every device's data, several devices at a time."""
+        self._checkToken()
+        with self._storesLock:
+            work = [(did, list(self._stores[did])) for did in self._stores]
+
+        def urgency(item):
+            """Most urgent priority among a device's stores with data."""
+            pending = [s.priority().value for s in item[1]
+                       if s.numRows() > 0 or s.spilled()[0] > 0]
+            return min(pending) if len(pending) > 0 else len(data.Priority)
+        work.sort(key=urgency)
+
+        def makeTask(did, stores):
+            """Bind the arguments of a device's send."""
+            return lambda: self._sendDevice(did, stores)
+
+        tasks = [makeTask(did, stores) for did, stores in work]
+        results = pool.runAll(tasks, self._maxConcurrency)
+        failed = [(work[i][0], err) for i, (_, err) in enumerate(results)
+                  if err is not None]
+        if len(failed) > 0:
+            raise Exception("send failed for {} of {} devices; {}: {}".format(
+                len(failed), len(work), failed[0][0], failed[0][1]))
@@ -0,0 +1,172 @@
+"""Client-side rate limiting of requests to the iobeam backend."""
+import random
+import threading
+import time
+
+from iobeam.utils import utils
+
+# Status codes that mean the server is throttling or temporarily unavailable
+THROTTLED_CODES = (429, 503)
+
+
+class TokenBucket(object):
+    """Token bucket that refills at a steady rate up to a burst capacity.
+
+    Taking more tokens than are available puts the bucket in debt, so a
+    single large request (e.g., bytes of a big import) is delayed rather
+    than refused.
+    """
+
+    def __init__(self, rate, burst=None):
+        """Constructor for a TokenBucket.
+
+        Params:
+            rate - Tokens added per second
+            burst - Max tokens the bucket holds; defaults to `rate`
+
+        Raises:
+            ValueError - If rate or burst are not positive.
+        """
+        if rate is None or rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst is not None and burst <= 0:
+            raise ValueError("burst must be positive")
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else rate)
+        self._tokens = self.capacity
+        self._last = utils.timer()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        """Take `amount` tokens, returning how long to wait before using them.
+
+        Params:
+            amount - Number of tokens needed
+
+        Returns:
+            Seconds the caller should wait (0 if tokens were available).
+        """
+        with self._lock:
+            now = utils.timer()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class RateLimiter(object):
+    """Limits requests per second and bytes per second sent by a Requester.
+
+    One limiter is shared by every service and thread using its requester.
+    When the server throttles a request (429 or 503), every request through
+    the limiter pauses (for the server's Retry-After, or an exponential
+    backoff with random jitter) before the request is retried.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+    def __init__(self, requestsPerSec=None, bytesPerSec=None, burstRequests=None,
+                 burstBytes=None, maxRetries=3, backoff=1.0, maxBackoff=60.0,
+                 startupJitter=0.0):
+        """Constructor for a RateLimiter.
+
+        Params:
+            requestsPerSec - Max sustained requests per second; None for no limit
+            bytesPerSec - Max sustained request body bytes per second; None
+                          for no limit
+            burstRequests - Requests that may be sent at once before limiting
+                            applies; defaults to `requestsPerSec`
+            burstBytes - Bytes that may be sent at once before limiting
+                         applies; defaults to `bytesPerSec`
+            maxRetries - Times a throttled request is retried
+            backoff - Base seconds of the exponential backoff after throttling
+            maxBackoff - Max seconds to back off
+            startupJitter - The first request waits a random time of up to
+                            this many seconds, so devices starting together
+                            spread out their first requests
+
+        Raises:
+            ValueError - If any rate, burst, or time is invalid.
+        """
+        if maxRetries is None or maxRetries < 0:
+            raise ValueError("maxRetries must be non-negative")
+        if backoff is None or backoff < 0 or maxBackoff is None or maxBackoff < 0:
+            raise ValueError("backoff must be non-negative")
+        if startupJitter is None or startupJitter < 0:
+            raise ValueError("startupJitter must be non-negative")
+
+        self._requests = None
+        if requestsPerSec is not None:
+            self._requests = TokenBucket(requestsPerSec, burst=burstRequests)
+        self._bytes = None
+        if bytesPerSec is not None:
+            self._bytes = TokenBucket(bytesPerSec, burst=burstBytes)
+        self.maxRetries = maxRetries
+        self._backoff = backoff
+        self._maxBackoff = maxBackoff
+        self._startupJitter = startupJitter
+        self._started = False
+        self._pausedUntil = 0.0
+        self._lock = threading.Lock()
+        self._sleep = time.sleep
+        self._random = random.random
+    # pylint: enable=too-many-arguments
+
+    def acquire(self, nbytes=0):
+        """Wait until a request of `nbytes` may be sent.
+
+        Params:
+            nbytes - Size of the request body
+        """
+        wait = 0.0
+        with self._lock:
+            if not self._started:
+                self._started = True
+                wait = self._startupJitter * self._random()
+            wait = max(wait, self._pausedUntil - utils.timer())
+        if self._requests is not None:
+            wait = max(wait, self._requests.reserve(1))
+        if self._bytes is not None and nbytes > 0:
+            wait = max(wait, self._bytes.reserve(nbytes))
+        if wait > 0:
+            self._sleep(wait)
+
+    def throttled(self, attempt, retryAfter=None):
+        """Pause all requests after the server throttled one.
+
+        Params:
+            attempt - Number of retries already made for the request (0 first)
+            retryAfter - Seconds the server asked to wait, if given
+
+        Returns:
+            Seconds that requests are paused.
+        """
+        if retryAfter is not None:
+            delay = min(float(retryAfter), self._maxBackoff)
+        else:
+            # "full jitter" so clients throttled together retry apart
+            delay = min(self._maxBackoff, self._backoff * (2 ** attempt)) * self._random()
+        with self._lock:
+            self._pausedUntil = max(self._pausedUntil, utils.timer() + delay)
+        utils.getLogger().info("throttled by server; pausing %.2fs", delay)
+        return delay
+
+
+def retryAfterSeconds(resp):
+    """Get the Retry-After of a response in seconds, if it has one.
+
+    Only the delay-seconds form of the header is supported.
+
+    Returns:
+        Seconds to wait, or None.
+    """
+    headers = getattr(resp, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
@@ -1,5 +1,8 @@
 """Classes used when communicating via HTTP to the iobeam backend."""
+import json
 import requests
+from requests import adapters
+from iobeam.http import ratelimit
 from iobeam.utils import utils
 
 ERROR_CODE_DUPLICATE_DEVICE_ID = 150
@@ -10,21 +13,94 @@ _BASE_URL = "https://api.iobeam.com/v1/"
 class Requester(object):
     """Generates HTTP requests using `requests` library."""
 
-    def __init__(self, baseUrl=_BASE_URL):
+    def __init__(self, baseUrl=_BASE_URL, parent=None):
+        """Constructor for a Requester.
+
+        Params:
+            baseUrl - URL that endpoints are relative to
+            parent - Requester whose session to send through (see `scoped`);
+                     None creates a new session
+        """
         self._baseUrl = baseUrl
-        self._session = requests.Session()
+        self._session = parent._session if parent is not None else requests.Session()
+        self._poolSize = adapters.DEFAULT_POOLSIZE
+        self._hooks = []
+        self._limiter = None
+        self._parent = parent
 
     def makeEndpoint(self, endpoint):
         """Create a fully defined URL for an endpoint."""
         return self._baseUrl + endpoint
 
+    def scoped(self):
+        """Return a requester with its own hooks and rate limiter.
+
+        The new requester sends through this one's session, so connections
+        are still pooled per base URL, but hooks and the rate limiter set on
+        it only apply to its own requests. Clients use this so their hooks
+        and limiters do not affect other clients with the same backend.
+        """
+        return Requester(baseUrl=self._baseUrl, parent=self._parent or self)
+
+    def ensurePoolSize(self, size):
+        """Make sure at least `size` connections per host can be kept open.
+
+        The connection pool is shared by every service (and thread) using
+        this requester, so it should be at least as large as the number of
+        requests expected to run concurrently.
+
+        Params:
+            size - Minimum number of pooled connections per host
+        """
+        if self._parent is not None:
+            self._parent.ensurePoolSize(size)
+            return
+        if size is None or size <= self._poolSize:
+            return
+        self._poolSize = size
+        for prefix in ["http://", "https://"]:
+            self._session.mount(prefix, adapters.HTTPAdapter(pool_maxsize=size))
+
+    def addHook(self, hook):
+        """Register a hook to receive timing spans for every request.
+
+        Hooks are called as `hook(name, seconds, info)` for the phases
+        "http.encode", "http.send", and "http.parse". A hook sees requests
+        from every service using this requester, but not those of requesters
+        made with `scoped`.
+        """
+        if hook not in self._hooks:
+            self._hooks.append(hook)
+
+    def removeHook(self, hook):
+        """Unregister a hook previously added with `addHook`."""
+        if hook in self._hooks:
+            self._hooks.remove(hook)
+
+    def setRateLimiter(self, limiter):
+        """Limit the rate of requests made through this requester.
+
+        The limiter applies to every service and thread using this
+        requester, but not to requesters made with `scoped`.
+
+        Params:
+            limiter - A ratelimit.RateLimiter, or None to remove limiting
+        """
+        self._limiter = limiter
+
+    def rateLimiter(self):
+        """Return the RateLimiter of this requester, or None."""
+        return self._limiter
+
     def get(self, url):
         """Return a base GET request for a given URL."""
-        return Request("GET", url, self._session)
+        return Request("GET", url, self._session, hooks=self._hooks,
+                       limiter=self._limiter)
 
     def post(self, url):
         """Return a base POST request for a given URL."""
-        return Request("POST", url, self._session)
+        return Request("POST", url, self._session, hooks=self._hooks,
+                       limiter=self._limiter)
 
 
 _REQUESTERS = {_BASE_URL: Requester()}
@@ -63,7 +139,8 @@ class UnknownCodeError(Error):
 class Request(object):
     """Wrapper for an HTTP request object."""
 
-    def __init__(self, method, url, session):
+    # pylint: disable=too-many-arguments
+    def __init__(self, method, url, session, hooks=None, limiter=None):
         self.method = method
         self.url = url
         self.headers = {}
@@ -73,6 +150,9 @@ class Request(object):
         self.body = None
         self.params = {}
         self._session = session
+        self._hooks = hooks
+        self._limiter = limiter
+    # pylint: enable=too-many-arguments
 
     def header(self, key, value):
         """Add a header to the request (chainable)."""
@@ -93,26 +173,96 @@ class Request(object):
         self.params[key] = value
         return self
 
+    def _encodeBody(self):
+        """Encode the body as JSON, reporting an "http.encode" span.
+
+        Returns:
+            The encoded body as a string.
+        """
+        start = utils.timer()
+        payload = json.dumps(self.body)
+        if self._hooks:
+            utils.emitSpan(self._hooks, "http.encode", start,
+                           {"method": self.method, "url": self.url,
+                            "bytes": len(payload)})
+        return payload
+
     def execute(self):
-        """Execute an HTTP request using `requests` library."""
+        """Execute an HTTP request using `requests` library.
+
+        If any hooks are registered, the time spent encoding the body and on
+        the network round trip are reported as "http.encode" and "http.send"
+        spans, along with the number of bytes sent and received.
+
+        If the requester has a rate limiter, the request waits for its turn,
+        and is retried (up to the limiter's `maxRetries`) when the server
+        responds that it is throttling requests.
+        """
+        limiter = self._limiter
+        payload = None
+        if self.method == "POST" and self.body is not None and \
+                (self._hooks or limiter is not None):
+            payload = self._encodeBody()
+            self.header("Content-Type", "application/json")
+        if limiter is None:
+            self._send(payload)
+            return
+
+        attempt = 0
+        while True:
+            limiter.acquire(len(payload) if payload is not None else 0)
+            self._send(payload)
+            if self.resp is None or \
+                    self.resp.status_code not in ratelimit.THROTTLED_CODES or \
+                    attempt >= limiter.maxRetries:
+                return
+            limiter.throttled(attempt, ratelimit.retryAfterSeconds(self.resp))
+            attempt += 1
+
+    def _send(self, payload):
+        """Make the HTTP call, sending `payload` if the body was encoded."""
         self.resp = None
+        hooks = self._hooks
+        sent = 0
         if self.method == "GET":
+            start = utils.timer() if hooks else None
             self.resp = self._session.get(
                 self.url, params=self.params, headers=self.headers)
         elif self.method == "POST":
-            self.resp = self._session.post(self.url, params=self.params,
-                                           headers=self.headers, json=self.body)
+            start = utils.timer() if hooks else None
+            if payload is not None:
+                sent = len(payload)
+                self.resp = self._session.post(self.url, params=self.params,
+                                               headers=self.headers, data=payload)
+            else:
+                self.resp = self._session.post(self.url, params=self.params,
+                                               headers=self.headers, json=self.body)
         else:
-            utils.getLogger().warning("UNSUPPORTED METHOD: {}", self.method)
+            utils.getLogger().warning("UNSUPPORTED METHOD: %s", self.method)
+            return
+
+        if hooks:
+            utils.emitSpan(hooks, "http.send", start, {
+                "method": self.method,
+                "url": self.url,
+                "status": self.resp.status_code,
+                "bytesSent": sent,
+                "bytesReceived": len(self.resp.content or b"")
+            })
 
     def getResponse(self):
         """Return response body for a given request."""
         if self.resp is None:
             return None
+        start = utils.timer() if self._hooks else None
         try:
-            return self.resp.json()
+            ret = self.resp.json()
         except Exception:
-            return None
+            ret = None
+        if start is not None:
+            utils.emitSpan(self._hooks, "http.parse", start,
+                           {"method": self.method, "url": self.url})
+        return ret
 
     def getResponseCode(self):
         """Return HTTP status code for a given request."""
@@ -1,26 +1,53 @@
 """The iobeam client and related types/methods."""
+from . import base
+from . import gateway
 from .endpoints import devices
 from .endpoints import exports
 from .endpoints import imports
 from .endpoints import tokens
+from .http import ratelimit
 from .http import request
+from .resources import budget
 from .resources import data
 from .resources import device
 from .resources import query
+from .resources import results
+from .resources import watermark as marks
+from .utils import cache as lrucache
+from .utils import offline
+from .utils import rangecache
+from .utils import registry
 from .utils import utils
+from .workers import flusher
+from .workers import pool
+from .workers import reconnector
 
 import os.path
+import threading
+from time import time
 
 #  Aliases for resource types for convenience outside the package.
 DataStore = data.DataStore
+ConcurrentDataStore = data.ConcurrentDataStore
 DataPoint = data.DataPoint
 DataSeries = data.DataSeries
 Timestamp = data.Timestamp
 TimeUnit = data.TimeUnit
+Priority = data.Priority
 QueryReq = query.Query
+GatewayClient = gateway.GatewayClient
+BufferBudget = budget.BufferBudget
+RateLimiter = ratelimit.RateLimiter
+BackpressurePolicy = budget.BackpressurePolicy
+LRUCache = lrucache.LRUCache
+RangeCache = rangecache.RangeCache
+Watermark = marks.Watermark
 
 _DEVICE_ID_FILE = "iobeam_device_id"
 
+# Estimated size of a legacy DataPoint (time and value)
+_POINT_BYTES = 2 * data.DataStore._EST_BYTES_PER_VALUE  # pylint: disable=protected-access
+
 class ClientBuilder(object):
     """Used to build an iobeam client object."""
 
@@ -34,6 +61,13 @@ class ClientBuilder(object):
         self._deviceId = None
         self._regArgs = None
         self._backend = None
+        self._hooks = []
+        self._flushArgs = None
+        self._refreshMargin = None
+        self._budget = None
+        self._lowShare = None
+        self._limiter = None
+        self._offlineArgs = None
 
     def saveToDisk(self, path="."):
         """Client object should save deviceId to disk (chainble).
@@ -104,10 +138,149 @@ class ClientBuilder(object):
         self._backend = request.getRequester(url=baseUrl)
         return self
 
+    def addHook(self, hook):
+        """Client object should report timing spans to `hook` (chainable).
+
+        Params:
+            hook - Callable taking `(name, seconds, info)`; see
+                   `_Client.addHook` for the spans reported.
+
+        Returns:
+            This Builder object, for chaining.
+        """
+        self._hooks.append(hook)
+        return self
+
+    # pylint: disable=too-many-arguments
+    def autoFlush(self, maxRows=None, maxBytes=None, maxAge=None,
+                  checkInterval=1.0):
+        """Client object should send data in the background (chainable).
+
+        A background thread sends the client's data whenever any of the given
+        thresholds is crossed. At least one threshold must be provided.
+
+        Params:
+            maxRows - Send when at least this many rows are buffered
+            maxBytes - Send when buffered data is estimated at this many bytes
+            maxAge - Send when the oldest buffered row is this many seconds old
+            checkInterval - Seconds between threshold checks
+
+        Returns:
+            This Builder object, for chaining.
+        """
+        flusher.checkValidThresholds(maxRows, maxBytes, maxAge, checkInterval)
+        self._flushArgs = (maxRows, maxBytes, maxAge, checkInterval)
+        return self
+    # pylint: enable=too-many-arguments
+
+    def refreshTokenInBackground(self, margin=60 * 60):
+        """Client object should refresh its token in the background (chainable).
+
+        The project token is refreshed ahead of expiry by a background
+        thread, so sends do not have to wait on a refresh.
+
+        Params:
+            margin - Seconds before the client would consider the token
+                     expired to refresh it.
+
+        Returns:
+            This Builder object, for chaining.
+        """
+        if margin is None or margin < 0:
+            raise ValueError("margin must be non-negative")
+        self._refreshMargin = margin
+        return self
+
+    def bufferBudget(self, maxBytes, policy=budget.BackpressurePolicy.BLOCK,
+                     timeout=None, spillPath=None):
+        """Client object should limit memory used by unsent data (chainable).
+
+        Params:
+            maxBytes - Max estimated bytes of unsent data to buffer
+            policy - BackpressurePolicy to apply to new rows when full
+            timeout - With BLOCK, max seconds `add()` waits for space before
+                      raising BufferFullError; None waits forever. Without
+                      `autoFlush` nothing frees space, so `add()` raises
+                      at once.
+            spillPath - With SPILL, directory for spilled rows
+
+        Returns:
+            This Builder object, for chaining.
+        """
+        self._budget = budget.BufferBudget(maxBytes, policy=policy,
+                                           timeout=timeout, spillPath=spillPath)
+        return self
+
+    # pylint: disable=too-many-arguments
+    def rateLimit(self, requestsPerSec=None, bytesPerSec=None, maxRetries=3,
+                  startupJitter=0.0):
+        """Client object should limit its rate of requests (chainable).
+
+        Requests wait for a token bucket allowing `requestsPerSec` requests
+        and `bytesPerSec` bytes per second. Throttled requests (429/503) are
+        retried after a jittered backoff. See `ratelimit.RateLimiter` for
+        finer control, set with the client's `setRateLimiter`.
+
+        Params:
+            requestsPerSec - Max requests per second; None for no limit
+            bytesPerSec - Max request bytes per second; None for no limit
+            maxRetries - Times a throttled request is retried
+            startupJitter - Max random seconds to delay the first request
+
+        Returns:
+            This Builder object, for chaining.
+        """
+        self._limiter = ratelimit.RateLimiter(
+            requestsPerSec=requestsPerSec, bytesPerSec=bytesPerSec,
+            maxRetries=maxRetries, startupJitter=startupJitter)
+        return self
+    # pylint: enable=too-many-arguments
+
+    def offlineMode(self, path, probeInterval=30.0, maxConcurrency=4):
+        """Client object should queue data on disk while offline (chainable).
+
+        See `enableOffline` of the client. Not available for gateways.
+
+        Params:
+            path - Directory to queue unsent batches in
+            probeInterval - Seconds between connectivity checks while offline
+            maxConcurrency - Max queued batches sent at once on reconnect
+
+        Returns:
+            This Builder object, for chaining.
+        """
+        if probeInterval is None or probeInterval <= 0:
+            raise ValueError("probeInterval must be positive")
+        if not isinstance(maxConcurrency, int) or maxConcurrency < 1:
+            raise ValueError("maxConcurrency must be a positive int")
+        self._offlineArgs = (path, probeInterval, maxConcurrency)
+        return self
+
+    def lowPriorityShare(self, share):
+        """Client object should cap the share of LOW priority data (chainable).
+
+        Params:
+            share - Max fraction (0 to 1) of the rows in each send taken by
+                    LOW priority stores while higher priority data is sent
+
+        Returns:
+            This Builder object, for chaining.
+        """
+        if share is None or not 0 <= share <= 1:
+            raise ValueError("share must be between 0 and 1")
+        self._lowShare = share
+        return self
+
     def build(self):
         """Actually construct the client object."""
         client = _Client(self._diskPath, self._projectId, self._projectToken,
                          self._backend, deviceId=self._deviceId)
+        self._configure(client)
+        client.setLowPriorityShare(self._lowShare)
+        if self._offlineArgs is not None:
+            path, probeInterval, maxConcurrency = self._offlineArgs
+            client.enableOffline(path, probeInterval=probeInterval,
+                                 maxConcurrency=maxConcurrency)
         if self._regArgs is not None:
             did, dname, setOnDupe = self._regArgs
             client.registerDevice(deviceId=did, deviceName=dname,
@@ -115,8 +288,50 @@ class ClientBuilder(object):
 
         return client
 
+    def _configure(self, client):
+        """Apply options shared by all kinds of clients."""
+        for hook in self._hooks:
+            client.addHook(hook)
+        if self._limiter is not None:
+            client.setRateLimiter(self._limiter)
+        if self._budget is not None:
+            client.setBufferBudget(self._budget)
+        if self._flushArgs is not None:
+            maxRows, maxBytes, maxAge, interval = self._flushArgs
+            client.startAutoFlush(maxRows=maxRows, maxBytes=maxBytes,
+                                  maxAge=maxAge, checkInterval=interval)
+        if self._refreshMargin is not None:
+            client.startTokenRefresh(margin=self._refreshMargin)
+
+    def buildGateway(self, maxConcurrency=8):
+        """Construct a gateway client that sends data for many devices.
+
+        Device options (`setDeviceId`, `registerDevice`, `registerOrSetId`)
+        do not apply to gateways; devices are given per store instead. With
+        `saveToDisk`, registered devices are recorded in the on-disk registry.
+
+        Params:
+            maxConcurrency - Max number of devices to send at once; also the
+                             minimum size of the shared connection pool.
+
+        Returns:
+            A GatewayClient.
+
+        Raises:
+            ValueError - If a device option was set on this builder.
+        """
+        if self._deviceId is not None or self._regArgs is not None:
+            raise ValueError("device options cannot be used with a gateway")
+        client = gateway.GatewayClient(self._projectId, self._projectToken,
+                                       self._backend,
+                                       maxConcurrency=maxConcurrency,
+                                       path=self._diskPath)
+        self._configure(client)
+
+        return client
+
 
-class _Client(object):
+class _Client(base.BaseClient):
     """Client object used to communicate with iobeam."""
 
     # pylint: disable=too-many-arguments
@@ -126,7 +341,8 @@ class _Client(object):
         Creates a client instance associated with a project and (potentially) a
         device. If `path` is provided, this device's ID will be stored at
         <path>/iobeam_device_id. This on-disk ID will be used if one is not
-        provided as `deviceId`.
+        provided as `deviceId`. Registered devices are also recorded in
+        <path>/iobeam_devices.json, so they are not registered again.
 
         Params:
             path - Path where device ID should be persisted
@@ -136,14 +352,20 @@ class _Client(object):
                       https://api.iobeam.com/v1/
             deviceId - Device id if previously registered
         """
-        utils.checkValidProjectId(projectId)
-        utils.checkValidProjectToken(projectToken)
-
-        self.projectId = projectId
-        self.projectToken = projectToken
+        base.BaseClient.__init__(self, projectId, projectToken, backend)
         self._path = path
+        self._registry = registry.DeviceRegistry(path) if path is not None else None
         self._dataset = {}
+        self._datasetSince = None
+        self._datasetLock = threading.Lock()
         self._batches = []
+        self._lowShare = None
+        self._offline = None
+        self._offlineSince = None
+        self._lastProbe = None
+        self._probeInterval = None
+        self._drainConcurrency = 1
+        self._reconnector = None
 
         self._activeDevice = None
         if deviceId is not None:
@@ -156,33 +378,15 @@ class _Client(object):
                     if len(did) > 0:
                         self._activeDevice = device.Device(projectId, did)
 
-
-        # Setup services
-        self._deviceService = devices.DeviceService(projectToken,
-                                                    requester=backend)
-        self._importService = imports.ImportService(projectToken,
-                                                    requester=backend)
-        self._tokenService = tokens.TokenService(requester=backend)
-
         self._checkToken()
     # pylint: enable=too-many-arguments
 
-    def _checkToken(self):
-        """Check if token is expired, and refresh if necessary."""
-        if utils.isExpiredToken(self.projectToken):
-            newToken = self._refreshToken()
-            if newToken is not None:
-                self.projectToken = newToken
-
-    def _refreshToken(self):
-        """Refresh expired project token."""
-        return self._tokenService.refreshToken(self.projectToken)
-
     def registerDevice(self, deviceId=None, deviceName=None, setOnDupe=False):
         """Registers the device with iobeam.
 
         If a path was provided when the client was constructed, the device ID
-        will be stored on disk.
+        will be stored on disk, and devices already in the on-disk registry
+        are set without contacting iobeam.
 
         Params:
             deviceId - Desired device ID; otherwise randomly generated
@@ -204,6 +408,11 @@ class _Client(object):
 
         if deviceId is not None:
             utils.checkValidDeviceId(deviceId)
+            known = self._registry.get(self.projectId, deviceId) \
+                if self._registry is not None else None
+            if known is not None:
+                self._setActiveDevice(known)
+                return self
 
         self._checkToken()
         try:
@@ -216,6 +425,8 @@ class _Client(object):
                                   deviceName=deviceName)
             else:
                 raise
+        if self._registry is not None:
+            self._registry.add(d)
         self._setActiveDevice(d)
 
         return self
@@ -237,8 +448,7 @@ class _Client(object):
         self._activeDevice = dev
         if self._path is not None:
             p = os.path.join(self._path, _DEVICE_ID_FILE)
-            with open(p, "w") as f:
-                f.write(self._activeDevice.deviceId)
+            utils.atomicWrite(p, self._activeDevice.deviceId)
 
     def isRegistered(self):
         """Tells whether this client has a registered device.
@@ -268,9 +478,18 @@ class _Client(object):
             utils.getLogger().warning("tried to add an invalid or None datapoint")
             return
 
-        if seriesName not in self._dataset:
-            self._dataset[seriesName] = set()
-        self._dataset[seriesName].add(datapoint)
+        budget = self._budget
+        if budget is not None and not budget.admit(None, _POINT_BYTES):
+            return
+        with self._datasetLock:
+            if seriesName not in self._dataset:
+                self._dataset[seriesName] = set()
+            dupe = datapoint in self._dataset[seriesName]
+            self._dataset[seriesName].add(datapoint)
+            if self._datasetSince is None:
+                self._datasetSince = time()
+        if budget is not None and dupe:
+            budget.release(_POINT_BYTES)
 
     def addDataSeries(self, dataseries):
         """Adds a DataSeries to the data store.
@@ -290,32 +509,57 @@ class _Client(object):
             return
 
         key = dataseries.getName()
-        if key not in self._dataset:
-            self._dataset[key] = set()
-
-        for p in dataseries.getPoints():
-            self._dataset[key].add(p)
+        points = dataseries.getPoints()
+        budget = self._budget
+        if budget is not None and not budget.admit(None, len(points) * _POINT_BYTES):
+            return
+        with self._datasetLock:
+            if key not in self._dataset:
+                self._dataset[key] = set()
+
+            before = len(self._dataset[key])
+            for p in points:
+                self._dataset[key].add(p)
+            added = len(self._dataset[key]) - before
+            if self._datasetSince is None:
+                self._datasetSince = time()
+        if budget is not None:
+            budget.release((len(points) - added) * _POINT_BYTES)
 
     def clearSeries(self, seriesName):
         """Removes any points associated with `seriesName`."""
-        self._dataset.pop(seriesName, None)
+        with self._datasetLock:
+            removed = self._dataset.pop(seriesName, ())
+        if self._budget is not None:
+            self._budget.release(len(removed) * _POINT_BYTES)
 
-    def createDataStore(self, columns):
+    def createDataStore(self, columns, concurrent=False,
+                        priority=data.Priority.NORMAL):
         """Create a DataStore that is tracked by this client.
 
         Params:
             columns - List of stream names for the DataStore
+            concurrent - If True, create a ConcurrentDataStore, which scales
+                         better when many threads add to it at once.
+            priority - Priority of the store's data when sending; HIGH stores
+                       are sent first (see `send()`).
 
         Returns:
             DataStore object with those columns and being tracked
             by this client for sending.
         """
         for store in self._batches:
-            if store.hasSameColumns(columns):
+            isConcurrent = isinstance(store, data.ConcurrentDataStore)
+            if store.hasSameColumns(columns) and isConcurrent == concurrent \
+                    and store.priority() == priority:
                 return store
 
-        ds = data.DataStore(columns)
+        if concurrent:
+            ds = data.ConcurrentDataStore(columns, priority=priority)
+        else:
+            ds = data.DataStore(columns, priority=priority)
         self._batches.append(ds)
+        self._trackStore(ds)
 
         return ds
 
@@ -332,10 +576,21 @@ class _Client(object):
             raise ValueError("store must be a DataStore")
 
         self._batches.append(store)
+        self._trackStore(store)
 
     def _convertDataSetToBatches(self):
-        """Convert legacy format into new table format."""
-        dataset = self._dataset
+        """Convert legacy format into new table format.
+
+        The points are taken atomically, so points added while converting
+        are kept for the next send.
+        """
+        with self._datasetLock:
+            dataset = self._dataset
+            self._dataset = {}
+            self._datasetSince = None
+        if self._budget is not None:
+            self._budget.release(sum(len(dataset[k]) for k in dataset) * _POINT_BYTES)
+
         batches = []
         for name in dataset:
             batch = data.DataStore([name])
@@ -346,36 +601,395 @@ class _Client(object):
                 row[name] = asDict["value"]
                 batch.add(ts, row)
             batches.append(batch)
-        self._dataset = {}
         return batches
 
-    def send(self):
-        """Sends stored data to the iobeam backend.
+    def _pendingStats(self):
+        """Summarize data waiting to be sent.
+
+        Returns:
+            Tuple of (number of rows, estimated size in bytes, wall clock time
+            the oldest row was added or None if there are no rows).
+        """
+        rows = 0
+        size = 0
+        oldest = None
+        for b in list(self._batches):
+            spilled, spilledAdded = b.spilled()
+            rows += b.numRows() + spilled
+            size += b.estimatedSize() + spilled * b._rowBytes()  # pylint: disable=protected-access
+            for added in (b.firstAddedTime(), spilledAdded):
+                if added is not None and (oldest is None or added < oldest):
+                    oldest = added
+        for name in list(self._dataset):
+            pts = len(self._dataset.get(name, ()))
+            rows += pts
+            size += pts * 2 * data.DataStore._EST_BYTES_PER_VALUE  # pylint: disable=protected-access
+        added = self._datasetSince
+        if added is not None and (oldest is None or added < oldest):
+            oldest = added
+
+        return (rows, size, oldest)
+
+    def _allStores(self):
+        """Return the DataStores tracked by this client."""
+        return list(self._batches)
+
+    def setLowPriorityShare(self, share):
+        """Cap the share of each send taken up by LOW priority stores.
+
+        When higher priority data is sent, LOW priority rows are limited to
+        `share` of the rows sent; the rest wait for later sends. With no
+        higher priority data, LOW stores are sent in full.
+
+        Params:
+            share - Fraction between 0 and 1, or None for no cap
 
         Raises:
-            Exception - if sending the data fails.
+            ValueError - If share is not between 0 and 1.
         """
-        self._checkToken()
-        pid = self.projectId
+        if share is not None and not 0 <= share <= 1:
+            raise ValueError("share must be between 0 and 1")
+        self._lowShare = share
+
+    # pylint: disable=too-many-arguments
+    def _sendStore(self, deviceId, store, maxRows=None, chunkRows=None, onFailure=None,
+                   betweenChunks=None):
+        """Send the oldest rows of a store.
+
+        The rows are taken out of the store once and sent in chunks; rows
+        that are not sent, because of `maxRows` or a failure, are put back
+        in one piece.
+
+        Params:
+            deviceId - Device the data belongs to
+            store - DataStore to send from; producers can keep adding to it
+            maxRows - Max rows to send; None for all
+            chunkRows - Max rows per request; None to send them in one
+            onFailure - Passed to `_importSnapshot`
+            betweenChunks - Optional callable run after each chunk except
+                            the last
+
+        Returns:
+            Number of rows sent.
+        """
+        snapshot = store.swap()
+        total = snapshot.numRows()
+        if maxRows is not None:
+            total = min(total, maxRows)
+        size = chunkRows or total
+
+        def restoreFrom(end):
+            """Make a callback putting back a failed chunk and what follows."""
+            def restore(remaining):
+                store.restore(snapshot.slice(end))
+                store.restore(remaining)
+            return restore
+
+        sent = 0
+        while sent < total:
+            end = min(sent + size, total)
+            self._importSnapshot(deviceId, snapshot.slice(sent, end), restoreFrom(end),
+                                 onFailure=onFailure)
+            sent = end
+            if sent < total and betweenChunks is not None:
+                betweenChunks()
+        store.restore(snapshot.slice(total))
+        return sent
+    # pylint: enable=too-many-arguments
+
+    def enableOffline(self, path, probeInterval=30.0, maxConcurrency=4):
+        """Keep data that cannot be sent in a queue on disk until back online.
+
+        When a send fails because the backend cannot be reached, the
+        unsent data is moved to a persistent queue in `path` and `send()`
+        returns normally. While offline, sends only queue data, except that
+        at most every `probeInterval` seconds the backend is probed with a
+        cheap timestamp request. A background thread probes on the same
+        schedule, so queued data is sent after an outage even if the
+        application does not call `send()`. Once online, queued batches are
+        sent oldest first, `maxConcurrency` at a time, before newer data.
+        Batches queued by an earlier run are sent too.
+
+        Params:
+            path - Directory to queue unsent batches in
+            probeInterval - Seconds between connectivity checks while offline
+            maxConcurrency - Max queued batches sent at once
+
+        Raises:
+            ValueError - If probeInterval or maxConcurrency are not positive.
+        """
+        newReconnector = reconnector.Reconnector(self, probeInterval=probeInterval)
+        if not isinstance(maxConcurrency, int) or maxConcurrency < 1:
+            raise ValueError("maxConcurrency must be a positive int")
+        self.disableOffline()
+        self._offline = offline.OfflineQueue(path)
+        self._probeInterval = probeInterval
+        self._drainConcurrency = maxConcurrency
+        requester = self._importService.requester()
+        if hasattr(requester, "ensurePoolSize"):
+            requester.ensurePoolSize(maxConcurrency)
+        self._reconnector = newReconnector
+        self._reconnector.start()
+
+    def disableOffline(self, timeout=None):
+        """Stop queueing data while offline; queued batches stay on disk.
+
+        Returns:
+            True if the background thread stopped; False otherwise.
+        """
+        ret = True
+        if self._reconnector is not None:
+            ret = self._reconnector.stop(timeout=timeout)
+            self._reconnector = None
+        self._offline = None
+        self._offlineSince = None
+        return ret
+
+    def isOffline(self):
+        """Tells whether the last attempt to reach the backend failed."""
+        return self._offlineSince is not None
+
+    def offlineBacklog(self):
+        """Return the number of batches queued while offline."""
+        return len(self._offline) if self._offline is not None else 0
+
+    def close(self, drain=True, timeout=None):
+        """Shut down the client's background work, including reconnecting.
+
+        Params:
+            drain - If True, send any remaining data before returning.
+            timeout - Max seconds to wait for an in-progress send.
+
+        Returns:
+            True if shut down (and drained) successfully; False otherwise.
+        """
+        # drain first, so data that cannot be sent is still queued on disk
+        closed = base.BaseClient.close(self, drain=drain, timeout=timeout)
+        return self.disableOffline(timeout=timeout) and closed
+
+    def _send(self):
+        """Sends queued and stored data; callers must hold `_sendLock`.
+
+        Without offline mode this is `_sendBuffered`. In offline mode,
+        network failures move the unsent data to the offline queue.
+        """
+        if self._offline is None:
+            self._sendBuffered()
+            return
+        if self.isOffline() and not self._probe():
+            self._queueBuffered()
+            return
+        try:
+            self._drainOffline()
+            self._sendBuffered()
+        except Exception as e:  # pylint: disable=broad-except
+            if not offline.isTransientError(e):
+                raise
+            self._goOffline(e)
+            self._queueBuffered()
+
+    def _probe(self):
+        """Check whether the backend is reachable, if a check is due.
+
+        Returns:
+            True if the backend responded; False if it could not be
+            reached, or was checked less than `probeInterval` ago.
+        """
+        now = utils.timer()
+        if self._lastProbe is not None and now - self._lastProbe < self._probeInterval:
+            return False
+        self._lastProbe = now
+        try:
+            self._deviceService.getTimestamp()
+        except Exception as e:  # pylint: disable=broad-except
+            if not offline.isNetworkError(e):
+                raise
+            return False
+        if self._offlineSince is not None:
+            utils.getLogger().info("backend reachable again after %.0fs",
+                                   time() - self._offlineSince)
+        self._offlineSince = None
+        return True
+
+    def _goOffline(self, err):
+        """Record that the backend could not be reached or take data."""
+        if self._offlineSince is None:
+            self._offlineSince = time()
+            utils.getLogger().warning("backend unavailable, queueing data: %s", err)
+        self._lastProbe = utils.timer()
+
+    def _queueBuffered(self):
+        """Move all stored data to the offline queue."""
         did = self._activeDevice.deviceId
         tempBatches = self._convertDataSetToBatches()
+        for i, b in enumerate(tempBatches):
+            try:
+                self._offline.put(did, b)
+            except Exception:
+                for unsaved in tempBatches[i:]:
+                    self._restoreToDataSet(unsaved)
+                raise
+        for store in list(self._batches):
+            snapshot = store.swap()
+            try:
+                self._offline.put(did, snapshot)
+            except Exception:
+                store.restore(snapshot)
+                raise
 
-        for b in list(self._batches):
-            success, extra = self._importService.importBatch(pid, did, b)
-            if not success:
-                raise Exception("send failed. server sent: {}".format(extra))
-            else:
-                b.clear()
+    def _drainOffline(self):
+        """Send queued batches, oldest first, a few at a time.
+
+        Batches the server rejects for good (a 4xx response other than 401,
+        408, or 429), or that cannot be read, are moved to the queue's
+        rejected subdirectory, so they are not sent again and do not hold
+        up newer data. Any other failure leaves the batch queued and stops
+        draining after the current window.
+
+        Raises:
+            Exception - A network error or offline.ServerUnavailableError,
+                        if the backend could not take the data; batches not
+                        yet sent stay queued.
+        """
+        entries = self._offline.entries()
+        if len(entries) == 0:
+            return
+        self._checkToken()
+
+        def makeTask(entry):
+            """Bind the batch of a task."""
+            def task():
+                did, store = self._offline.load(entry)
+                return self._importService.importBatch(self.projectId, did, store)
+            return task
+
+        for i in range(0, len(entries), self._drainConcurrency):
+            window = entries[i:i + self._drainConcurrency]
+            done = pool.runAll([makeTask(e) for e in window], self._drainConcurrency)
+            failure = None
+            for entry, (result, err) in zip(window, done):
+                if isinstance(err, offline.UnreadableBatchError):
+                    utils.getLogger().warning("queued batch %s rejected: %s", entry, err)
+                    self._offline.reject(entry)
+                    continue
+                if err is None and result.success:
+                    self._offline.remove(entry)
+                    continue
+                if isinstance(err, imports.PartialImportError):
+                    result = err.result
+                if result is not None and result.remaining is not None and result.acked > 0:
+                    # keep only what was not accepted
+                    unsent = self._offline.put(self._offline.load(entry)[0], result.remaining)
+                    self._offline.remove(entry)
+                    entry = unsent
+                if err is None and offline.isPermanentStatus(result.status):
+                    utils.getLogger().warning("queued batch %s rejected: %s",
+                                              entry, result.extra)
+                    if entry is not None:
+                        self._offline.reject(entry)
+                    continue
+                if err is None:
+                    err = offline.ServerUnavailableError(result.status, result.extra)
+                utils.getLogger().info("queued batch %s kept for later: %s", entry, err)
+                if failure is None:
+                    failure = err
+            if failure is not None:
+                raise failure
+
+    def _reconnect(self):
+        """Send the offline queue if the backend is reachable again."""
+        with self._sendLock:
+            if self._offline is None or self.offlineBacklog() == 0:
+                return
+            if self.isOffline() and not self._probe():
+                return
+            try:
+                self._drainOffline()
+            except Exception as e:
+                if not offline.isTransientError(e):
+                    raise
+                self._goOffline(e)
+
+    def _sendBuffered(self):
+        """Sends stored data; callers must hold `_sendLock`.
+
+        Stores are sent in priority order. Lower priority stores are sent one
+        request at a time, and HIGH priority rows added in the meantime are
+        sent between those requests, so they are not stuck behind a backlog.
+        """
+        self._checkToken()
+        did = self._activeDevice.deviceId
+        tempBatches = self._convertDataSetToBatches()
 
-        # temp batches are not saved between calls; re-made each time
-        for b in tempBatches:
-            success, extra = self._importService.importBatch(pid, did, b)
-            if not success:
-                raise Exception("send failed. server sent: {}".format(extra))
+        def restoreTemp(pending):
+            """Make a callback returning unsent temp batches to the data set."""
+            def restore():
+                for b in pending:
+                    self._restoreToDataSet(b)
+            return restore
+
+        onFailure = restoreTemp(tempBatches)
+        stores = sorted(self._batches, key=lambda b: b.priority().value)
+        urgent = [b for b in stores if b.priority() == data.Priority.HIGH]
+        sentHigher = 0
+        for b in urgent:
+            sentHigher += self._sendStore(did, b, onFailure=onFailure)
+
+        sentUrgent = [0]
+
+        def sendUrgent():
+            """Send HIGH rows added while a lower priority store is sent."""
+            for u in urgent:
+                sentUrgent[0] += self._sendStore(did, u, onFailure=onFailure)
+
+        lowLeft = None
+        for b in stores[len(urgent):]:
+            toSend = None
+            if b.priority() == data.Priority.LOW and self._lowShare is not None:
+                if lowLeft is None and sentHigher > 0 and self._lowShare < 1:
+                    lowLeft = int(sentHigher * self._lowShare / (1 - self._lowShare))
+                if lowLeft is not None:
+                    toSend = lowLeft
+            # pylint: disable=protected-access
+            chunk = max(1, imports.ImportService._BATCH_SIZE // len(b.columns()))
+            # pylint: enable=protected-access
+            sent = self._sendStore(did, b, maxRows=toSend, chunkRows=chunk,
+                                   onFailure=onFailure, betweenChunks=sendUrgent)
+            if b.priority() != data.Priority.LOW:
+                sentHigher += sent
+            elif lowLeft is not None:
+                lowLeft -= sent
+            if sent > 0:
+                sendUrgent()
+            sentHigher += sentUrgent[0]
+            sentUrgent[0] = 0
+
+        # temp batches are re-made each time; unsent points go back to the
+        # legacy data set for the next call
+        for i, b in enumerate(tempBatches):
+            self._importSnapshot(did, b, self._restoreToDataSet,
+                                 onFailure=restoreTemp(tempBatches[i + 1:]))
+
+    def _restoreToDataSet(self, batch):
+        """Put the rows of an unsent temp batch back as legacy DataPoints."""
+        if batch is None:
+            return
+        name = batch.columns()[0]
+        points = []
+        for row in batch.rows():
+            ts = data.Timestamp(row["time"], unit=TimeUnit.MICROSECONDS)
+            points.append(data.DataPoint(row[name], timestamp=ts))
+        if self._budget is not None:
+            # unsent points are kept even if that goes over budget
+            self._budget.charge(len(points) * _POINT_BYTES)
+        with self._datasetLock:
+            self._dataset.setdefault(name, set()).update(points)
+            if self._datasetSince is None:
+                self._datasetSince = time()
 
 
     @staticmethod
-    def query(token, qry, backend=None):
+    def query(token, qry, backend=None, cache=None, rangeCache=None):
         """Performs a query on the iobeam backend.
 
         The Query specifies the project, device, and series to look up, as well
@@ -384,6 +998,9 @@ class _Client(object):
         Params:
             token - A token with read access for the given project.
             query - Specifies a data query to perform.
+            cache - Optional LRUCache to serve repeated queries from.
+            rangeCache - Optional RangeCache; only time ranges it does not
+                         hold are requested.
 
         Returns:
             A dictionary representing the results of the query.
@@ -402,9 +1019,143 @@ class _Client(object):
         if backend is not None:
             requester = request.getRequester(url=backend)
 
-        service = exports.ExportService(token, requester=requester)
+        service = exports.ExportService(token, requester=requester, cache=cache,
+                                        rangeCache=rangeCache)
         return service.getData(qry)
 
+    @staticmethod
+    def queryMany(token, queries, maxConcurrency=8, backend=None, cache=None):
+        """Performs many queries on the iobeam backend concurrently.
+
+        Params:
+            token - A token with read access for the queried projects.
+            queries - List of queries to perform.
+            maxConcurrency - Max number of queries in flight
+            cache - Optional LRUCache to serve repeated queries from.
+
+        Returns:
+            A dictionary mapping each query to its results.
+
+        Raises:
+            ValueError - If `token` is None or any query is the wrong type.
+            request.UnknownCodeError - If any query gets an unexpected
+                                       status code.
+        """
+        if token is None:
+            raise ValueError("token cannot be None")
+        queries = list(queries or [])
+        for qry in queries:
+            if not isinstance(qry, QueryReq):
+                raise ValueError("queries must be iobeam.QueryReqs")
+        requester = None
+        if backend is not None:
+            requester = request.getRequester(url=backend)
+
+        service = exports.ExportService(token, requester=requester, cache=cache)
+        return service.getDataMany(queries, maxConcurrency=maxConcurrency)
+
+    # pylint: disable=too-many-arguments
+    @staticmethod
+    def querySplit(token, qry, parts=None, window=None, maxConcurrency=8, backend=None):
+        """Performs a query as concurrent queries over parts of its time range.
+
+        See `exports.ExportService.getDataSplit` for how the query is split.
+
+        Params:
+            token - A token with read access for the given project.
+            qry - Specifies a data query to perform; it must have a from time.
+            parts - Number of sub-ranges to split the time range into
+            window - Length of each sub-range (in the query's TimeUnit),
+                     instead of `parts`
+            maxConcurrency - Max number of queries in flight
+
+        Returns:
+            A dictionary representing the results of the whole query.
+
+        Raises:
+            ValueError - If `token` or `qry` is None, or `qry` is the wrong
+                         type.
+        """
+        if token is None:
+            raise ValueError("token cannot be None")
+        elif qry is None:
+            raise ValueError("qry cannot be None")
+        elif not isinstance(qry, QueryReq):
+            raise ValueError("qry must be a iobeam.QueryReq")
+        requester = None
+        if backend is not None:
+            requester = request.getRequester(url=backend)
+
+        service = exports.ExportService(token, requester=requester)
+        return service.getDataSplit(qry, parts=parts, window=window,
+                                    maxConcurrency=maxConcurrency)
+    # pylint: enable=too-many-arguments
+
+    @staticmethod
+    def queryNew(token, qry, watermark, backend=None):
+        """Performs a query for data newer than a watermark.
+
+        Params:
+            token - A token with read access for the given project.
+            qry - Specifies a data query to perform.
+            watermark - Watermark of data already seen; it is advanced (and
+                        saved, if it has a path) past the returned points
+
+        Returns:
+            A dictionary holding only points not returned before.
+
+        Raises:
+            ValueError - If `token`, `qry`, or `watermark` is None, or `qry`
+                         is the wrong type.
+        """
+        if token is None:
+            raise ValueError("token cannot be None")
+        elif qry is None:
+            raise ValueError("qry cannot be None")
+        elif not isinstance(qry, QueryReq):
+            raise ValueError("qry must be a iobeam.QueryReq")
+        elif watermark is None:
+            raise ValueError("watermark cannot be None")
+        requester = None
+        if backend is not None:
+            requester = request.getRequester(url=backend)
+
+        service = exports.ExportService(token, requester=requester)
+        return results.mergeResponses([watermark.advance(service.getData(q))
+                                       for q in watermark.applyEach(qry)])
+
+    @staticmethod
+    def queryPages(token, qry, pageSize=None, window=None, backend=None):
+        """Performs a query on the iobeam backend in windows and pages.
+
+        See `exports.ExportService.iterData` for how the query is split.
+
+        Params:
+            token - A token with read access for the given project.
+            qry - Specifies a data query to perform.
+            pageSize - Max points per series in each request
+            window - Length of time windows, in the query's TimeUnit
+
+        Returns:
+            Generator of dictionaries, each holding part of the results.
+
+        Raises:
+            ValueError - If `token` or `qry` is None, or `qry` is the wrong
+                         type.
+        """
+        if token is None:
+            raise ValueError("token cannot be None")
+        elif qry is None:
+            raise ValueError("qry cannot be None")
+        elif not isinstance(qry, QueryReq):
+            raise ValueError("qry must be a iobeam.QueryReq")
+        requester = None
+        if backend is not None:
+            requester = request.getRequester(url=backend)
+
+        service = exports.ExportService(token, requester=requester)
+        return service.iterData(qry, pageSize=pageSize, window=window)
+
     @staticmethod
     def fetchToken(userToken, projectId, duration=None, options=None,
                    backend=None):
@@ -420,9 +1171,30 @@ class _Client(object):
                                        duration=duration, options=options)
 
 # Aliases
-def makeQuery(token, qry, backend=None):
+def makeQuery(token, qry, backend=None, cache=None, rangeCache=None):
     """Perform iobeam query."""
-    return _Client.query(token, qry, backend)
+    return _Client.query(token, qry, backend, cache=cache, rangeCache=rangeCache)
+
+def makeQueries(token, queries, maxConcurrency=8, backend=None, cache=None):
+    """Perform many iobeam queries concurrently."""
+    return _Client.queryMany(token, queries, maxConcurrency=maxConcurrency,
+                             backend=backend, cache=cache)
+
+# pylint: disable=too-many-arguments
+def makeSplitQuery(token, qry, parts=None, window=None, maxConcurrency=8, backend=None):
+    """Perform iobeam query as concurrent queries over parts of its time range."""
+    return _Client.querySplit(token, qry, parts=parts, window=window,
+                              maxConcurrency=maxConcurrency, backend=backend)
+# pylint: enable=too-many-arguments
+
+def pollQuery(token, qry, watermark, backend=None):
+    """Perform iobeam query, returning only data newer than `watermark`."""
+    return _Client.queryNew(token, qry, watermark, backend=backend)
+
+def iterQuery(token, qry, pageSize=None, window=None, backend=None):
+    """Perform iobeam query, yielding the results in pieces."""
+    return _Client.queryPages(token, qry, pageSize=pageSize, window=window,
+                              backend=backend)
 
 def fetchDeviceToken(userToken, projectId, deviceId, duration=None,
                      options=None, backend=None):
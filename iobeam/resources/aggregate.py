@@ -0,0 +1,215 @@
+"""Streaming aggregation of export results into time windows."""
+from numbers import Number
+
+from iobeam.resources import results
+
+
+class WindowStats(object):
+    """Summary of the points of one series in one time window.
+
+    `sum`, `min`, `max`, and `mean` only consider numeric values and are
+    None if the window has none; `count` and `last` consider every point.
+    """
+
+    def __init__(self, deviceId, name, start, end):
+        """Constructor for WindowStats.
+
+        Params:
+            deviceId - Device of the series
+            name - Name of the series
+            start - Start of the window (inclusive)
+            end - End of the window (exclusive)
+        """
+        self.deviceId = deviceId
+        self.name = name
+        self.start = start
+        self.end = end
+        self.count = 0
+        self.sum = None
+        self.min = None
+        self.max = None
+        self.last = None
+        self._numeric = 0
+        self._lastTime = None
+
+    def add(self, time, value):
+        """Include a point in the window."""
+        self.count += 1
+        if self._lastTime is None or time >= self._lastTime:
+            self._lastTime = time
+            self.last = value
+        if isinstance(value, Number) and not isinstance(value, bool):
+            self._numeric += 1
+            if self.sum is None:
+                self.sum = self.min = self.max = value
+            else:
+                self.sum += value
+                self.min = min(self.min, value)
+                self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        """Mean of the numeric values, or None if there are none."""
+        if self._numeric == 0:
+            return None
+        return float(self.sum) / self._numeric
+
+    def asDict(self):
+        """Return the stats as a dictionary."""
+        return {
+            "device_id": self.deviceId,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "last": self.last
+        }
+
+    def __repr__(self):
+        return "WindowStats({}, {}, [{}, {}), count={})".format(
+            self.deviceId, self.name, self.start, self.end, self.count)
+
+
+class Aggregator(object):
+    """Computes per-series stats over time windows in a single pass.
+
+    Windows are `window` long and start every `step` (both in the time
+    unit of the points). With no step, windows are fixed and do not
+    overlap; with a smaller step they are rolling, and each point counts
+    in every window that contains it. Windows are aligned to multiples of
+    `step` from time 0.
+
+    Only stats are kept, so memory grows with the number of windows rather
+    than the number of points. When points arrive in time order (e.g., from
+    `ExportService.iterData`), `flushFinished` hands off finished windows to
+    keep memory bounded by the windows still open.
+    """
+
+    def __init__(self, window, step=None):
+        """Constructor for an Aggregator.
+
+        Params:
+            window - Length of each window
+            step - Time between window starts; defaults to `window`
+
+        Raises:
+            ValueError - If window or step are not positive ints, or step is
+                         larger than window.
+        """
+        if step is None:
+            step = window
+        for val, name in ((window, "window"), (step, "step")):
+            if not isinstance(val, int) or val <= 0:
+                raise ValueError("{} must be a positive int".format(name))
+        if step > window:
+            raise ValueError("step cannot be larger than window")
+        self.window = window
+        self.step = step
+        self._windows = {}  # (deviceId, name, start) -> WindowStats
+        self._latest = {}  # (deviceId, name) -> newest time added
+
+    def add(self, deviceId, name, time, value):
+        """Include one point in every window that contains it."""
+        series = (deviceId, name)
+        if series not in self._latest or time > self._latest[series]:
+            self._latest[series] = time
+        start = (time // self.step) * self.step
+        while start > time - self.window:
+            key = (deviceId, name, start)
+            stats = self._windows.get(key)
+            if stats is None:
+                stats = WindowStats(deviceId, name, start, start + self.window)
+                self._windows[key] = stats
+            stats.add(time, value)
+            start -= self.step
+
+    def addResults(self, responses):
+        """Include every point of one or more export responses.
+
+        Params:
+            responses - A response dictionary, or an iterable of them (e.g.,
+                        pages from `iterData`)
+
+        Returns:
+            This Aggregator, to allow chaining.
+        """
+        for did, name, time, value in results.iterPoints(responses):
+            self.add(did, name, time, value)
+        return self
+
+    def flush(self, before=None):
+        """Remove and return windows that end at or before a time.
+
+        Params:
+            before - Time up to which windows are finished; None for all
+
+        Returns:
+            List of WindowStats, ordered by series and start time.
+        """
+        keys = [k for k, s in self._windows.items() if before is None or s.end <= before]
+        done = [self._windows.pop(k) for k in keys]
+        return Aggregator._sorted(done)
+
+    def flushFinished(self):
+        """Remove and return windows that no later point can fall in.
+
+        Assumes the points of each series are added in time order, so a
+        window is finished once its series has a point at or after its end.
+
+        Returns:
+            List of WindowStats, ordered by series and start time.
+        """
+        keys = [k for k, s in self._windows.items()
+                if s.end <= self._latest[(s.deviceId, s.name)]]
+        return Aggregator._sorted([self._windows.pop(k) for k in keys])
+
+    def windows(self):
+        """Return all current windows, ordered by series and start time."""
+        return Aggregator._sorted(self._windows.values())
+
+    @staticmethod
+    def _sorted(stats):
+        """Sort WindowStats by device, series, and start."""
+        return sorted(stats, key=lambda s: (str(s.deviceId), str(s.name), s.start))
+
+
+def aggregate(responses, window, step=None):
+    """Compute per-series window stats of export results.
+
+    Params:
+        responses - A response dictionary, or an iterable of them
+        window - Length of each window, in the time unit of the results
+        step - Time between window starts, for rolling windows
+
+    Returns:
+        List of WindowStats, ordered by series and start time.
+    """
+    return Aggregator(window, step=step).addResults(responses).windows()
+
+
+def iterAggregate(pages, window, step=None):
+    """Compute window stats while results arrive, yielding finished windows.
+
+    Meant for pages from `ExportService.iterData` (or `iobeam.iterQuery`),
+    where each series' points arrive in time order: only windows still open
+    are held in memory.
+
+    Params:
+        pages - Iterable of response dictionaries
+        window - Length of each window, in the time unit of the results
+        step - Time between window starts, for rolling windows
+
+    Returns:
+        Generator of WindowStats; each series' windows are in start order.
+    """
+    agg = Aggregator(window, step=step)
+    for page in pages:
+        agg.addResults(page)
+        for stats in agg.flushFinished():
+            yield stats
+    for stats in agg.flush():
+        yield stats
@@ -0,0 +1,315 @@
+"""Memory budget shared by the buffers of a client."""
+import itertools
+import json
+import os
+import os.path
+import threading
+from enum import Enum
+
+from iobeam.utils import utils
+
+
+# keys of spill files; unlike id(), never reused for another store
+_SPILL_KEYS = itertools.count(1)
+
+
+class BackpressurePolicy(Enum):
+    """What to do with a new row when the budget is used up.
+
+    BLOCK - Wait (up to the budget's timeout) for a send to free space;
+            fails at once if nothing is sending in the background
+    DROP_OLDEST - Discard the oldest buffered rows to make room
+    DROP_NEWEST - Discard the new row
+    SPILL - Move buffered rows to a file on disk; they are read back when
+            their store is sent
+
+    DROP_OLDEST and SPILL only make room in tracked DataStores. Rows kept
+    outside a store (legacy DataPoints) are never dropped or spilled to make
+    room, so once they alone fill the budget new rows are dropped, as with
+    DROP_NEWEST.
+    """
+    BLOCK = 0
+    DROP_OLDEST = 1
+    DROP_NEWEST = 2
+    SPILL = 3
+
+
+class BufferFullError(Exception):
+    """Raised when a BLOCK budget is still full after its timeout, or is
+    full with nothing sending in the background to free space."""
+    pass
+
+
+class BufferBudget(object):
+    """Limit on the estimated bytes buffered across a client's DataStores.
+
+    Stores tracked by a budget reserve space for each row they add and
+    release it when their rows are taken for sending. When a row does not
+    fit, the budget's policy decides what happens, and `onFull` (if set) is
+    called so an uploader can be woken up; clients use this to request a
+    background send. `onFull` returns False if no uploader is running, in
+    which case BLOCK raises BufferFullError instead of waiting for space
+    that would never be freed.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, maxBytes, policy=BackpressurePolicy.BLOCK, timeout=None,
+                 spillPath=None, onFull=None):
+        """Constructor for a BufferBudget.
+
+        Params:
+            maxBytes - Max estimated bytes to buffer (see
+                       `DataStore.estimatedSize()`)
+            policy - BackpressurePolicy to apply when the budget is full
+            timeout - With BLOCK, max seconds to wait for space before
+                      raising BufferFullError; None waits forever
+            spillPath - With SPILL, directory to write spilled rows to
+            onFull - Optional callable run whenever a row does not fit;
+                     returning False means nothing will free space
+
+        Raises:
+            ValueError - If maxBytes is not a positive int, policy is not a
+                         BackpressurePolicy, timeout is negative, or SPILL is
+                         used without a spillPath.
+        """
+        if not isinstance(maxBytes, int) or maxBytes <= 0:
+            raise ValueError("maxBytes must be a positive int")
+        if not isinstance(policy, BackpressurePolicy):
+            raise ValueError("policy must be a BackpressurePolicy")
+        if timeout is not None and timeout < 0:
+            raise ValueError("timeout must be non-negative")
+        if policy == BackpressurePolicy.SPILL and spillPath is None:
+            raise ValueError("spillPath is required with SPILL")
+
+        self.maxBytes = maxBytes
+        self.policy = policy
+        self.timeout = timeout
+        self.onFull = onFull
+        self._spillPath = spillPath
+        self._cond = threading.Condition()
+        self._used = 0
+        self._dropped = 0
+        self._stores = []
+        self._spillLock = threading.Lock()
+        self._spills = {}  # store key -> (file path, number of rows, first added)
+        self._spillCount = 0
+    # pylint: enable=too-many-arguments
+
+    def track(self, store):
+        """Account for a store's rows in this budget.
+
+        Rows already in the store are charged without applying the policy.
+        """
+        with self._cond:
+            if store in self._stores:
+                return
+            self._stores.append(store)
+        # pylint: disable=protected-access
+        store._budget = self
+        if store._spillKey is None:
+            store._spillKey = next(_SPILL_KEYS)
+        # pylint: enable=protected-access
+        self.charge(store.estimatedSize())
+
+    def untrack(self, store):
+        """Stop accounting for a store, e.g., when its client drops it."""
+        with self._cond:
+            if store not in self._stores:
+                return
+            self._stores.remove(store)
+        store._budget = None  # pylint: disable=protected-access
+        self.release(store.estimatedSize())
+        self.discardSpill(store)
+
+    def admit(self, store, nbytes):
+        """Reserve space for a new row, applying the policy if it does not fit.
+
+        With DROP_OLDEST and SPILL, room is only made in tracked stores;
+        if none holds rows, the new row is dropped.
+
+        Params:
+            store - DataStore the row is for, or None for rows that are not
+                    in a store (e.g., legacy DataPoints)
+            nbytes - Estimated size of the row
+
+        Returns:
+            True if the row should be added; False if it was dropped.
+
+        Raises:
+            BufferFullError - With BLOCK, if no space is freed in time, or
+                              `onFull` reports that nothing is sending.
+        """
+        if self._tryReserve(nbytes):
+            return True
+        sending = self._notifyFull()
+
+        if self.policy == BackpressurePolicy.BLOCK:
+            if not sending:
+                raise BufferFullError(
+                    "buffer budget of {} bytes is full and nothing is sending".format(
+                        self.maxBytes))
+            deadline = None if self.timeout is None else utils.timer() + self.timeout
+            with self._cond:
+                while self._used + nbytes > self.maxBytes:
+                    wait = None if deadline is None else deadline - utils.timer()
+                    if wait is not None and wait <= 0:
+                        raise BufferFullError(
+                            "buffer budget of {} bytes is full".format(self.maxBytes))
+                    self._cond.wait(wait)
+                self._used += nbytes
+            return True
+        elif self.policy in (BackpressurePolicy.DROP_OLDEST, BackpressurePolicy.SPILL):
+            while True:
+                victim = self._victim(store)
+                if victim is None:
+                    break
+                if self.policy == BackpressurePolicy.DROP_OLDEST:
+                    self._countDropped(victim._dropOldest(nbytes))  # pylint: disable=protected-access
+                else:
+                    self._spill(victim)
+                if self._tryReserve(nbytes):
+                    return True
+
+        self._countDropped(1)
+        return False
+
+    def charge(self, nbytes):
+        """Account for rows that must be kept, even if over budget."""
+        with self._cond:
+            self._used += nbytes
+
+    def release(self, nbytes):
+        """Give back space of rows that left the buffers."""
+        if nbytes <= 0:
+            return
+        with self._cond:
+            self._used = max(0, self._used - nbytes)
+            self._cond.notify_all()
+
+    def _tryReserve(self, nbytes):
+        """Reserve `nbytes` if they fit."""
+        with self._cond:
+            if self._used + nbytes <= self.maxBytes:
+                self._used += nbytes
+                return True
+            return False
+
+    def _notifyFull(self):
+        """Run the onFull callback, ignoring its errors.
+
+        Returns:
+            False if the callback reported that nothing will free space;
+            True otherwise.
+        """
+        if self.onFull is None:
+            return True
+        try:
+            return self.onFull() is not False
+        except Exception:  # pylint: disable=broad-except
+            utils.getLogger().warning("buffer budget onFull failed", exc_info=True)
+            return True
+
+    def _countDropped(self, rows):
+        """Add to the count of discarded rows."""
+        with self._cond:
+            self._dropped += rows
+
+    def _victim(self, store):
+        """Pick a store to make room in, or None if all are empty.
+
+        DROP_OLDEST picks the store holding the oldest unsent row; SPILL
+        picks the store using the most memory.
+        """
+        with self._cond:
+            stores = [s for s in self._stores if s.numRows() > 0]
+        if len(stores) == 0:
+            return None
+        if self.policy == BackpressurePolicy.SPILL:
+            return max(stores, key=lambda s: s.estimatedSize())
+        return min(stores, key=lambda s: s.firstAddedTime() or 0)
+
+    def _spill(self, store):
+        """Move all of a store's in-memory rows to its spill file."""
+        # pylint: disable=protected-access
+        rows, added = store._takeAll()
+        if len(rows) == 0:
+            return
+        with self._spillLock:
+            path, count, first = self._spills.get(store._spillKey, (None, 0, None))
+            if path is None:
+                self._spillCount += 1
+                path = os.path.join(self._spillPath, "iobeam-spill-{}-{}.jsonl".format(
+                    os.getpid(), self._spillCount))
+            with open(path, "a") as f:
+                for row in rows:
+                    f.write(json.dumps(row))
+                    f.write("\n")
+            if first is None or (added is not None and added < first):
+                first = added
+            self._spills[store._spillKey] = (path, count + len(rows), first)
+        self.release(len(rows) * store._rowBytes())
+        # pylint: enable=protected-access
+
+    def spilled(self, store):
+        """Describe the rows of a store that are spilled to disk.
+
+        Returns:
+            Tuple of (number of rows, wall clock time the oldest was added or
+            None if there are none).
+        """
+        with self._spillLock:
+            _, count, added = self._spills.get(store._spillKey, (None, 0, None))  # pylint: disable=protected-access
+        return (count, added)
+
+    def unspill(self, store):
+        """Read back and remove a store's spilled rows.
+
+        Returns:
+            Tuple of (list of rows, oldest first, and wall clock time the
+            oldest was added); the list is empty if none were spilled.
+        """
+        with self._spillLock:
+            path, _, added = self._spills.pop(store._spillKey, (None, 0, None))  # pylint: disable=protected-access
+            if path is None:
+                return ([], None)
+            with open(path, "r") as f:
+                rows = [json.loads(line) for line in f if len(line.strip()) > 0]
+            os.remove(path)
+        return (rows, added)
+
+    def discardSpill(self, store):
+        """Delete a store's spilled rows without reading them."""
+        with self._spillLock:
+            path, _, _ = self._spills.pop(store._spillKey, (None, 0, None))  # pylint: disable=protected-access
+            if path is not None and os.path.isfile(path):
+                os.remove(path)
+
+    def used(self):
+        """Return the estimated bytes currently buffered in memory."""
+        with self._cond:
+            return self._used
+
+    def occupancy(self):
+        """Return the fraction of the budget in use (may exceed 1.0)."""
+        return float(self.used()) / self.maxBytes
+
+    def stats(self):
+        """Summarize the state of the budget.
+
+        Returns:
+            Dict with "usedBytes", "maxBytes", "occupancy" (fraction in use),
+            "droppedRows" (total discarded so far), and "spilledRows"
+            (currently on disk).
+        """
+        with self._spillLock:
+            spilled = sum(count for _, count, _ in self._spills.values())
+        with self._cond:
+            used = self._used
+            dropped = self._dropped
+        return {
+            "usedBytes": used,
+            "maxBytes": self.maxBytes,
+            "occupancy": float(used) / self.maxBytes,
+            "droppedRows": dropped,
+            "spilledRows": spilled
+        }
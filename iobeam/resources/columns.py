@@ -0,0 +1,142 @@
+"""Columnar (array based) form of export query results."""
+from array import array
+from numbers import Number
+
+from iobeam.resources import data
+from iobeam.resources import results
+from iobeam.utils import utils
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# array typecode of 64-bit ints ("q" is not available on Python 2)
+INT_CODE = "q" if utils.IS_PY3 else "l"
+
+# time units as multiples of a microsecond
+_USEC = {
+    data.TimeUnit.SECONDS: 1000000,
+    data.TimeUnit.MILLISECONDS: 1000,
+    data.TimeUnit.MICROSECONDS: 1
+}
+
+
+def hasNumpy():
+    """Tells whether NumPy is available for columnar results."""
+    return numpy is not None
+
+
+class SeriesColumns(object):
+    """Times and values of one series, stored as two columns.
+
+    `times` and `values` are `array.array`s (or NumPy arrays) of equal
+    length. Values that are not all numbers are kept in a list instead.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, deviceId, name, times, values, timeUnit):
+        """Constructor for SeriesColumns.
+
+        Params:
+            deviceId - Device the series belongs to
+            name - Name of the series
+            times - Column of times, in `timeUnit`
+            values - Column of values
+            timeUnit - TimeUnit of `times`
+        """
+        self.deviceId = deviceId
+        self.name = name
+        self.times = times
+        self.values = values
+        self.timeUnit = timeUnit
+    # pylint: enable=too-many-arguments
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return "SeriesColumns({}, {}, {} points)".format(
+            self.deviceId, self.name, len(self))
+
+
+def _converter(fromUnit, toUnit):
+    """Return a function converting int times between two units."""
+    fromUsec = _USEC[fromUnit]
+    toUsec = _USEC[toUnit]
+    if fromUsec == toUsec:
+        return None
+    elif fromUsec > toUsec:
+        mult = fromUsec // toUsec
+        return lambda t: t * mult
+    div = toUsec // fromUsec
+    return lambda t: t // div
+
+
+def _unitOf(response):
+    """Return the TimeUnit of times in a response (msec if not given)."""
+    fmt = (response or {}).get("timefmt")
+    for unit in data.TimeUnit:
+        if unit.value == fmt:
+            return unit
+    return data.TimeUnit.MILLISECONDS
+
+
+# pylint: disable=too-many-arguments
+def decodeSeries(deviceId, name, points, fromUnit, toUnit, useNumpy=False):
+    """Turn a list of {"time", "value"} points into SeriesColumns.
+
+    Params:
+        deviceId - Device the series belongs to
+        name - Name of the series
+        points - List of point dicts, as in export responses
+        fromUnit - TimeUnit of the points' times
+        toUnit - TimeUnit to convert times to
+        useNumpy - If True, columns are NumPy arrays
+
+    Returns:
+        SeriesColumns of the points.
+    """
+    convert = _converter(fromUnit, toUnit)
+    times = array(INT_CODE, [p["time"] for p in points])
+    if convert is not None:
+        times = array(INT_CODE, [convert(t) for t in times])
+
+    values = [p["value"] for p in points]
+    numeric = all(isinstance(v, Number) and not isinstance(v, bool) for v in values)
+    if numeric:
+        values = array("d", values)
+
+    if useNumpy:
+        times = numpy.frombuffer(times, dtype=numpy.int64) if len(times) > 0 \
+            else numpy.zeros(0, dtype=numpy.int64)
+        values = numpy.frombuffer(values, dtype=numpy.float64) if numeric and len(values) > 0 \
+            else numpy.array(values, dtype=numpy.float64 if numeric else object)
+    return SeriesColumns(deviceId, name, times, values, toUnit)
+# pylint: enable=too-many-arguments
+
+
+def decodeColumns(response, timeUnit=None, useNumpy=None):
+    """Decode an export response into columns, one SeriesColumns per series.
+
+    Params:
+        response - Dictionary returned by an export query
+        timeUnit - TimeUnit to normalize times to; defaults to the unit of
+                   the response
+        useNumpy - True for NumPy arrays, False for `array.array`s, or None
+                   to use NumPy when it is installed
+
+    Returns:
+        List of SeriesColumns, in the order of the response.
+
+    Raises:
+        ValueError - If useNumpy is True but NumPy is not installed.
+    """
+    if useNumpy is None:
+        useNumpy = hasNumpy()
+    elif useNumpy and not hasNumpy():
+        raise ValueError("numpy is not installed")
+    fromUnit = _unitOf(response)
+    toUnit = timeUnit or fromUnit
+    return [decodeSeries(did, name, pts, fromUnit, toUnit, useNumpy=useNumpy)
+            for did, name, pts in results.iterSeries(response)]
@@ -1,5 +1,7 @@
 """Data types related to making data points and series."""
 # pylint: disable=too-few-public-methods
+import threading
+from operator import itemgetter
 from time import time
 from enum import Enum
 from iobeam.utils import utils
@@ -18,6 +20,12 @@ class TimeUnit(Enum):
     MICROSECONDS = "usec"
     SECONDS = "sec"
 
+class Priority(Enum):
+    """Enum of send priorities for DataStores; lower values are sent first."""
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
 class Timestamp(object):
     """Represents a timestamp, using a value and TimeUnit."""
 
@@ -135,17 +143,28 @@ class DataPoint(object):
 
 
 class DataStore(object):
-    """A collection of data streams with rows batched by time."""
+    """A collection of data streams with rows batched by time.
+
+    Rows can be added from other threads while the store is being sent:
+    sending takes the current rows with `swap()`, leaving an empty buffer
+    for new rows, so producers only ever wait for the swap itself.
+    """
 
-    def __init__(self, columns):
+    # Rough size of one encoded value in an import request, used to estimate
+    # how many bytes a store will take to send.
+    _EST_BYTES_PER_VALUE = 16
+
+    def __init__(self, columns, priority=Priority.NORMAL):
         """Construct a new DataStore object with given columns.
 
         Params:
             fields - Column or series names for data in this batch.
+            priority - Priority of this store's data when sending
 
         Raises:
             ValueError - If `columns` is None, empty, or not a list. Also, if
-            it contains reserved names: time, time_offset.
+            it contains reserved names: time, time_offset. Or if priority is
+            not a Priority.
         """
         if columns is None or len(columns) == 0:
             raise ValueError("columns cannot be None or empty")
@@ -153,13 +172,83 @@ class DataStore(object):
             raise ValueError("columns must be a list of strings")
         for c in columns:
             utils.checkValidSeriesName(c)
+        if not isinstance(priority, Priority):
+            raise ValueError("priority must be a Priority")
 
         self._columns = list(columns)  # defensive copy
+        self._priority = priority
         self._rows = []
+        self._firstAdded = None
+        self._lock = threading.Lock()
+        self._budget = None
+        self._spillKey = None
 
     def clear(self):
         """Remove all data rows."""
-        del self._rows[:]
+        rows, _ = self._takeAll()
+        budget = self._budget
+        if budget is not None:
+            budget.release(len(rows) * self._rowBytes())
+            budget.discardSpill(self)
+
+    def _takeAll(self):
+        """Take all in-memory rows out of this store.
+
+        Returns:
+            Tuple of (rows, earliest time a row was added).
+        """
+        with self._lock:
+            rows = self._rows
+            added = self._firstAdded
+            self._rows = []
+            self._firstAdded = None
+        return (rows, added)
+
+    def swap(self):
+        """Atomically take all rows out of this store.
+
+        New rows can be added to this store while the returned snapshot is
+        being sent. If sending fails, the snapshot should be given back with
+        `restore()` so no rows are lost.
+
+        Returns:
+            A new DataStore with the same columns holding the rows that were
+            in this store (including any spilled to disk by its budget); this
+            store is left empty.
+        """
+        rows, added = self._takeAll()
+        budget = self._budget
+        if budget is not None:
+            budget.release(len(rows) * self._rowBytes())
+            spilled, spilledAdded = budget.unspill(self)
+            if len(spilled) > 0:
+                rows = spilled + rows
+                if added is None or (spilledAdded is not None and spilledAdded < added):
+                    added = spilledAdded
+
+        snapshot = DataStore(self._columns, priority=self._priority)
+        snapshot._rows = rows
+        snapshot._firstAdded = added
+        return snapshot
+
+    def restore(self, snapshot):
+        """Put rows taken with `swap()` back, ahead of any newer rows.
+
+        Params:
+            snapshot - DataStore returned by `swap()` on this store
+        """
+        # pylint: disable=protected-access
+        if snapshot is None or len(snapshot._rows) == 0:
+            return
+        if self._budget is not None:
+            # unsent rows are kept even if that goes over budget
+            self._budget.charge(len(snapshot._rows) * self._rowBytes())
+        with self._lock:
+            self._rows[0:0] = snapshot._rows
+            added = snapshot._firstAdded
+            if added is not None and (self._firstAdded is None or added < self._firstAdded):
+                self._firstAdded = added
+        # pylint: enable=protected-access
 
     def add(self, timestamp, dataDict):
         """Add row of data at a given timestamp.
@@ -173,6 +262,21 @@ class DataStore(object):
                 (a) timestamp is neither an int or a Timestamp type
                 (b) dataDict is empty or None
                 (b) dataDict contains keys not in this store
+            budget.BufferFullError - If this store is tracked by a BLOCK
+                                     budget that stays full past its
+                                     timeout, or with nothing sending.
+        """
+        row = self._makeRow(timestamp, dataDict)
+        budget = self._budget
+        if budget is not None and not budget.admit(self, self._rowBytes()):
+            return
+        self._appendRow(row)
+
+    def _makeRow(self, timestamp, dataDict):
+        """Validate and convert a timestamp and dataDict into a row.
+
+        Raises:
+            ValueError - See `add()`.
         """
         ts = None
         # validate timestamp
@@ -197,19 +301,88 @@ class DataStore(object):
                 row[f] = dataDict[f]
             else:
                 row[f] = None
-        self._rows.append(row)
+        return row
+
+    def _appendRow(self, row):
+        """Append an already validated row."""
+        with self._lock:
+            if self._firstAdded is None:
+                self._firstAdded = time()
+            self._rows.append(row)
+
+    def _dropOldest(self, nbytes):
+        """Discard the oldest rows to free at least `nbytes` (at least one row).
+
+        Returns:
+            Number of rows discarded.
+        """
+        rows, added = self._takeAll()
+        count = min(len(rows), max(1, -(-nbytes // self._rowBytes())))
+        keep = rows[count:]
+        if len(keep) > 0:
+            with self._lock:
+                self._rows[0:0] = keep
+                if self._firstAdded is None or added < self._firstAdded:
+                    self._firstAdded = added
+        if self._budget is not None:
+            self._budget.release(count * self._rowBytes())
+        return count
+
+    def _rowBytes(self):
+        """Return the estimated size of one row."""
+        return (len(self._columns) + 1) * DataStore._EST_BYTES_PER_VALUE
+
+    def _currentRows(self):
+        """Return the list of rows currently in the store (not a copy)."""
+        return self._rows
 
     def columns(self):
         """Return a copy of the columns in this store."""
         return list(self._columns)
 
+    def priority(self):
+        """Return the send Priority of this store."""
+        return self._priority
+
     def rows(self):
         """Return a copy of the rows in this store."""
         ret = []
-        for r in self._rows:
+        for r in self._currentRows():
             ret.append(r.copy())
         return ret
 
+    def numRows(self):
+        """Return the number of rows in this store."""
+        return len(self._rows)
+
+    def estimatedSize(self):
+        """Return a rough estimate of the bytes needed to send this store."""
+        return self.numRows() * self._rowBytes()
+
+    def firstAddedTime(self):
+        """Return when the oldest unsent row was added (seconds since epoch).
+
+        Returns:
+            Wall clock time the first row was added since the store was last
+            cleared, or None if the store is empty.
+        """
+        return self._firstAdded if self.numRows() > 0 else None
+
+    def spilled(self):
+        """Describe the rows its budget moved from this store to disk.
+
+        Spilled rows are not counted by `numRows()`, but are sent along with
+        the store by `swap()`.
+
+        Returns:
+            Tuple of (number of rows, wall clock time the oldest was added or
+            None if there are none).
+        """
+        budget = self._budget
+        if budget is None:
+            return (0, None)
+        return budget.spilled(self)
+
     def hasSameColumns(self, cols):
         """Check if this datastore has exactly a list of columns."""
         if cols is None or not isinstance(cols, list):
@@ -220,6 +393,22 @@ class DataStore(object):
             return set(cols) == set(self._columns)
 
 
+    def slice(self, start, end=None):
+        """Return a new DataStore with a range of this store's rows.
+
+        Params:
+            start - Index of the first row to include
+            end - Index after the last row to include; None for all rows
+                  after `start`
+
+        Returns:
+            DataStore with the same columns containing those rows.
+        """
+        ret = DataStore(self._columns, priority=self._priority)
+        ret._rows = self._currentRows()[start:end]
+        ret._firstAdded = self._firstAdded
+        return ret
+
     def split(self, chunkSize):
         """Split a store into multiple batches with `chunkSize` rows.
 
@@ -230,16 +419,163 @@ class DataStore(object):
             List of DataStores containing at most chunkSize rows from this store.
         """
         ret = []
-        for i in range(0, len(self._rows), chunkSize):
-            temp = DataStore(self._columns)
-            temp._rows = self._rows[i:i+chunkSize]
+        rows = self._currentRows()
+        for i in range(0, len(rows), chunkSize):
+            temp = DataStore(self._columns, priority=self._priority)
+            temp._rows = rows[i:i+chunkSize]
             ret.append(temp)
 
         return ret
 
     def __len__(self):
         """Return the size of this store in terms of data points."""
-        return len(self._rows) * len(self._columns)
+        return self.numRows() * len(self._columns)
+
+
+class _ThreadBuffer(object):
+    """Rows appended by a single thread to a ConcurrentDataStore."""
+
+    def __init__(self):
+        self.owner = threading.current_thread()
+        self.rows = []
+        self.firstAdded = None
+        self.lock = threading.Lock()
+
+
+class ConcurrentDataStore(DataStore):
+    """A DataStore for many producer threads adding rows at once.
+
+    Each thread appends to its own buffer, guarded by a lock that only
+    contends with `swap()`/`clear()`, never with other producers. The
+    buffers are merged in time order whenever rows are read or sent.
+    """
+
+    def __init__(self, columns, priority=Priority.NORMAL):
+        """Construct a new ConcurrentDataStore object with given columns.
+
+        Params:
+            columns - Column or series names for data in this store.
+            priority - Priority of this store's data when sending
+
+        Raises:
+            ValueError - See `DataStore`.
+        """
+        DataStore.__init__(self, columns, priority=priority)
+        self._local = threading.local()
+        self._buffers = []
+
+    def _buffer(self):
+        """Return the calling thread's buffer, registering it if needed."""
+        buf = getattr(self._local, "buf", None)
+        if buf is None:
+            buf = _ThreadBuffer()
+            self._local.buf = buf
+            with self._lock:
+                self._buffers.append(buf)
+        return buf
+
+    def _appendRow(self, row):
+        """Append an already validated row to the calling thread's buffer."""
+        buf = self._buffer()
+        with buf.lock:
+            if buf.firstAdded is None:
+                buf.firstAdded = time()
+            buf.rows.append(row)
+
+    def _take(self, clearRows):
+        """Collect rows from all buffers, optionally emptying them.
+
+        Returns:
+            Tuple of (rows sorted by time, earliest time a row was added).
+        """
+        with self._lock:
+            buffers = list(self._buffers)
+            rows = self._rows
+            added = self._firstAdded
+            if clearRows:
+                self._rows = []
+                self._firstAdded = None
+            else:
+                rows = list(rows)
+
+        for buf in buffers:
+            with buf.lock:
+                rows.extend(buf.rows)
+                if buf.firstAdded is not None and (added is None or buf.firstAdded < added):
+                    added = buf.firstAdded
+                if clearRows:
+                    buf.rows = []
+                    buf.firstAdded = None
+
+        if clearRows:
+            # Drop buffers of threads that have exited, now that they are empty
+            with self._lock:
+                self._buffers = [b for b in self._buffers
+                                 if b.owner.is_alive() or len(b.rows) > 0]
+        rows.sort(key=itemgetter("time"))
+        return (rows, added)
+
+    def _currentRows(self):
+        """Return a merged, time ordered copy of all rows."""
+        return self._take(False)[0]
+
+    def numRows(self):
+        """Return the number of rows in this store."""
+        total = len(self._rows)
+        for buf in list(self._buffers):
+            total += len(buf.rows)
+        return total
+
+    def firstAddedTime(self):
+        """Return when the oldest unsent row was added (seconds since epoch)."""
+        if self.numRows() == 0:
+            return None
+        added = self._firstAdded
+        for buf in list(self._buffers):
+            bufAdded = buf.firstAdded
+            if bufAdded is not None and (added is None or bufAdded < added):
+                added = bufAdded
+        return added
+
+    def _takeAll(self):
+        """Take the rows of all producer threads, in time order."""
+        return self._take(True)
+
+
+def mergeStores(stores):
+    """Combine DataStores into one store with the union of their columns.
+
+    Rows keep their order, store by store; columns a row did not have are
+    None. Useful for sending several small stores in one request.
+
+    Params:
+        stores - List of DataStores to merge
+
+    Returns:
+        A new DataStore containing the rows of every store, or None if
+        `stores` is empty.
+    """
+    if stores is None or len(stores) == 0:
+        return None
+    columns = []
+    for store in stores:
+        for c in store.columns():
+            if c not in columns:
+                columns.append(c)
+
+    ret = DataStore(columns)
+    for store in stores:
+        # pylint: disable=protected-access
+        for r in store._currentRows():
+            row = {"time": r["time"]}
+            for c in columns:
+                row[c] = r.get(c)
+            ret._rows.append(row)
+        added = store.firstAddedTime()
+        if added is not None and (ret._firstAdded is None or added < ret._firstAdded):
+            ret._firstAdded = added
+        # pylint: enable=protected-access
+    return ret
 
 
 class DataSeries(object):
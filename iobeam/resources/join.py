@@ -0,0 +1,174 @@
+"""Aligning several series of export results on time."""
+import heapq
+from array import array
+from collections import OrderedDict
+from enum import Enum
+
+from iobeam.resources import columns
+
+
+class Match(Enum):
+    """How points of different series are matched on time.
+
+    EXACT - Only points with equal times are matched
+    ASOF - Each row gets the latest point at or before its time
+    NEAREST - Each row gets the point closest to its time
+    """
+    EXACT = 0
+    ASOF = 1
+    NEAREST = 2
+
+
+class Table(object):
+    """Columnar table of series aligned on time.
+
+    `times` is an `array.array` of the row times, and `columns` maps each
+    series label to a list of its values per row (None where the series
+    has no matching point).
+    """
+
+    def __init__(self, times, cols, timeUnit=None):
+        """Constructor for a Table.
+
+        Params:
+            times - Column of row times
+            cols - OrderedDict of label to list of values
+            timeUnit - TimeUnit of `times`
+        """
+        self.times = times
+        self.columns = cols
+        self.timeUnit = timeUnit
+
+    def names(self):
+        """Return the labels of the value columns, in order."""
+        return list(self.columns.keys())
+
+    def column(self, name):
+        """Return the values of a column."""
+        return self.columns[name]
+
+    def rows(self):
+        """Iterate over rows as tuples of (time, value of each column)."""
+        cols = list(self.columns.values())
+        for i, t in enumerate(self.times):
+            yield (t,) + tuple(c[i] for c in cols)
+
+    def __len__(self):
+        return len(self.times)
+
+
+def _labels(series):
+    """Name each series by its name, adding the device if names repeat."""
+    names = [s.name for s in series]
+    if len(set(names)) == len(names):
+        return [str(n) for n in names]
+    return ["{}/{}".format(s.deviceId, s.name) for s in series]
+
+
+def _sortedPoints(s):
+    """Return (times, values) of a series as lists sorted by time."""
+    times = list(s.times)
+    values = list(s.values)
+    if any(times[i] > times[i + 1] for i in range(len(times) - 1)):
+        order = sorted(range(len(times)), key=lambda i: times[i])
+        times = [times[i] for i in order]
+        values = [values[i] for i in order]
+    return times, values
+
+
+def _unionTimes(timeLists):
+    """Merge sorted time lists into one sorted list without repeats."""
+    ret = []
+    for t in heapq.merge(*timeLists):
+        if len(ret) == 0 or ret[-1] != t:
+            ret.append(t)
+    return ret
+
+
+def _align(rowTimes, times, values, match, tolerance):
+    """Pick a value of one series for each row time in a single pass.
+
+    Params:
+        rowTimes - Sorted row times
+        times - Sorted times of the series
+        values - Values of the series
+        match - Match type
+        tolerance - Max distance between a row and its point, or None
+
+    Returns:
+        List of values (None where nothing matches).
+    """
+    ret = []
+    n = len(times)
+    j = 0
+    for t in rowTimes:
+        # advance to the last point at or before t
+        while j + 1 < n and times[j + 1] <= t:
+            j += 1
+        pick = None
+        if n > 0:
+            if match == Match.EXACT:
+                pick = j if times[j] == t else None
+            elif match == Match.ASOF:
+                pick = j if times[j] <= t else None
+            else:
+                pick = j
+                if times[j] <= t and j + 1 < n and times[j + 1] - t < t - times[j]:
+                    pick = j + 1
+        if pick is not None and tolerance is not None and abs(t - times[pick]) > tolerance:
+            pick = None
+        # for repeated times, use the last point with that time
+        while pick is not None and pick + 1 < n and times[pick + 1] == times[pick]:
+            pick += 1
+        ret.append(values[pick] if pick is not None else None)
+    return ret
+
+
+def join(data, match=Match.EXACT, tolerance=None, base=None, timeUnit=None):
+    """Align series on time into a single Table.
+
+    Rows are the times of the `base` series or, without a base, the times
+    of every series. Each series is matched to the rows in one merge pass,
+    so the cost grows with the total number of points.
+
+    Params:
+        data - An export response dictionary, or a list of
+               columns.SeriesColumns
+        match - Match type for points of other series
+        tolerance - Max time difference between a row and a matched point
+                    (in the time unit of the data); None for no limit
+        base - Label or index of the series whose times are the rows; None
+               to use the union of all times
+        timeUnit - With a response, TimeUnit to normalize times to
+
+    Returns:
+        A Table with one column per series.
+
+    Raises:
+        ValueError - If match is not a Match, tolerance is negative, or base
+                     is not a series.
+    """
+    if not isinstance(match, Match):
+        raise ValueError("match must be a join.Match")
+    if tolerance is not None and tolerance < 0:
+        raise ValueError("tolerance must be non-negative")
+    if isinstance(data, dict):
+        data = columns.decodeColumns(data, timeUnit=timeUnit, useNumpy=False)
+    series = list(data)
+    labels = _labels(series)
+    points = [_sortedPoints(s) for s in series]
+
+    if base is None:
+        rowTimes = _unionTimes([p[0] for p in points])
+    else:
+        if base in labels:
+            base = labels.index(base)
+        if not isinstance(base, int) or not 0 <= base < len(series):
+            raise ValueError("base must be the label or index of a series")
+        rowTimes = _unionTimes([points[base][0]])
+
+    cols = OrderedDict()
+    for label, (times, values) in zip(labels, points):
+        cols[label] = _align(rowTimes, times, values, match, tolerance)
+    unit = series[0].timeUnit if len(series) > 0 else timeUnit
+    return Table(array(columns.INT_CODE, rowTimes), cols, timeUnit=unit)
@@ -81,6 +81,79 @@ class Query(object):
         """Return parameter dictionary for this query."""
         return self._params
 
+    def cacheKey(self):
+        """Return a hashable key identifying this query's target and parameters.
+
+        Queries with equal keys ask the backend for the same results,
+        regardless of the order their parameters were set in.
+        """
+        params = tuple(sorted((k, str(v)) for k, v in self._params.items()))
+        return (self.getUrl(), params)
+
+    def getDeviceId(self):
+        """Return the device this query is limited to, or None for all."""
+        return self._did
+
+    def getSeriesName(self):
+        """Return the series this query is limited to, or None for all."""
+        return self._series
+
+    def getTimeUnit(self):
+        """Return the TimeUnit of times in this query and its results."""
+        return self._timeUnit
+
+    def getLimit(self):
+        """Return the max # of results per series, or None if not set."""
+        return self._params.get("limit")
+
+    def getMillisRange(self):
+        """Return the time range of this query in milliseconds.
+
+        Returns:
+            Tuple of (from, to), where either is None if not set.
+        """
+        return (self._params.get("from"), self._params.get("to"))
+
+    def copy(self):
+        """Return a new Query with the same target and parameters."""
+        ret = Query(self._pid, deviceId=self._did, seriesName=self._series,
+                    timeUnit=self._timeUnit)
+        ret._params = dict(self._params)
+        return ret
+
+    def withMillisRange(self, start, end):
+        """Return a copy of this query limited to a range in milliseconds.
+
+        Params:
+            start - Start of the range (ms since epoch), or None for no start
+            end - End of the range (ms since epoch), or None for no end
+
+        Returns:
+            A new Query.
+        """
+        ret = self.copy()
+        for key, val in (("from", start), ("to", end)):
+            if val is None:
+                ret._params.pop(key, None)
+            else:
+                ret._params[key] = val
+        return ret
+
+    def withTarget(self, deviceId, seriesName):
+        """Return a copy of this query for another device and series.
+
+        Params:
+            deviceId - Device to query, or None for all
+            seriesName - Series to query, or None for all
+
+        Returns:
+            A new Query with the same parameters.
+        """
+        ret = Query(self._pid, deviceId=deviceId, seriesName=seriesName,
+                    timeUnit=self._timeUnit)
+        ret._params = dict(self._params)
+        return ret
+
     def limit(self, limit):
         """Sets limit of this query, i.e., the max # of results per series."""
         msg = "limit must be a positive int"
@@ -0,0 +1,113 @@
+"""Helpers for working with the results of export queries.
+
+Export responses have the form:
+
+    {
+        "result": [
+            {
+                "project_id": <int>,
+                "device_id": <string>,
+                "sources": [
+                    {"name": <series>, "data": [{"time": ..., "value": ...}]}
+                ]
+            }
+        ],
+        "timefmt": <unit of times>
+    }
+"""
+
+
+def iterSeries(response):
+    """Iterate over the series in an export response.
+
+    Params:
+        response - Dictionary returned by an export query
+
+    Returns:
+        Generator of (deviceId, seriesName, list of {"time", "value"} dicts).
+    """
+    if not response:
+        return
+    for device in response.get("result") or []:
+        did = device.get("device_id")
+        for source in device.get("sources") or []:
+            yield (did, source.get("name"), source.get("data") or [])
+
+
+def iterPoints(responses):
+    """Iterate over every point in one or more export responses.
+
+    Params:
+        responses - A response dictionary, or an iterable of them (e.g., the
+                    pages yielded by `ExportService.iterData`)
+
+    Returns:
+        Generator of (deviceId, seriesName, time, value) tuples.
+    """
+    if isinstance(responses, dict):
+        responses = [responses]
+    for response in responses:
+        for did, name, pts in iterSeries(response):
+            for p in pts:
+                yield (did, name, p.get("time"), p.get("value"))
+
+
+def countPoints(response):
+    """Return the number of points in an export response."""
+    return sum(len(pts) for _, _, pts in iterSeries(response))
+
+
+def mergeResponses(responses):
+    """Combine export responses into one.
+
+    Points of a series found in several responses are concatenated in the
+    order of the responses.
+
+    Params:
+        responses - List of response dictionaries
+
+    Returns:
+        A new response dictionary; top level fields are copied from the
+        first response.
+    """
+    series = []
+    index = {}
+    for response in responses:
+        for did, name, pts in iterSeries(response):
+            key = (did, name)
+            if key not in index:
+                index[key] = len(series)
+                series.append((did, name, []))
+            series[index[key]][2].extend(pts)
+    return makeResponse(responses[0] if len(responses) > 0 else None, series)
+
+
+def makeResponse(template, series):
+    """Build an export response holding the given series.
+
+    Params:
+        template - Response whose top level fields (e.g., "timefmt") and
+                   device details are copied
+        series - List of (deviceId, seriesName, points) to include
+
+    Returns:
+        A new response dictionary.
+    """
+    devices = {}
+    order = []
+    for device in (template or {}).get("result") or []:
+        did = device.get("device_id")
+        if did not in devices:
+            entry = dict((k, v) for k, v in device.items() if k != "sources")
+            entry["sources"] = []
+            devices[did] = entry
+            order.append(did)
+    for did, name, pts in series:
+        if did not in devices:
+            devices[did] = {"device_id": did, "sources": []}
+            order.append(did)
+        devices[did]["sources"].append({"name": name, "data": pts})
+
+    ret = dict((k, v) for k, v in (template or {}).items() if k != "result")
+    ret["result"] = [devices[did] for did in order if len(devices[did]["sources"]) > 0]
+    return ret
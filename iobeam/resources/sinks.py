@@ -0,0 +1,288 @@
+"""Sinks that write export results to files as they are fetched."""
+import csv
+import json
+import os
+import os.path
+from numbers import Number
+
+from iobeam.resources import results
+from iobeam.utils import utils
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# columns of every sink, in order
+FIELDS = ("device_id", "series", "time", "value")
+
+
+def hasParquet():
+    """Tells whether Parquet output is available (pyarrow is installed)."""
+    return pyarrow is not None
+
+
+class Sink(object):
+    """Base class of buffered writers of (device, series, time, value) rows.
+
+    Rows are buffered in memory and written out every `bufferRows` rows (or
+    on `flush`), so memory use is bounded by the buffer. `tell` returns the
+    position after the last flushed row and `truncate` cuts the output back
+    to such a position, so an interrupted export can resume without
+    duplicating rows.
+    """
+
+    def __init__(self, bufferRows=10000):
+        """Constructor for a Sink.
+
+        Params:
+            bufferRows - Rows to buffer before writing them out
+
+        Raises:
+            ValueError - If bufferRows is not a positive int.
+        """
+        if not isinstance(bufferRows, int) or bufferRows <= 0:
+            raise ValueError("bufferRows must be a positive int")
+        self.bufferRows = bufferRows
+        self._buffer = []
+        self.rowsWritten = 0
+
+    def write(self, deviceId, name, time, value):
+        """Add one row, writing out the buffer if it is full."""
+        self._buffer.append((deviceId, name, time, value))
+        if len(self._buffer) >= self.bufferRows:
+            self.flush()
+
+    def writeResponse(self, response):
+        """Add every point of an export response (or iterable of them)."""
+        for did, name, time, value in results.iterPoints(response):
+            self.write(did, name, time, value)
+
+    def pending(self):
+        """Return the number of buffered rows not yet written out."""
+        return len(self._buffer)
+
+    def flush(self):
+        """Write out buffered rows and make them durable."""
+        if len(self._buffer) > 0:
+            self._writeRows(self._buffer)
+            self.rowsWritten += len(self._buffer)
+            self._buffer = []
+        self._sync()
+
+    def close(self):
+        """Flush remaining rows and release the output."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def _writeRows(self, rows):
+        """Write a list of rows to the output."""
+        raise NotImplementedError
+
+    def _sync(self):
+        """Make written rows durable; no-op by default."""
+        pass
+
+    def tell(self):
+        """Return the position of the output after the flushed rows."""
+        raise NotImplementedError
+
+    def truncate(self, position):
+        """Discard output after `position` (as returned by `tell`)."""
+        raise NotImplementedError
+
+
+class _FileSink(Sink):
+    """Sink writing text lines to a single file."""
+
+    def __init__(self, path, append=False, bufferRows=10000):
+        """Constructor for a file sink.
+
+        Params:
+            path - File to write to
+            append - If True, add to an existing file instead of replacing it
+            bufferRows - Rows to buffer before writing them out
+        """
+        Sink.__init__(self, bufferRows=bufferRows)
+        self.path = path
+        exists = append and os.path.isfile(path)
+        self._file = open(path, "a" if exists else "w")
+        if not exists:
+            self._writeHeader()
+
+    def _writeHeader(self):
+        """Write whatever starts a new file; nothing by default."""
+        pass
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def tell(self):
+        return self._file.tell()
+
+    def truncate(self, position):
+        self._file.flush()
+        self._file.seek(position)
+        self._file.truncate()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+
+class CsvSink(_FileSink):
+    """Writes rows as CSV with a device_id,series,time,value header."""
+
+    def _writeHeader(self):
+        csv.writer(self._file, lineterminator="\n").writerow(FIELDS)
+
+    def _writeRows(self, rows):
+        csv.writer(self._file, lineterminator="\n").writerows(rows)
+
+
+class JsonLinesSink(_FileSink):
+    """Writes rows as JSON objects, one per line."""
+
+    def _writeRows(self, rows):
+        self._file.write("".join(json.dumps(dict(zip(FIELDS, row))) + "\n" for row in rows))
+
+
+class ParquetSink(Sink):
+    """Writes rows to a directory of Parquet files, one per flush.
+
+    Each flush writes a new part file, so the files already written stay
+    valid if the export is interrupted. Values are stored as doubles, or as
+    strings with `stringValues`. Requires pyarrow.
+    """
+
+    def __init__(self, path, append=False, bufferRows=100000, stringValues=False):
+        """Constructor for a ParquetSink.
+
+        Params:
+            path - Directory to write part files to
+            append - If True, keep existing part files
+            bufferRows - Rows per part file
+            stringValues - If True, store values as strings
+
+        Raises:
+            ValueError - If pyarrow is not installed.
+        """
+        if not hasParquet():
+            raise ValueError("Parquet output requires pyarrow")
+        Sink.__init__(self, bufferRows=bufferRows)
+        self.path = path
+        self._stringValues = stringValues
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        if not append:
+            self.truncate(0)
+
+    def _partPath(self, n):
+        """Return the path of the n-th part file."""
+        return os.path.join(self.path, "part-{:05d}.parquet".format(n))
+
+    def _writeRows(self, rows):
+        cols = list(zip(*rows))
+        if self._stringValues:
+            values = pyarrow.array([None if v is None else str(v) for v in cols[3]],
+                                   type=pyarrow.string())
+        else:
+            values = pyarrow.array([float(v) if isinstance(v, Number) else None
+                                    for v in cols[3]], type=pyarrow.float64())
+        table = pyarrow.Table.from_arrays([
+            pyarrow.array([str(d) for d in cols[0]], type=pyarrow.string()),
+            pyarrow.array([str(n) for n in cols[1]], type=pyarrow.string()),
+            pyarrow.array(list(cols[2]), type=pyarrow.int64()),
+            values
+        ], names=list(FIELDS))
+        part = self.tell()
+        tmpPath = self._partPath(part) + ".tmp"
+        pyarrow.parquet.write_table(table, tmpPath)
+        os.rename(tmpPath, self._partPath(part))
+
+    def tell(self):
+        n = 0
+        while os.path.isfile(self._partPath(n)):
+            n += 1
+        return n
+
+    def truncate(self, position):
+        for name in os.listdir(self.path):
+            if name.startswith("part-") and name.endswith(".parquet") and \
+                    int(name[len("part-"):-len(".parquet")]) >= position:
+                os.remove(os.path.join(self.path, name))
+
+
+FORMATS = {
+    "csv": CsvSink,
+    "jsonl": JsonLinesSink,
+    "parquet": ParquetSink
+}
+
+
+def makeSink(fmt, path, append=False, bufferRows=None):
+    """Create a sink for a format name.
+
+    Params:
+        fmt - One of "csv", "jsonl", or "parquet"
+        path - File (or directory, for parquet) to write to
+        append - If True, keep what is already written
+        bufferRows - Rows to buffer; None for the sink's default
+
+    Raises:
+        ValueError - If the format is unknown or unavailable.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("unknown format: {}".format(fmt))
+    if bufferRows is None:
+        return FORMATS[fmt](path, append=append)
+    return FORMATS[fmt](path, append=append, bufferRows=bufferRows)
+
+
+class Checkpoint(object):
+    """Progress of an export to a sink, saved next to its output.
+
+    Records the sink position after the last flush and the newest time
+    written per series, so a resumed export truncates anything written
+    after the checkpoint and continues after the recorded times.
+    """
+
+    def __init__(self, path):
+        """Constructor for a Checkpoint.
+
+        Params:
+            path - File to keep the checkpoint in
+        """
+        self.path = path
+
+    def load(self):
+        """Return the saved (position, marks), or None if there is none.
+
+        `marks` is a list of [deviceId, seriesName, time].
+        """
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, "r") as f:
+            saved = json.load(f)
+        return saved["position"], saved["marks"]
+
+    def save(self, position, marks):
+        """Save the sink position and a dictionary of (device, series) to time."""
+        utils.atomicWrite(self.path, json.dumps({
+            "position": position,
+            "marks": [[did, name, t] for (did, name), t in sorted(marks.items())]
+        }))
+
+    def clear(self):
+        """Delete the checkpoint, e.g., once the export is complete."""
+        if os.path.isfile(self.path):
+            os.remove(self.path)
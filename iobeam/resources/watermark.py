@@ -0,0 +1,198 @@
+"""Watermarks for fetching only data newer than what was already seen."""
+import json
+import os.path
+import threading
+
+from iobeam.resources import data
+from iobeam.resources import results
+from iobeam.utils import utils
+
+
+class Watermark(object):
+    """Newest time seen for each (device, series) of a polled query.
+
+    A watermark turns a query into an incremental one: `applyEach` splits
+    the query into ranges that start at the watermarks of its series, and
+    `advance` drops points that were already seen and records the newest
+    time of each series. Polling then costs in proportion to the new data.
+
+    Points that arrive later with times older than a series' watermark are
+    not returned.
+    """
+
+    def __init__(self, path=None, timeUnit=data.TimeUnit.MILLISECONDS, groupMillis=60000):
+        """Constructor for a Watermark.
+
+        Params:
+            path - Optional file to persist the watermark to; it is loaded
+                   if it exists and rewritten on each `advance` that moves
+                   a mark
+            timeUnit - TimeUnit of the times of the polled query
+            groupMillis - Marks at most this many msec apart are fetched
+                          by the same query in `applyEach`
+
+        Raises:
+            ValueError - If timeUnit is not a TimeUnit, groupMillis is
+                         negative, or the file at path was saved with a
+                         different unit.
+        """
+        if not isinstance(timeUnit, data.TimeUnit):
+            raise ValueError("timeUnit must be a TimeUnit")
+        if groupMillis is None or groupMillis < 0:
+            raise ValueError("groupMillis must be non-negative")
+        self._path = path
+        self._unit = timeUnit
+        self._groupMillis = groupMillis
+        self._marks = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.isfile(path):
+            self._load()
+
+    def _load(self):
+        """Read the marks saved at this watermark's path."""
+        with open(self._path, "r") as f:
+            saved = json.load(f)
+        if saved.get("timefmt") != str(self._unit.value):
+            raise ValueError("watermark at {} uses a different time unit".format(self._path))
+        for did, name, t in saved.get("marks") or []:
+            self._marks[(did, name)] = t
+
+    def save(self):
+        """Write the watermark to its path (no-op without a path)."""
+        if self._path is None:
+            return
+        with self._lock:
+            marks = [[did, name, t] for (did, name), t in sorted(self._marks.items())]
+        utils.atomicWrite(self._path, json.dumps(
+            {"timefmt": str(self._unit.value), "marks": marks}))
+
+    def get(self, deviceId, seriesName):
+        """Return the newest time seen for a series, or None."""
+        with self._lock:
+            return self._marks.get((deviceId, seriesName))
+
+    def set(self, deviceId, seriesName, time):
+        """Set the newest time seen for a series (without saving)."""
+        with self._lock:
+            self._marks[(deviceId, seriesName)] = time
+
+    def marks(self):
+        """Return a dictionary of (deviceId, seriesName) to newest time seen."""
+        with self._lock:
+            return dict(self._marks)
+
+    def reset(self):
+        """Forget all marks, so the next poll fetches the whole query range."""
+        with self._lock:
+            self._marks = {}
+        self.save()
+
+    def apply(self, query):
+        """Return a copy of `query` that only fetches data not yet seen.
+
+        The from time becomes the oldest mark of any series (or stays as
+        is, if later), so every series is fetched again from there. When
+        marks differ widely, e.g., because a device stopped reporting, use
+        `applyEach` instead. The msec of the mark itself is fetched again,
+        so points with the same msec but finer times are not missed;
+        `advance` filters out the repeats.
+
+        Raises:
+            ValueError - If the query's TimeUnit differs from this watermark's.
+        """
+        if query.getTimeUnit() != self._unit:
+            raise ValueError("query must use the watermark's time unit")
+        with self._lock:
+            oldest = min(self._marks.values()) if len(self._marks) > 0 else None
+        start, end = query.getMillisRange()
+        if oldest is None:
+            return query.copy()
+        oldestMs = data.Timestamp(oldest, unit=self._unit).asMilliseconds()
+        if start is None or oldestMs > start:
+            start = oldestMs
+        return query.withMillisRange(start, end)
+
+    def applyEach(self, query):
+        """Return queries that together fetch only data of `query` not seen.
+
+        The marks of the query's series are sorted and grouped, starting a
+        new group whenever a mark is more than `groupMillis` after the
+        first mark of the current group. Each group gets one query, from
+        its first mark up to where the next group starts, covering only the
+        series of that and earlier groups (narrowed to a device or series
+        name when they all share one). The newest group's query covers the
+        whole target of `query`, so series without a mark are found, and
+        has no end besides the query's own. Each series is thus fetched
+        from about its own mark, and no range is fetched twice.
+
+        As with `apply`, the msec of a mark is fetched again; pass every
+        response to `advance`, in order.
+
+        Returns:
+            List of Query, oldest range first.
+
+        Raises:
+            ValueError - If the query's TimeUnit differs from this watermark's.
+        """
+        if query.getTimeUnit() != self._unit:
+            raise ValueError("query must use the watermark's time unit")
+        did = query.getDeviceId()
+        name = query.getSeriesName()
+        with self._lock:
+            marks = sorted((data.Timestamp(t, unit=self._unit).asMilliseconds(), key)
+                           for key, t in self._marks.items()
+                           if (did is None or key[0] == did) and
+                           (name is None or key[1] == name))
+        if len(marks) == 0:
+            return [query.copy()]
+
+        groups = []  # (first mark in msec, series of this and earlier groups)
+        for ms, key in marks:
+            if len(groups) > 0 and ms - groups[-1][0] <= self._groupMillis:
+                groups[-1][1].append(key)
+            else:
+                keys = list(groups[-1][1]) if len(groups) > 0 else []
+                groups.append((ms, keys + [key]))
+
+        start, end = query.getMillisRange()
+        ret = []
+        for i, (ms, keys) in enumerate(groups):
+            groupStart = ms if start is None else max(start, ms)
+            if i == len(groups) - 1:
+                ret.append(query.withMillisRange(groupStart, end))
+                break
+            groupEnd = groups[i + 1][0] - 1
+            if end is not None:
+                groupEnd = min(end, groupEnd)
+            if groupStart > groupEnd:
+                continue
+            devices = set(k[0] for k in keys)
+            names = set(k[1] for k in keys)
+            target = query.withTarget(devices.pop() if len(devices) == 1 else did,
+                                      names.pop() if len(names) == 1 else name)
+            ret.append(target.withMillisRange(groupStart, groupEnd))
+        return ret
+
+    def advance(self, response):
+        """Drop already seen points from a response and move the marks.
+
+        Params:
+            response - Results of a query made with `apply`
+
+        Returns:
+            A response dictionary holding only new points.
+        """
+        series = []
+        changed = False
+        with self._lock:
+            for did, name, pts in results.iterSeries(response):
+                mark = self._marks.get((did, name))
+                new = [p for p in pts if mark is None or p["time"] > mark]
+                if len(new) == 0:
+                    continue
+                series.append((did, name, new))
+                self._marks[(did, name)] = max(p["time"] for p in new)
+                changed = True
+        if changed:
+            self.save()
+        return results.makeResponse(response, series)
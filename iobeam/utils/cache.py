@@ -0,0 +1,139 @@
+"""In-process LRU cache with expiring entries."""
+import copy
+import json
+import threading
+from collections import OrderedDict
+
+from iobeam.utils import utils
+
+
+class LRUCache(object):
+    """Thread safe cache with a TTL and least recently used eviction.
+
+    Values are copied on the way in and out, so callers can modify what
+    they get back without changing the cached value.
+    """
+
+    def __init__(self, maxEntries=None, maxBytes=None, ttl=None):
+        """Constructor for an LRUCache.
+
+        Params:
+            maxEntries - Max number of entries; None for no limit
+            maxBytes - Max total size of entries (as JSON); None for no limit
+            ttl - Seconds an entry stays valid; None to never expire
+
+        Raises:
+            ValueError - If any limit is not positive.
+        """
+        for val, name in ((maxEntries, "maxEntries"), (maxBytes, "maxBytes"),
+                          (ttl, "ttl")):
+            if val is not None and val <= 0:
+                raise ValueError("{} must be positive".format(name))
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, size, expires)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @staticmethod
+    def _sizeOf(value):
+        """Estimate the size of a value by its JSON encoding."""
+        try:
+            return len(json.dumps(value))
+        except (TypeError, ValueError):
+            return 0
+
+    def get(self, key):
+        """Get the value of a key.
+
+        Returns:
+            A copy of the cached value, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= utils.timer():
+                self._remove(key)
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            # move to the most recently used end
+            del self._entries[key]
+            self._entries[key] = entry
+            self._hits += 1
+            value = entry[0]
+        return copy.deepcopy(value)
+
+    def put(self, key, value):
+        """Cache a value, evicting least recently used entries if needed.
+
+        Values larger than `maxBytes` are not cached.
+
+        Params:
+            key - Hashable key
+            value - Value to cache (not None)
+        """
+        if value is None:
+            return
+        size = LRUCache._sizeOf(value) if self.maxBytes is not None else 0
+        if self.maxBytes is not None and size > self.maxBytes:
+            return
+        value = copy.deepcopy(value)
+        expires = utils.timer() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires)
+            self._bytes += size
+            while len(self._entries) > 0 and \
+                    ((self.maxEntries is not None and len(self._entries) > self.maxEntries) or
+                     (self.maxBytes is not None and self._bytes > self.maxBytes)):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def _remove(self, key):
+        """Remove an entry; caller must hold the lock."""
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, key):
+        """Remove a key from the cache, if present."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        """Remove all entries (statistics are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        """Return the number of entries (including expired ones not yet removed)."""
+        return len(self._entries)
+
+    def stats(self):
+        """Summarize cache use.
+
+        Returns:
+            Dict with "hits", "misses", "hitRate", "evictions", "expirations",
+            "entries", and "bytes".
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hitRate": float(self._hits) / lookups if lookups > 0 else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes
+            }
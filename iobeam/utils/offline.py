@@ -0,0 +1,176 @@
+"""Persistent queue of batches that could not be sent while offline."""
+import json
+import os
+import os.path
+import threading
+
+import requests
+
+from iobeam.resources import data
+from iobeam.utils import utils
+
+_PREFIX = "iobeam-offline-"
+
+# subdirectory for batches the server rejected
+REJECTED_DIR = "rejected"
+
+# 4xx responses that may succeed when retried later
+_RETRYABLE_4XX = (401, 408, 429)
+
+
+class UnreadableBatchError(Exception):
+    """Raised when a queued batch cannot be read, e.g., a corrupt file."""
+    pass
+
+
+class ServerUnavailableError(Exception):
+    """Raised when the server answers with a status worth retrying later.
+
+    Attributes:
+        status - HTTP status code of the response
+    """
+
+    def __init__(self, status, extra):
+        """Constructor for a ServerUnavailableError.
+
+        Params:
+            status - HTTP status code of the response, or None if unknown
+            extra - Error response from the server
+        """
+        Exception.__init__(self, "server unavailable ({}): {}".format(status, extra))
+        self.status = status
+
+
+def isNetworkError(err):
+    """Tells whether an error means the backend could not be reached.
+
+    Only connection errors and timeouts of `requests` count; local errors,
+    such as failing to read or write the queue, do not. For a
+    PartialImportError, its cause is checked.
+    """
+    cause = getattr(err, "cause", None)
+    if cause is not None:
+        err = cause
+    return isinstance(err, (requests.exceptions.ConnectionError,
+                            requests.exceptions.Timeout))
+
+
+def isPermanentStatus(status):
+    """Tells whether a failed response means a batch will never be accepted.
+
+    Only 4xx responses other than 401, 408, and 429 are permanent; server
+    errors, throttling, and expired tokens are retried later.
+    """
+    return status is not None and 400 <= status < 500 and status not in _RETRYABLE_4XX
+
+
+def isTransientError(err):
+    """Tells whether sending should stop and be retried after a while.
+
+    True for network errors and for ServerUnavailableError.
+    """
+    return isNetworkError(err) or isinstance(err, ServerUnavailableError)
+
+
+class OfflineQueue(object):
+    """Directory of batches waiting for the backend to be reachable.
+
+    Each batch is a JSON file holding a device ID and the rows of a
+    DataStore. File names start with the time of the batch's oldest row,
+    so `entries` lists batches in time order. Files are written atomically
+    and only removed once sent, so queued data survives restarts. Batches
+    the server rejects are moved to the `rejected` subdirectory, where they
+    are kept for inspection but not sent again.
+    """
+
+    def __init__(self, path):
+        """Constructor for an OfflineQueue.
+
+        Params:
+            path - Directory to keep queued batches in; created if missing
+        """
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def put(self, deviceId, store):
+        """Queue the rows of a DataStore (no-op if it is empty).
+
+        Params:
+            deviceId - Device the data belongs to
+            store - DataStore whose rows are queued; it is not modified
+
+        Returns:
+            Path of the queued batch, or None if the store was empty.
+        """
+        rows = store.rows()
+        if len(rows) == 0:
+            return None
+        oldest = min(r["time"] for r in rows)
+        with self._lock:
+            self._count += 1
+            name = "{}{:020d}-{}-{}.json".format(_PREFIX, oldest, os.getpid(), self._count)
+        entry = os.path.join(self.path, name)
+        utils.atomicWrite(entry, json.dumps({
+            "device_id": deviceId,
+            "columns": store.columns(),
+            "priority": store.priority().name,
+            "rows": rows
+        }))
+        return entry
+
+    def entries(self):
+        """Return the paths of queued batches, oldest data first."""
+        names = [n for n in os.listdir(self.path)
+                 if n.startswith(_PREFIX) and n.endswith(".json")]
+        return [os.path.join(self.path, n) for n in sorted(names)]
+
+    @staticmethod
+    def load(entry):
+        """Read a queued batch.
+
+        Params:
+            entry - Path from `entries`
+
+        Returns:
+            Tuple of (deviceId, DataStore).
+
+        Raises:
+            UnreadableBatchError - If the batch file is missing or corrupt.
+        """
+        try:
+            with open(entry, "r") as f:
+                saved = json.load(f)
+            store = data.DataStore(saved["columns"],
+                                   priority=data.Priority[saved.get("priority", "NORMAL")])
+            for row in saved["rows"]:
+                values = dict((k, v) for k, v in row.items() if k != "time")
+                store.add(data.Timestamp(row["time"], unit=data.TimeUnit.MICROSECONDS), values)
+            return saved["device_id"], store
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            raise UnreadableBatchError("cannot read {}: {}".format(entry, e))
+
+    @staticmethod
+    def remove(entry):
+        """Delete a queued batch, e.g., once it was sent."""
+        if os.path.isfile(entry):
+            os.remove(entry)
+
+    def reject(self, entry):
+        """Move a queued batch to the rejected subdirectory."""
+        rejectedPath = os.path.join(self.path, REJECTED_DIR)
+        if not os.path.isdir(rejectedPath):
+            os.makedirs(rejectedPath)
+        os.rename(entry, os.path.join(rejectedPath, os.path.basename(entry)))
+
+    def rejected(self):
+        """Return the paths of batches the server rejected."""
+        rejectedPath = os.path.join(self.path, REJECTED_DIR)
+        if not os.path.isdir(rejectedPath):
+            return []
+        return [os.path.join(rejectedPath, n) for n in sorted(os.listdir(rejectedPath))]
+
+    def __len__(self):
+        return len(self.entries())
@@ -0,0 +1,298 @@
+"""On-disk cache of export results that knows which time ranges it holds."""
+import bisect
+import hashlib
+import itertools
+import json
+import os.path
+import threading
+from time import time
+
+from iobeam.resources import data
+from iobeam.resources import results
+from iobeam.utils import utils
+
+# numbers segment files, so instances sharing a directory never clash
+_SEGMENT_IDS = itertools.count(1)
+
+class IntervalSet(object):
+    """Set of disjoint, closed integer intervals kept in sorted order."""
+
+    def __init__(self, intervals=None):
+        """Constructor for an IntervalSet.
+
+        Params:
+            intervals - Optional list of (start, end) pairs to add
+        """
+        self._starts = []
+        self._ends = []
+        for start, end in intervals or []:
+            self.add(start, end)
+
+    def add(self, start, end):
+        """Add [start, end], merging it with overlapping or adjacent intervals.
+
+        Raises:
+            ValueError - If end is before start.
+        """
+        if end < start:
+            raise ValueError("end cannot be less than start")
+        # first interval that could touch the new one (its end >= start - 1)
+        i = bisect.bisect_left(self._ends, start - 1)
+        j = i
+        while j < len(self._starts) and self._starts[j] <= end + 1:
+            start = min(start, self._starts[j])
+            end = max(end, self._ends[j])
+            j += 1
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+    def gaps(self, start, end):
+        """Return the parts of [start, end] not in the set.
+
+        Returns:
+            List of (start, end) pairs, in order.
+        """
+        ret = []
+        i = bisect.bisect_left(self._ends, start)
+        cur = start
+        while i < len(self._starts) and self._starts[i] <= end:
+            if self._starts[i] > cur:
+                ret.append((cur, self._starts[i] - 1))
+            cur = max(cur, self._ends[i] + 1)
+            i += 1
+        if cur <= end:
+            ret.append((cur, end))
+        return ret
+
+    def covers(self, start, end):
+        """Tells whether all of [start, end] is in the set."""
+        return len(self.gaps(start, end)) == 0
+
+    def intervals(self):
+        """Return the intervals as a list of (start, end) pairs."""
+        return list(zip(self._starts, self._ends))
+
+
+class RangeCache(object):
+    """Cache of export results on disk, indexed by the time ranges held.
+
+    Results are kept per token, query target, and parameters other than the
+    time range (e.g., project/device/series, time unit, and value filters),
+    so data fetched with one token is never returned for another. For each
+    such stream, an index file under `path` records the millisecond
+    intervals fetched and the segment files holding their points; a query
+    then only requests the parts of its range that are not covered, and
+    the answer is assembled from the segments overlapping its range.
+
+    Each fetched range is written to a new segment, so adding data costs
+    in proportion to the data fetched rather than to everything cached.
+
+    Queries with a limit are not cached, since their results do not cover
+    their whole range.
+    """
+
+    def __init__(self, path, lag=60000):
+        """Constructor for a RangeCache.
+
+        Params:
+            path - Directory to keep cache files in
+            lag - Milliseconds before now that are fetched but never
+                  recorded as covered, since data for them may still arrive
+
+        Raises:
+            ValueError - If path is not a directory or lag is negative.
+        """
+        if path is None or not os.path.isdir(path):
+            raise ValueError("path must be an existing directory")
+        if lag is None or lag < 0:
+            raise ValueError("lag must be non-negative")
+        self._path = path
+        self._lag = lag
+        self._lock = threading.Lock()
+        self._queries = 0
+        self._requests = 0
+        self._hits = 0
+
+    @staticmethod
+    def _streamKey(query, token):
+        """Return the JSON-able key of a query and token, ignoring its time range."""
+        url, params = query.cacheKey()
+        return [utils.tokenHash(token), url,
+                [list(p) for p in params if p[0] not in ("from", "to")]]
+
+    def _fileFor(self, key):
+        """Return the index file path of a stream key."""
+        digest = hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+        return os.path.join(self._path, "iobeam-range-{}-{}.json".format(key[0][:16], digest))
+
+    @staticmethod
+    def _load(path):
+        """Read an index file; a missing or unreadable file is empty."""
+        empty = {"intervals": [], "devices": {}, "segments": []}
+        if not os.path.isfile(path):
+            return empty
+        try:
+            with open(path, "r") as f:
+                loaded = json.load(f)
+        except ValueError:
+            utils.getLogger().warning("ignoring corrupt range cache %s", path)
+            return empty
+        return loaded if isinstance(loaded, dict) else empty
+
+    def _loadSegments(self, index, start, end):
+        """Read the points of the segments of an index overlapping [start, end].
+
+        Returns:
+            List of (deviceId, seriesName, [[time, value], ...]).
+        """
+        ret = []
+        for segStart, segEnd, name in index.get("segments") or []:
+            if segEnd < start or segStart > end:
+                continue
+            try:
+                with open(os.path.join(self._path, name), "r") as f:
+                    ret.extend(json.load(f))
+            except (IOError, ValueError):
+                utils.getLogger().warning("ignoring unreadable range cache segment %s", name)
+        return ret
+
+    def getData(self, query, token, fetch):
+        """Get the results of a query, fetching only uncovered time ranges.
+
+        Params:
+            query - iobeam.resources.Query to answer
+            token - Token the query is made with; cached data is only
+                    shared between queries with the same token
+            fetch - Callable taking a Query and returning its results as a
+                    response dictionary, raising on failure
+
+        Returns:
+            A response dictionary, in the same format as export queries.
+        """
+        if query.getLimit() is not None:
+            return fetch(query)
+
+        unit = query.getTimeUnit()
+        now = int(time() * 1000)
+        start, end = query.getMillisRange()
+        start = 0 if start is None else start
+        end = now if end is None else end
+        key = RangeCache._streamKey(query, token)
+        path = self._fileFor(key)
+
+        with self._lock:
+            index = RangeCache._load(path)
+        gaps = IntervalSet(index["intervals"]).gaps(start, end)
+
+        fetched = []
+        for gapStart, gapEnd in gaps:
+            utils.getLogger().debug("range cache fetching %s-%s", gapStart, gapEnd)
+            fetched.append((gapStart, gapEnd, fetch(query.withMillisRange(gapStart, gapEnd))))
+        with self._lock:
+            self._queries += 1
+            self._requests += len(fetched)
+            if len(fetched) == 0:
+                self._hits += 1
+            if len(fetched) > 0:
+                index = self._merge(path, key, fetched, unit, now - self._lag)
+
+        series = []
+        for dev, name, pts in self._loadSegments(index, start, end):
+            inRange = [{"time": t, "value": v} for t, v in pts
+                       if start <= data.Timestamp(t, unit=unit).asMilliseconds() <= end]
+            if len(inRange) > 0:
+                series.append((dev, name, inRange))
+        # points of a gap newer than the lag are returned but not stored
+        for _, _, resp in fetched:
+            for dev, name, pts in results.iterSeries(resp):
+                recent = [p for p in pts
+                          if data.Timestamp(p["time"], unit=unit).asMilliseconds() >
+                          now - self._lag]
+                if len(recent) > 0:
+                    series.append((dev, name, recent))
+
+        template = {
+            "result": [dict(d) for d in index["devices"].values()],
+            "timefmt": str(unit.value)
+        }
+        return results.makeResponse(template, RangeCache._combine(series))
+
+    # pylint: disable=too-many-arguments
+    def _merge(self, path, key, fetched, unit, settled):
+        """Write fetched results as new segments and update the index.
+
+        Only the new segments and the (small) index are written; existing
+        segments are left as they are. The caller must hold the lock.
+
+        Returns:
+            The updated index.
+        """
+        index = RangeCache._load(path)
+        covered = IntervalSet(index["intervals"])
+        devices = index["devices"]
+        segments = index.get("segments") or []
+        base = os.path.basename(path)[:-len(".json")]
+        for gapStart, gapEnd, resp in fetched:
+            for dev in resp.get("result") or []:
+                entry = dict((k, v) for k, v in dev.items() if k != "sources")
+                devices[str(dev.get("device_id"))] = entry
+            if gapStart > settled:
+                continue
+            segEnd = min(gapEnd, settled)
+            points = []
+            for dev, name, pts in results.iterSeries(resp):
+                kept = sorted([p["time"], p["value"]] for p in pts
+                              if data.Timestamp(p["time"], unit=unit).asMilliseconds() <= settled)
+                if len(kept) > 0:
+                    points.append([dev, name, kept])
+            segName = "{}.{}-{}.{}-{}.json".format(base, gapStart, segEnd, os.getpid(),
+                                                   next(_SEGMENT_IDS))
+            utils.atomicWrite(os.path.join(self._path, segName), json.dumps(points))
+            segments.append([gapStart, segEnd, segName])
+            covered.add(gapStart, segEnd)
+
+        index = {
+            "key": key,
+            "intervals": [list(i) for i in covered.intervals()],
+            "devices": devices,
+            "segments": sorted(segments)
+        }
+        utils.atomicWrite(path, json.dumps(index))
+        return index
+    # pylint: enable=too-many-arguments
+
+    @staticmethod
+    def _combine(series):
+        """Merge lists of points of the same series, sorted by time."""
+        merged = {}
+        order = []
+        for dev, name, pts in series:
+            if (dev, name) not in merged:
+                merged[(dev, name)] = {}
+                order.append((dev, name))
+            for p in pts:
+                merged[(dev, name)][p["time"]] = p
+        return [(dev, name, [merged[(dev, name)][t] for t in sorted(merged[(dev, name)])])
+                for dev, name in order]
+
+    def clear(self):
+        """Delete all cache files."""
+        with self._lock:
+            for name in os.listdir(self._path):
+                if name.startswith("iobeam-range-") and name.endswith(".json"):
+                    os.remove(os.path.join(self._path, name))
+
+    def stats(self):
+        """Summarize cache use.
+
+        Returns:
+            Dict with "queries" (answered through the cache), "requests"
+            (made for uncovered ranges), and "hits" (queries answered
+            without any request).
+        """
+        with self._lock:
+            return {
+                "queries": self._queries,
+                "requests": self._requests,
+                "hits": self._hits
+            }
@@ -0,0 +1,118 @@
+"""Persistent local record of devices registered with iobeam."""
+import json
+import os.path
+import threading
+
+from iobeam.resources import device
+from iobeam.utils import utils
+
+REGISTRY_FILE = "iobeam_devices.json"
+
+
+class DeviceRegistry(object):
+    """On-disk registry of devices known to be registered, keyed by project.
+
+    Clients consult the registry before registering a device, so restarts
+    do not repeat registration calls for devices that already exist. The
+    file is a JSON object mapping project IDs to objects that map device
+    IDs to `{"name": <deviceName>}`. Every change rewrites the file
+    atomically, after merging in what other processes have written.
+    """
+
+    def __init__(self, path):
+        """Constructor for a DeviceRegistry.
+
+        Params:
+            path - Directory where the registry file is kept
+        """
+        self._file = os.path.join(path, REGISTRY_FILE)
+        self._lock = threading.Lock()
+        self._projects = self._load()
+
+    def _load(self):
+        """Read the registry file; a missing or unreadable file is empty."""
+        if not os.path.isfile(self._file):
+            return {}
+        try:
+            with open(self._file, "r") as f:
+                loaded = json.load(f)
+        except ValueError:
+            utils.getLogger().warning("ignoring corrupt device registry %s",
+                                      self._file)
+            return {}
+        return loaded if isinstance(loaded, dict) else {}
+
+    def get(self, projectId, deviceId):
+        """Get a registered device.
+
+        Params:
+            projectId - Project the device belongs to
+            deviceId - ID of the device
+
+        Returns:
+            Device object if the device is in the registry, otherwise None.
+        """
+        with self._lock:
+            entry = self._projects.get(str(projectId), {}).get(deviceId)
+        if entry is None:
+            return None
+        return device.Device(projectId, deviceId, deviceName=entry.get("name"))
+
+    def contains(self, projectId, deviceId):
+        """Tells whether a device is in the registry."""
+        with self._lock:
+            return deviceId in self._projects.get(str(projectId), {})
+
+    def devices(self, projectId):
+        """Get all registered devices of a project.
+
+        Returns:
+            List of Device objects.
+        """
+        with self._lock:
+            entries = dict(self._projects.get(str(projectId), {}))
+        return [device.Device(projectId, did, deviceName=entries[did].get("name"))
+                for did in entries]
+
+    def add(self, dev):
+        """Record that a device is registered.
+
+        Params:
+            dev - Device object to add
+        """
+        self.addAll([dev])
+
+    def addAll(self, devs):
+        """Record that several devices are registered, with a single write.
+
+        Params:
+            devs - List of Device objects to add
+        """
+        devs = list(devs)
+        if len(devs) == 0:
+            return
+        with self._lock:
+            self._projects = self._load()
+            for dev in devs:
+                project = self._projects.setdefault(str(dev.projectId), {})
+                project[dev.deviceId] = {"name": dev.deviceName}
+            self._save()
+
+    def remove(self, projectId, deviceId):
+        """Forget a device, e.g., after it is deleted from iobeam.
+
+        Returns:
+            True if the device was in the registry.
+        """
+        with self._lock:
+            self._projects = self._load()
+            project = self._projects.get(str(projectId), {})
+            if deviceId not in project:
+                return False
+            del project[deviceId]
+            self._save()
+            return True
+
+    def _save(self):
+        """Write the registry to disk; caller must hold the lock."""
+        utils.atomicWrite(self._file, json.dumps(self._projects, sort_keys=True))
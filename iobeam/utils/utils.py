@@ -1,8 +1,11 @@
 """Common utility functions."""
+import hashlib
 import jwt
 import logging
+import os
 import re
 import sys
+import tempfile
 import time
 
 IS_PY3 = sys.version_info >= (3, 0)
@@ -16,21 +19,32 @@ if IS_PY3:
 
 EXPIRY_FUDGE = 1000 * 60 * 60 * 24  # one day in milliseconds
 
-def isExpiredToken(projectToken):
-    """Check if token's expiry date (minus a bit) has passed.
+# High resolution clock used for measuring elapsed time (in seconds).
+# pylint: disable=no-member
+timer = time.perf_counter if IS_PY3 else time.time
+# pylint: enable=no-member
 
-    Token is expired if the current time is after the expiry date less EXPIRY_FUDGE.
+# Decoded expiry times (ms since epoch), keyed by token string
+__TOKEN_EXPIRY_CACHE = {}
+__TOKEN_EXPIRY_CACHE_MAX = 64
+
+def getTokenExpiry(projectToken):
+    """Get a token's expiry time, decoding it only the first time it is seen.
 
     Params:
         projectToken - JWT token to decode
 
     Returns:
-        True if expired; False otherwise.
+        Expiry time of the token in milliseconds since epoch.
 
     Raises:
         ValueError - projectToken is not a valid JWT token
     """
     checkValidProjectToken(projectToken)
+    exp = __TOKEN_EXPIRY_CACHE.get(projectToken)
+    if exp is not None:
+        return exp
+
     opts = {"verify_signature": False, "verify_exp": False}
     try:
         decoded = jwt.decode(projectToken.replace("+", "-").replace("/", "_"),
@@ -38,6 +52,29 @@ def isExpiredToken(projectToken):
     except jwt.DecodeError:
         raise ValueError("invalid jwt token")
     exp = int(decoded["exp"]) * 1000
+
+    if len(__TOKEN_EXPIRY_CACHE) >= __TOKEN_EXPIRY_CACHE_MAX:
+        __TOKEN_EXPIRY_CACHE.clear()
+    __TOKEN_EXPIRY_CACHE[projectToken] = exp
+    return exp
+
+
+def isExpiredToken(projectToken):
+    """Check if token's expiry date (minus a bit) has passed.
+
+    Token is expired if the current time is after the expiry date less EXPIRY_FUDGE.
+    The token is only decoded the first time it is checked.
+
+    Params:
+        projectToken - JWT token to decode
+
+    Returns:
+        True if expired; False otherwise.
+
+    Raises:
+        ValueError - projectToken is not a valid JWT token
+    """
+    exp = getTokenExpiry(projectToken)
     now = int(time.time() * 1000)
 
     return now >= (exp - EXPIRY_FUDGE)
@@ -106,6 +143,64 @@ def checkValidProjectToken(token):
     """
     __checkNon0LengthString(token, "token")
 
+def tokenHash(token):
+    """Return a short digest of a token, to scope cached data to it.
+
+    The digest identifies the token without storing it in cache keys or
+    file names.
+    """
+    if not isinstance(token, bytes):
+        token = token.encode("utf-8")
+    return hashlib.sha256(token).hexdigest()[:32]
+
+def emitSpan(hooks, name, start, info):
+    """Report a timing span to every hook in `hooks`.
+
+    Hooks are callables taking `(name, seconds, info)`. A hook that raises
+    is logged and otherwise ignored, so instrumentation can never break a
+    request.
+
+    Params:
+        hooks - List of hook callables
+        name - Name of the span, e.g., "http.send"
+        start - Value of `timer()` when the span began
+        info - Dictionary of extra details (byte counts, URLs, etc)
+    """
+    elapsed = timer() - start
+    for hook in hooks:
+        try:
+            hook(name, elapsed, info)
+        except Exception:  # pylint: disable=broad-except
+            getLogger().warning("hook failed for span %s", name, exc_info=True)
+
+def atomicWrite(path, contents):
+    """Write `contents` to the file at `path` so readers never see a partial file.
+
+    The contents are written to a temporary file in the same directory,
+    flushed to disk, and then renamed over `path`.
+
+    Params:
+        path - Path of the file to (over)write
+        contents - String to write
+    """
+    dirName = os.path.dirname(os.path.abspath(path))
+    fd, tmpPath = tempfile.mkstemp(dir=dirName, prefix=".iobeam-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(contents)
+            f.flush()
+            os.fsync(f.fileno())
+        if IS_PY3:
+            os.replace(tmpPath, path)  # pylint: disable=no-member
+        else:
+            if os.name == "nt" and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmpPath, path)
+    except Exception:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
 __LOGGER = None
 
 def getLogger():
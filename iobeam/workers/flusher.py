@@ -0,0 +1,123 @@
+"""Background sending of buffered data when size or age thresholds are met."""
+from time import time
+from iobeam.utils import utils
+from iobeam.workers import worker
+
+
+def checkValidThresholds(maxRows, maxBytes, maxAge, checkInterval):
+    """Check that flush thresholds are usable.
+
+    Raises:
+        ValueError - If no threshold is given, any is not positive, or
+                     `checkInterval` is None.
+    """
+    if maxRows is None and maxBytes is None and maxAge is None:
+        raise ValueError("at least one flush threshold must be set")
+    if checkInterval is None:
+        raise ValueError("checkInterval cannot be None")
+    for val in [maxRows, maxBytes, maxAge, checkInterval]:
+        if val is not None and val <= 0:
+            raise ValueError("flush thresholds must be positive")
+
+
+class AutoFlusher(worker.Worker):
+    """Periodically checks a client's buffers and sends them in the background.
+
+    A flush is triggered when any configured threshold is crossed: the
+    number of buffered rows, the estimated size in bytes, or the age (in
+    seconds) of the oldest buffered row. Producers only ever append to the
+    client's stores, so they never wait on the network.
+
+    The target must provide `_pendingStats()`, returning a tuple of
+    (rows, estimated bytes, time oldest row was added or None), and `send()`.
+    """
+
+    _MAX_BACKOFF = 60.0  # seconds
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, target, maxRows=None, maxBytes=None, maxAge=None,
+                 checkInterval=1.0):
+        """Constructor for an AutoFlusher.
+
+        Params:
+            target - Client whose buffers are flushed
+            maxRows - Flush when at least this many rows are buffered
+            maxBytes - Flush when buffers are estimated at this many bytes
+            maxAge - Flush when the oldest buffered row is this many
+                     seconds old
+            checkInterval - Seconds between threshold checks
+
+        Raises:
+            ValueError - If no threshold is given, or any is not positive.
+        """
+        checkValidThresholds(maxRows, maxBytes, maxAge, checkInterval)
+        worker.Worker.__init__(self, "iobeam-autoflush")
+
+        self._target = target
+        self._maxRows = maxRows
+        self._maxBytes = maxBytes
+        self._maxAge = maxAge
+        self._interval = checkInterval
+        self._wait = checkInterval
+    # pylint: enable=too-many-arguments
+
+    def shouldFlush(self):
+        """Check whether any threshold has been crossed."""
+        rows, size, oldest = self._target._pendingStats()  # pylint: disable=protected-access
+        if rows == 0:
+            return False
+        if self._maxRows is not None and rows >= self._maxRows:
+            return True
+        if self._maxBytes is not None and size >= self._maxBytes:
+            return True
+        if self._maxAge is not None and oldest is not None:
+            return time() - oldest >= self._maxAge
+        return False
+
+    def requestFlush(self):
+        """Ask the background thread to flush as soon as possible."""
+        self._wake()
+
+    def _flush(self):
+        """Send the target's data, returning whether it succeeded."""
+        try:
+            self._target.send()
+            return True
+        except Exception:  # pylint: disable=broad-except
+            utils.getLogger().warning("background send failed", exc_info=True)
+            return False
+
+    def _firstWait(self):
+        self._wait = self._interval
+        return self._wait
+
+    def _runOnce(self, woken):
+        """Flush if requested or a threshold is crossed, backing off on failure."""
+        if woken or self.shouldFlush():
+            if self._flush():
+                self._wait = self._interval
+            else:
+                self._wait = min(self._wait * 2, max(self._interval, AutoFlusher._MAX_BACKOFF))
+        return self._wait
+
+    def stop(self, drain=True, timeout=None):  # pylint: disable=arguments-differ
+        """Stop the background thread.
+
+        Params:
+            drain - If True, buffered data is sent one last time after the
+                    thread stops.
+            timeout - Max seconds to wait for an in-progress send to finish;
+                      None waits indefinitely.
+
+        Returns:
+            True if the thread stopped (and drained, if requested)
+            successfully; False otherwise.
+        """
+        if not worker.Worker.stop(self, timeout=timeout):
+            return False
+
+        if drain:
+            rows, _, _ = self._target._pendingStats()  # pylint: disable=protected-access
+            if rows > 0:
+                return self._flush()
+        return True
@@ -0,0 +1,54 @@
+"""Running many blocking tasks with bounded concurrency."""
+import threading
+
+
+def runAll(tasks, maxWorkers):
+    """Run callables using at most `maxWorkers` threads at a time.
+
+    Errors raised by a task are captured rather than propagated, so one
+    failure does not stop the remaining tasks.
+
+    Params:
+        tasks - List of callables taking no arguments
+        maxWorkers - Max number of tasks to run at once; 1 (or fewer) runs
+                     them in order on the calling thread
+
+    Returns:
+        A list of (result, error) tuples in the same order as `tasks`, where
+        `error` is the exception the task raised, or None.
+    """
+    results = [None] * len(tasks)
+
+    def runOne(i):
+        try:
+            results[i] = (tasks[i](), None)
+        except Exception as e:  # pylint: disable=broad-except
+            results[i] = (None, e)
+
+    if maxWorkers is None or maxWorkers <= 1 or len(tasks) <= 1:
+        for i in range(0, len(tasks)):
+            runOne(i)
+        return results
+
+    lock = threading.Lock()
+    nextIdx = [0]
+
+    def worker():
+        while True:
+            with lock:
+                i = nextIdx[0]
+                nextIdx[0] += 1
+            if i >= len(tasks):
+                return
+            runOne(i)
+
+    threads = []
+    for _ in range(0, min(maxWorkers, len(tasks))):
+        t = threading.Thread(target=worker, name="iobeam-worker")
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+
+    return results
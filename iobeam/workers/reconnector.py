@@ -0,0 +1,40 @@
+"""Background sending of data queued while a client was offline."""
+from iobeam.utils import utils
+from iobeam.workers import worker
+
+
+class Reconnector(worker.Worker):
+    """Periodically lets an offline client check whether it is back online.
+
+    Every `probeInterval` seconds the target's `_reconnect()` is called,
+    which probes the backend and, once it is reachable, sends the data
+    that was queued while offline. No application code has to run for a
+    device to catch up after an outage.
+    """
+
+    def __init__(self, target, probeInterval=30.0):
+        """Constructor for a Reconnector.
+
+        Params:
+            target - Client providing `_reconnect()`
+            probeInterval - Seconds between checks
+
+        Raises:
+            ValueError - If probeInterval is not positive.
+        """
+        if probeInterval is None or probeInterval <= 0:
+            raise ValueError("probeInterval must be positive")
+        worker.Worker.__init__(self, "iobeam-reconnect")
+        self._target = target
+        self._probeInterval = probeInterval
+
+    def _firstWait(self):
+        return self._probeInterval
+
+    def _runOnce(self, woken):
+        """Let the target check the backend and send its queue."""
+        try:
+            self._target._reconnect()  # pylint: disable=protected-access
+        except Exception:  # pylint: disable=broad-except
+            utils.getLogger().warning("sending offline queue failed", exc_info=True)
+        return self._probeInterval
@@ -0,0 +1,69 @@
+"""Background refreshing of project tokens before they expire."""
+from time import time
+from iobeam.utils import utils
+from iobeam.workers import worker
+
+
+class TokenRefresher(worker.Worker):
+    """Refreshes a client's project token in the background.
+
+    The token is refreshed `margin` seconds before the client would consider
+    it expired (see `utils.EXPIRY_FUDGE`), so sends never have to wait on a
+    refresh request.
+
+    The target must provide a `projectToken` attribute and
+    `_refreshIfNeeded(force)`, which refreshes the token.
+    """
+
+    _MAX_WAIT = 60 * 60.0  # re-check at least hourly (seconds)
+
+    def __init__(self, target, margin=60 * 60, retryInterval=60):
+        """Constructor for a TokenRefresher.
+
+        Params:
+            target - Client whose token is refreshed
+            margin - Seconds before the client's expiry check to refresh
+            retryInterval - Seconds to wait before retrying a failed refresh
+
+        Raises:
+            ValueError - If margin is negative or retryInterval not positive.
+        """
+        if margin is None or margin < 0:
+            raise ValueError("margin must be non-negative")
+        if retryInterval is None or retryInterval <= 0:
+            raise ValueError("retryInterval must be positive")
+        worker.Worker.__init__(self, "iobeam-token-refresh")
+        self._target = target
+        self._margin = margin
+        self._retryInterval = retryInterval
+
+    def secondsUntilRefresh(self):
+        """Seconds until the current token should be refreshed (may be < 0).
+
+        Raises:
+            ValueError - If the target's token is not a valid JWT token.
+        """
+        exp = utils.getTokenExpiry(self._target.projectToken)
+        refreshAt = (exp - utils.EXPIRY_FUDGE) / 1000.0 - self._margin
+        return refreshAt - time()
+
+    def _runOnce(self, woken):
+        """Refresh the token if it is due, returning the wait until the next check."""
+        try:
+            wait = self.secondsUntilRefresh()
+        except ValueError:
+            utils.getLogger().warning("token is not a JWT; not refreshing")
+            return None
+
+        if wait <= 0:
+            try:
+                self._target._refreshIfNeeded(True)  # pylint: disable=protected-access
+                wait = self.secondsUntilRefresh()
+            except Exception:  # pylint: disable=broad-except
+                utils.getLogger().warning("background token refresh failed",
+                                          exc_info=True)
+                wait = 0
+            if wait <= 0:
+                # failed, or the new token is just as close to expiring
+                wait = self._retryInterval
+        return min(wait, TokenRefresher._MAX_WAIT)
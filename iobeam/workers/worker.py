@@ -0,0 +1,95 @@
+"""Base class of the background threads of a client."""
+import threading
+
+
+class Worker(object):
+    """Runs a task in a daemon thread, waiting between runs.
+
+    Subclasses implement `_runOnce(woken)`, which does one round of work
+    and returns the seconds to wait before the next round (or None to end
+    the thread), and may override `_firstWait()`. A waiting thread is woken
+    early by `stop()` or `_wake()`.
+    """
+
+    def __init__(self, name):
+        """Constructor for a Worker.
+
+        Params:
+            name - Name of the background thread
+        """
+        self._name = name
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._woken = False
+        self._thread = None
+
+    def start(self):
+        """Start the background thread (no-op if already running)."""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._woken = False
+            self._thread = threading.Thread(target=self._run, name=self._name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def isRunning(self):
+        """Tells whether the background thread is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def _firstWait(self):
+        """Seconds to wait before the first round; 0 runs it at once."""
+        return 0
+
+    def _runOnce(self, woken):
+        """Do one round of work.
+
+        Params:
+            woken - True if `_wake()` was called since the last round
+
+        Returns:
+            Seconds to wait before the next round, or None to stop.
+        """
+        raise NotImplementedError()
+
+    def _wake(self):
+        """Run the next round as soon as possible."""
+        with self._cond:
+            self._woken = True
+            self._cond.notify()
+
+    def _run(self):
+        """Main loop of the background thread."""
+        wait = self._firstWait()
+        while True:
+            with self._cond:
+                if not self._stopping and not self._woken and wait > 0:
+                    self._cond.wait(wait)
+                if self._stopping:
+                    return
+                woken = self._woken
+                self._woken = False
+            wait = self._runOnce(woken)
+            if wait is None:
+                return
+
+    def stop(self, timeout=None):
+        """Stop the background thread.
+
+        Params:
+            timeout - Max seconds to wait for an in-progress round
+
+        Returns:
+            True if the thread stopped; False otherwise.
+        """
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._cond.notify()
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                return False
+        self._thread = None
+        return True
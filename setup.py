@@ -117,9 +117,11 @@ setup(
     # To provide executable scripts, use entry points in preference to the
     # "scripts" keyword. Entry points provide cross-platform support and allow
     # pip to create the appropriate form of executable for the target platform.
-    #entry_points={
-    #    'console_scripts': [
-    #        'sample=sample:main',
-    #    ],
-    #},
+    entry_points={
+        'console_scripts': [
+            'iobeam-export=iobeam.cli.export:main',
+            'iobeam-import=iobeam.cli.importer:main',
+            'iobeam-backfill=iobeam.cli.backfill:main',
+        ],
+    },
 )
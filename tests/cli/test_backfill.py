@@ -0,0 +1,184 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+if sys.version_info > (3, 2):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+from iobeam.cli import backfill
+from iobeam.cli import importer
+from iobeam.endpoints import imports
+from tests.http import dummy_backend
+
+_TOKEN = "dummy"
+
+RecordingRequester = dummy_backend.RecordingRequester
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_saveLoadClear(self):
+        cp = backfill.Checkpoint(os.path.join(self.path, "cp.json"))
+        self.assertEqual({}, cp.load())
+        files = {"/a.csv": {"devices": {"d1": 10}, "done": False}}
+        cp.save(files)
+        self.assertEqual(files, backfill.Checkpoint(cp.path).load())
+        cp.clear()
+        self.assertEqual({}, cp.load())
+        cp.clear()
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.checkpoint = backfill.Checkpoint(os.path.join(self.path, "cp.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _write(self, name, rows):
+        path = os.path.join(self.path, name)
+        with open(path, "w") as f:
+            f.write("time,dev,a\n")
+            for t, dev in rows:
+                f.write("{},{},{}\n".format(t, dev, t))
+        return path
+
+    def _backfill(self, requester, **kwargs):
+        service = imports.ImportService(_TOKEN, requester=requester)
+        mapping = importer.ColumnMapping(deviceColumn="dev")
+        return backfill.Backfill(service, 1, mapping, self.checkpoint, **kwargs)
+
+    def test_completeFilesSkipped(self):
+        a = self._write("a.csv", [(i, "d1") for i in range(0, 5)])
+        b = self._write("b.csv", [(i, "d2") for i in range(0, 5)])
+        requester = RecordingRequester()
+        bf = self._backfill(requester, chunkRows=2)
+        self.assertTrue(bf.runFile(a))
+        self.assertTrue(bf.runFile(b))
+        self.assertEqual(10, bf.finish()["rowsImported"])
+        self.assertTrue(self.checkpoint.load()[os.path.abspath(a)]["done"])
+
+        requester = RecordingRequester()
+        bf = self._backfill(requester)
+        self.assertTrue(bf.runFile(a))
+        self.assertTrue(bf.runFile(b))
+        self.assertEqual(0, len(requester.bodies))
+
+    def test_resumeAfterFailure(self):
+        path = self._write("a.csv", [(i, "a" if i % 2 == 0 else "b") for i in range(0, 12)])
+        requester = RecordingRequester(failDevices=set(["b"]))
+        bf = self._backfill(requester, chunkRows=2, concurrency=1)
+        self.assertFalse(bf.runFile(path))
+        stats = bf.finish()
+        self.assertEqual(2, stats["rowsImported"])
+        self.assertEqual(2, stats["rowsFailed"])
+        accepted = [r["a"] for d, r in requester.rows() if d == "a"]
+        self.assertEqual([0, 2], accepted)
+        self.assertEqual({"a": 3}, self.checkpoint.load()[os.path.abspath(path)]["devices"])
+
+        requester = RecordingRequester()
+        bf = self._backfill(requester, chunkRows=2, concurrency=1)
+        self.assertTrue(bf.runFile(path))
+        stats = bf.finish()
+        self.assertEqual(2, stats["rowsResumed"])
+        self.assertEqual(10, stats["rowsImported"])
+        resent = sorted(r["a"] for _, r in requester.rows())
+        self.assertEqual(sorted(set(range(0, 12)) - set(accepted)), resent)
+
+    def test_resumeAfterPartialAck(self):
+        path = self._write("a.csv", [(i, "d1") for i in range(0, 10)])
+        bf = self._backfill(RecordingRequester(), chunkRows=5, concurrency=1)
+
+        def partial(pid, did, batch):
+            return imports.ImportResult(False, "error", ackedChunks=1, totalChunks=2,
+                                        acked=3, remaining=batch.slice(3))
+
+        with patch.object(bf._service, "importBatch", side_effect=partial):
+            self.assertFalse(bf.runFile(path))
+        self.assertEqual(3, bf.finish()["rowsImported"])
+        self.assertEqual({"d1": 3}, self.checkpoint.load()[os.path.abspath(path)]["devices"])
+
+        requester = RecordingRequester()
+        bf = self._backfill(requester, chunkRows=5, concurrency=1)
+        self.assertTrue(bf.runFile(path))
+        self.assertEqual(3, bf.finish()["rowsResumed"])
+        self.assertEqual(list(range(3, 10)), [r["a"] for _, r in requester.rows()])
+
+    def test_resumeAfterEarlierChunkFailed(self):
+        path = self._write("a.csv", [(i, "d1") for i in range(0, 8)])
+        requester = RecordingRequester()
+        bf = self._backfill(requester, chunkRows=2, concurrency=2)
+        real = bf._service.importBatch
+        calls = []
+
+        def failFirst(pid, did, batch):
+            calls.append(batch.numRows())
+            if len(calls) == 1:
+                return imports.ImportResult(False, "error", status=500)
+            return real(pid, did, batch)
+
+        with patch.object(bf._service, "importBatch", side_effect=failFirst):
+            self.assertFalse(bf.runFile(path))
+        self.assertEqual(1, len(calls))
+
+        bf = self._backfill(requester, chunkRows=2, concurrency=2)
+        self.assertTrue(bf.runFile(path))
+        bf.finish()
+        sent = [r["a"] for _, r in requester.rows()]
+        self.assertEqual(list(range(0, 8)), sorted(sent))
+
+    def test_throttle(self):
+        path = self._write("a.csv", [(i, "d1") for i in range(0, 30)])
+        bf = self._backfill(RecordingRequester(), rowsPerSec=10, chunkRows=10, concurrency=1)
+        sleeps = []
+        bf._sleep = sleeps.append
+        self.assertTrue(bf.runFile(path))
+        self.assertEqual(2, len(sleeps))
+        self.assertAlmostEqual(1.0, sleeps[0], delta=0.1)
+        self.assertAlmostEqual(2.0, sleeps[1], delta=0.1)
+
+    def test_badRate(self):
+        self.assertRaises(ValueError, self._backfill, RecordingRequester(), rowsPerSec=0)
+
+
+class TestBackfillCommand(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _args(self, *extra):
+        return backfill.makeParser().parse_args([
+            "--token", _TOKEN, "--project", "1", "--device", "d1", "--quiet",
+            "--checkpoint", os.path.join(self.path, "cp.json")] + list(extra))
+
+    def test_run(self):
+        path = os.path.join(self.path, "a.jsonl")
+        with open(path, "w") as f:
+            f.write('{"time": 1, "a": 1}\n{"time": 2, "a": 2}\n')
+        stats = backfill.run(self._args(path), requester=RecordingRequester())
+        self.assertTrue(stats["complete"])
+        self.assertEqual(2, stats["rowsImported"])
+
+        requester = RecordingRequester()
+        backfill.run(self._args(path), requester=requester)
+        self.assertEqual(0, len(requester.bodies))
+        backfill.run(self._args("--restart", path), requester=requester)
+        self.assertEqual(2, len(requester.rows()))
+
+    def test_runStdin(self):
+        self.assertRaises(ValueError, backfill.run, self._args("-"),
+                          requester=RecordingRequester())
@@ -0,0 +1,116 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+if sys.version_info > (3, 2):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+from iobeam.cli import export
+from iobeam.endpoints import exports
+from iobeam.resources import query
+from iobeam.resources import sinks
+from tests.http import dummy_backend
+from tests.http import request
+
+_TOKEN = "dummy"
+
+
+# (deviceId, series) -> (start, stop, step, scale), see dummy_backend.makePoints
+_POINTS = {
+    ("dev1", "a"): (0, 100, 10, 2),
+    ("dev2", "b"): (5, 100, 20, -1)
+}
+
+
+class FailingBackend(dummy_backend.ExportBackend):
+    """Export backend that fails every request after the first `okCalls`."""
+
+    def __init__(self, points, okCalls):
+        dummy_backend.ExportBackend.__init__(self, points)
+        self.okCalls = okCalls
+
+    def getData(self):
+        if len(self.queries) >= self.okCalls:
+            self.queries.append(dict(self.lastParams or {}))
+            return {"http_status_code": 500}
+        return dummy_backend.ExportBackend.getData(self)
+
+
+class TestExportTo(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.output = os.path.join(self.path, "out.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _lines(self):
+        with open(self.output, "r") as f:
+            return f.read().splitlines()
+
+    def _export(self, backend, checkpoint, resume=False):
+        service = exports.ExportService(_TOKEN, requester=request.DummyRequester(backend))
+        sink = sinks.CsvSink(self.output, append=resume, bufferRows=3)
+        try:
+            return service.exportTo(query.Query(1).fromTime(0), sink,
+                                    checkpoint=checkpoint, pageSize=2)
+        finally:
+            sink.close()
+
+    def test_exportTo(self):
+        backend = dummy_backend.ExportBackend(dummy_backend.makePoints(_POINTS))
+        rows = self._export(backend, None)
+        self.assertEqual(15, rows)
+        lines = self._lines()
+        self.assertEqual("device_id,series,time,value", lines[0])
+        self.assertEqual(16, len(lines))
+        self.assertEqual(15, len(set(lines[1:])))
+
+    def test_exportToResumes(self):
+        backend = dummy_backend.ExportBackend(dummy_backend.makePoints(_POINTS))
+        self._export(backend, None)
+        want = sorted(self._lines())
+
+        cp = sinks.Checkpoint(self.output + ".checkpoint")
+        self.assertRaises(request.UnknownCodeError, self._export,
+                          FailingBackend(dummy_backend.makePoints(_POINTS), 3), cp)
+        self.assertIsNotNone(cp.load())
+
+        backend = dummy_backend.ExportBackend(dummy_backend.makePoints(_POINTS))
+        self._export(backend, cp, resume=True)
+        self.assertEqual(want, sorted(self._lines()))
+        self.assertIsNone(cp.load())
+
+
+class TestExportCommand(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_run(self):
+        output = os.path.join(self.path, "out.jsonl")
+        args = export.makeParser().parse_args([
+            "--token", _TOKEN, "--project", "1", "--device", "dev1", "--from", "0",
+            "--format", "jsonl", "--output", output, "--time-unit", "sec"])
+        backend = dummy_backend.ExportBackend(dummy_backend.makePoints(_POINTS))
+        out = io.StringIO() if sys.version_info > (3, 0) else io.BytesIO()
+        rows = export.run(args, requester=request.DummyRequester(backend), out=out)
+        self.assertEqual(10, rows)
+        self.assertTrue("exported 10 rows" in out.getvalue())
+        self.assertEqual("sec", backend.queries[0]["timefmt"])
+        self.assertFalse(os.path.exists(output + ".checkpoint"))
+
+    def test_mainErrors(self):
+        with patch.dict(os.environ, {export.TOKEN_ENV: ""}):
+            with patch.object(sys, "stderr", io.StringIO() if sys.version_info > (3, 0)
+                              else io.BytesIO()):
+                self.assertRaises(SystemExit, export.main,
+                                  ["--project", "1", "--output", "x.csv"])
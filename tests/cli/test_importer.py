@@ -0,0 +1,178 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from iobeam.cli import importer
+from iobeam.endpoints import imports
+from iobeam.resources import data
+from tests.http import dummy_backend
+
+_TOKEN = "dummy"
+
+RecordingRequester = dummy_backend.RecordingRequester
+
+
+class TestColumnMapping(unittest.TestCase):
+
+    def test_parse(self):
+        m = importer.ColumnMapping(timeUnit=data.TimeUnit.SECONDS, deviceColumn="dev")
+        did, ts, values = m.parse({"time": "1.5", "dev": "d1", "temp": "20.5",
+                                   "state": "on", "empty": ""})
+        self.assertEqual("d1", did)
+        self.assertEqual(1500000, ts.asMicroseconds())
+        self.assertEqual({"temp": 20.5, "state": "on"}, values)
+
+    def test_parseMapped(self):
+        m = importer.ColumnMapping(timeColumn="ts", deviceId="d1", series={"t": "temp"})
+        _, ts, values = m.parse({"ts": 10, "t": 3, "other": 4})
+        self.assertEqual(10, ts.asMilliseconds())
+        self.assertEqual({"temp": 3}, values)
+
+    def test_parseUnicode(self):
+        m = importer.ColumnMapping(deviceColumn=u"dev")
+        did, ts, values = m.parse({u"time": u"10", u"dev": u"d1", u"temp": u"20.5",
+                                   u"state": u"\u00e9t\u00e9"})
+        self.assertEqual(u"d1", did)
+        self.assertEqual(10, ts.asMilliseconds())
+        self.assertEqual({u"temp": 20.5, u"state": u"\u00e9t\u00e9"}, values)
+        self.assertEqual(3, importer.parseValue(u"3"))
+        self.assertRaises(ValueError, m.parse, {u"time": u"x", u"dev": u"d1", u"a": 1})
+
+    def test_parseErrors(self):
+        self.assertRaises(ValueError, importer.ColumnMapping)
+        self.assertRaises(ValueError, importer.ColumnMapping, deviceId="d", deviceColumn="c")
+        m = importer.ColumnMapping(deviceColumn="dev")
+        self.assertRaises(ValueError, m.parse, {"time": "x", "dev": "d", "a": 1})
+        self.assertRaises(ValueError, m.parse, {"time": 1, "dev": "", "a": 1})
+        self.assertRaises(ValueError, m.parse, {"time": 1, "dev": "d"})
+
+
+class TestImporter(unittest.TestCase):
+
+    def _importer(self, requester, **kwargs):
+        service = imports.ImportService(_TOKEN, requester=requester)
+        mapping = importer.ColumnMapping(deviceColumn="dev")
+        return importer.Importer(service, 1, mapping, **kwargs)
+
+    def test_chunksAndConcurrency(self):
+        requester = RecordingRequester()
+        imp = self._importer(requester, chunkRows=10, concurrency=3)
+        for i in range(0, 95):
+            imp.add({"time": i, "dev": "d{}".format(i % 2), "a": i})
+        imp.add({"time": "bad", "dev": "d0", "a": 1})
+        stats = imp.finish()
+        self.assertEqual(96, stats["rowsRead"])
+        self.assertEqual(95, stats["rowsImported"])
+        self.assertEqual(1, stats["rowsSkipped"])
+        self.assertEqual(0, stats["rowsFailed"])
+        self.assertTrue(all(len(b["sources"]["data"]) <= 10 for b in requester.bodies))
+        rows = requester.rows()
+        self.assertEqual(95, len(rows))
+        self.assertEqual(set(range(0, 95)), set(r["a"] for _, r in rows))
+        self.assertEqual(set(["d0", "d1"]), set(d for d, _ in rows))
+
+    def test_newSeriesStartsNewChunk(self):
+        requester = RecordingRequester()
+        imp = self._importer(requester)
+        imp.add({"time": 1, "dev": "d", "a": 1})
+        imp.add({"time": 2, "dev": "d", "a": 2, "b": 3})
+        imp.finish()
+        self.assertEqual([["a"], ["a", "b"]],
+                         [[f for f in b["sources"]["fields"] if f != "time"]
+                          for b in requester.bodies])
+
+    def test_failuresCounted(self):
+        requester = RecordingRequester(failDevices=set(["bad"]))
+        progress = io.StringIO() if sys.version_info > (3, 0) else io.BytesIO()
+        imp = self._importer(requester, concurrency=2, progress=progress)
+        for i in range(0, 4):
+            imp.add({"time": i, "dev": "bad" if i % 2 else "good", "a": i})
+        stats = imp.finish()
+        self.assertEqual(2, stats["rowsImported"])
+        self.assertEqual(2, stats["rowsFailed"])
+        self.assertEqual("bad", imp.errors[0][0])
+        self.assertTrue(progress.getvalue().startswith("done: 2 rows imported"))
+
+    def test_maxBufferedRows(self):
+        requester = RecordingRequester()
+        imp = self._importer(requester, chunkRows=100, concurrency=1, maxBufferedRows=10)
+        for i in range(0, 40):
+            imp.add({"time": i, "dev": "big" if i % 4 == 0 else "d{}".format(i), "a": i})
+            self.assertTrue(imp._buffered <= 10)
+        # the device with the most buffered rows is uploaded first
+        self.assertEqual("big", requester.bodies[0]["device_id"])
+        self.assertEqual(40, imp.finish()["rowsImported"])
+        self.assertEqual(0, imp._buffered)
+
+    def test_badArgs(self):
+        self.assertRaises(ValueError, self._importer, RecordingRequester(), chunkRows=0)
+        self.assertRaises(ValueError, self._importer, RecordingRequester(), concurrency=0)
+        self.assertRaises(ValueError, self._importer, RecordingRequester(),
+                          maxBufferedRows=0)
+
+
+class TestImportCommand(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _write(self, name, text):
+        path = os.path.join(self.path, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_runCsvAndJsonLines(self):
+        csvPath = self._write("a.csv", "ts,temp,hum\n1,20.5,40\n2,21,\n")
+        jsonPath = self._write("b.jsonl", '{"ts": 3, "temp": 22}\n\n{"ts": 4, "hum": 41}\n')
+        args = importer.makeParser().parse_args([
+            "--token", _TOKEN, "--project", "1", "--device", "d1", "--time-column", "ts",
+            "--time-unit", "sec", "--map", "temp=temperature", "--map", "hum",
+            "--quiet", csvPath, jsonPath])
+        requester = RecordingRequester()
+        stats = importer.run(args, requester=requester)
+        self.assertEqual(4, stats["rowsImported"])
+        rows = sorted((r["time"], r.get("temperature"), r.get("hum"))
+                      for _, r in requester.rows())
+        self.assertEqual([(1000000, 20.5, 40), (2000000, 21, None),
+                          (3000000, 22, None), (4000000, None, 41)], rows)
+
+    def test_runUnicodeJsonLines(self):
+        path = self._write("a.jsonl",
+                           '{"ts": "1", "temp": "20.5", "state": "\\u00e9t\\u00e9"}\n')
+        args = importer.makeParser().parse_args([
+            "--token", _TOKEN, "--project", "1", "--device", "d1", "--time-column", "ts",
+            "--quiet", path])
+        requester = RecordingRequester()
+        stats = importer.run(args, requester=requester)
+        self.assertEqual(1, stats["rowsImported"])
+        row = requester.rows()[0][1]
+        self.assertEqual((1000, 20.5, u"\u00e9t\u00e9"),
+                         (row["time"], row["temp"], row["state"]))
+
+    def test_runMalformedJsonLines(self):
+        path = self._write("a.jsonl", '{"ts": 1, "temp": 20}\n{"ts": 2,\n[1, 2]\n'
+                           '{"ts": 3, "temp": 21}\n')
+        args = importer.makeParser().parse_args([
+            "--token", _TOKEN, "--project", "1", "--device", "d1", "--time-column", "ts",
+            "--quiet", path])
+        stats = importer.run(args, requester=RecordingRequester())
+        self.assertEqual(4, stats["rowsRead"])
+        self.assertEqual(2, stats["rowsImported"])
+        self.assertEqual(2, stats["rowsSkipped"])
+
+    def test_parserRequiresDevice(self):
+        err = io.StringIO() if sys.version_info > (3, 0) else io.BytesIO()
+        stderr = sys.stderr
+        sys.stderr = err
+        try:
+            self.assertRaises(SystemExit, importer.makeParser().parse_args,
+                              ["--project", "1", "x.csv"])
+        finally:
+            sys.stderr = stderr
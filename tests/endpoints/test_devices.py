@@ -124,6 +124,44 @@ class TestDeviceService(unittest.TestCase):
             self.assertEqual(2, dummy.calls)
             self.assertTrue(str(e).startswith("Received unexpected code: 422"))
 
+    def test_registerDevices(self):
+        dummy = DummyBackend()
+        service = DeviceService(_TOKEN, requester=request.DummyRequester(dummy))
+        service.registerDevice(1, deviceId="dev2", deviceName="name2")
+
+        devs = [("dev1", "name1"), ("dev2", "name2b"), ("bad id", "name3"),
+                ("dev4", "name4")]
+        ret = service.registerDevices(1, devs, maxConcurrency=1)
+        self.assertEqual(4, len(ret))
+        self.assertEqual(["dev1", "dev2", "bad id", "dev4"],
+                         [r.deviceId for r in ret])
+        self.assertTrue(ret[0].ok())
+        self._checkDevice(ret[0].device, 1, "dev1", "name1")
+        self.assertTrue(isinstance(ret[1].error, devices.DuplicateIdError))
+        self.assertFalse(ret[1].ok())
+        self.assertTrue(isinstance(ret[2].error, ValueError))
+        self.assertTrue(ret[3].ok())
+        self.assertEqual(4, dummy.calls)  # bad id never sent
+
+    def test_registerDevicesSetOnDupe(self):
+        dummy = DummyBackend()
+        service = DeviceService(_TOKEN, requester=request.DummyRequester(dummy))
+        service.registerDevice(1, deviceId="dev1", deviceName="name1")
+
+        ret = service.registerDevices(1, ["dev1", ("dev2", "name2")],
+                                      setOnDupe=True, maxConcurrency=1)
+        self.assertTrue(ret[0].ok())
+        self.assertTrue(ret[0].existed)
+        self._checkDevice(ret[0].device, 1, "dev1", None)
+        self.assertTrue(ret[1].ok())
+        self.assertFalse(ret[1].existed)
+        self.assertEqual(3, dummy.calls)
+
+    def test_registerDevicesNoToken(self):
+        service = DeviceService(None, requester=request.DummyRequester(DummyBackend()))
+        self.assertRaises(request.UnauthorizedError,
+                          service.registerDevices, 1, ["dev1"])
+
     def test_registerBadToken(self):
         registerReturn = (_NONE_DEVICE_ID, _NONE_DEVICE_NAME)
         dummy = DummyBackend(registerReturn=registerReturn)
@@ -1,7 +1,11 @@
+import threading
+import time
 import unittest
 
 from iobeam.endpoints import exports
 from iobeam.resources import query
+from iobeam.resources import results
+from iobeam.utils import cache
 from tests.http import dummy_backend
 from tests.http import request
 
@@ -84,3 +88,278 @@ class TestExportService(unittest.TestCase):
         self.assertEqual(2, dummy.calls)
 
     # TODO test error conditions
+
+
+# (deviceId, series) -> (start, stop, step, scale), see dummy_backend.makePoints
+_POINTS = {
+    ("dev1", "a"): (0, 100, 10, 2),   # 10 points
+    ("dev1", "b"): (5, 30, 10, -1),   # 3 points
+    ("dev2", "a"): (0, 100, 25, 1)    # 4 points
+}
+
+
+class TestIterData(unittest.TestCase):
+
+    def _service(self, points=None):
+        backend = dummy_backend.ExportBackend(points or dummy_backend.makePoints(_POINTS))
+        service = ExportService(_TOKEN, requester=request.DummyRequester(backend))
+        return backend, service
+
+    def _collect(self, pages):
+        ret = {}
+        for did, name, t, v in results.iterPoints(pages):
+            ret.setdefault((did, name), []).append((t, v))
+        return ret
+
+    def test_iterDataSingle(self):
+        backend, service = self._service()
+        pages = list(service.iterData(Query(_PROJECT_ID)))
+        self.assertEqual(1, len(pages))
+        self.assertEqual(17, results.countPoints(pages[0]))
+        self.assertEqual(1, backend.calls)
+
+    def test_iterDataBadArgs(self):
+        _, service = self._service()
+        self.assertRaises(ValueError, service.iterData, Query(_PROJECT_ID), pageSize=0)
+        self.assertRaises(ValueError, service.iterData, Query(_PROJECT_ID), window="1")
+        self.assertRaises(ValueError, service.iterData, Query(_PROJECT_ID), window=10)
+
+    def test_iterDataPaged(self):
+        backend, service = self._service()
+        pages = list(service.iterData(Query(_PROJECT_ID), pageSize=3))
+        self.assertEqual(dummy_backend.makePoints(_POINTS), self._collect(pages))
+        for page in pages:
+            for _, _, pts in results.iterSeries(page):
+                self.assertTrue(len(pts) <= 3)
+        self.assertTrue(backend.calls > 1)
+        # pages resume at the last time of the full series, asking for one
+        # more point to make up for the one already yielded there
+        self.assertEqual(4, backend.queries[1]["limit"])
+        self.assertEqual(20, backend.queries[1]["from"])
+
+    def test_iterDataPagedSameTime(self):
+        points = {("dev1", "a"): [(0, 0), (1, 1), (2, 2), (2, 3), (2, 4), (2, 5), (3, 6)]}
+        _, service = self._service(points)
+        got = self._collect(service.iterData(Query(_PROJECT_ID), pageSize=2))
+        self.assertEqual(points[("dev1", "a")], got[("dev1", "a")])
+
+        # finer times within the same msec are not lost either
+        points = {("dev1", "a"): [(0, 0), (0.25, 1), (0.5, 2), (0.5, 3), (1, 4)]}
+        _, service = self._service(points)
+        q = Query(_PROJECT_ID, timeUnit=query.TimeUnit.MICROSECONDS)
+        got = self._collect(service.iterData(q, pageSize=2))
+        self.assertEqual([(0, 0), (250, 1), (500, 2), (500, 3), (1000, 4)], got[("dev1", "a")])
+
+    def test_iterDataPagedLimit(self):
+        _, service = self._service()
+        q = Query(_PROJECT_ID, deviceId="dev1", seriesName="a").limit(5)
+        got = self._collect(service.iterData(q, pageSize=2))
+        self.assertEqual(dummy_backend.makePoints(_POINTS)[("dev1", "a")][:5], got[("dev1", "a")])
+
+    def test_iterDataWindows(self):
+        backend, service = self._service()
+        q = Query(_PROJECT_ID).inTimeRange(0, 99)
+        pages = list(service.iterData(q, window=40))
+        self.assertEqual(3, backend.calls)
+        self.assertEqual([(0, 39), (40, 79), (80, 99)],
+                         [(p["from"], p["to"]) for p in backend.queries])
+        self.assertEqual(dummy_backend.makePoints(_POINTS), self._collect(pages))
+
+    def test_iterDataWindowsSeconds(self):
+        points = {("dev1", "a"): [(t * 1000, t) for t in range(0, 10)]}
+        backend, service = self._service(points)
+        q = Query(_PROJECT_ID, timeUnit=query.TimeUnit.SECONDS).inTimeRange(0, 9)
+        got = self._collect(service.iterData(q, pageSize=2, window=5))
+        self.assertEqual([(t, t) for t in range(0, 10)], got[("dev1", "a")])
+        self.assertEqual([0, 1000, 3000, 5000, 6000, 8000],
+                         [p["from"] for p in backend.queries])
+
+    def test_iterDataError(self):
+        dummy = DummyBackend()
+        service = ExportService("wrong", requester=request.DummyRequester(dummy))
+        pages = service.iterData(Query(_PROJECT_ID))
+        self.assertRaises(request.UnknownCodeError, list, pages)
+
+
+class ConcurrentExportRequester(request.DummyRequester):
+    """Requester making a new export backend per call, tracking concurrency."""
+
+    def __init__(self, points, delay=0.02):
+        request.DummyRequester.__init__(self, None)
+        self.points = points
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.queries = []
+
+    def get(self, url):
+        requester = self
+
+        class Slow(dummy_backend.ExportBackend):
+            def getData(self):
+                with requester.lock:
+                    requester.inFlight += 1
+                    requester.maxInFlight = max(requester.maxInFlight, requester.inFlight)
+                time.sleep(requester.delay)
+                with requester.lock:
+                    requester.inFlight -= 1
+                    requester.queries.append(dict(self.lastParams or {}))
+                return dummy_backend.ExportBackend.getData(self)
+
+        r = Slow(self.points)
+        r.method = "GET"
+        r.url = url
+        return r
+
+
+class TestGetDataMany(unittest.TestCase):
+
+    def test_getDataMany(self):
+        points = dummy_backend.makePoints(_POINTS)
+        requester = ConcurrentExportRequester(points)
+        service = ExportService(_TOKEN, requester=requester)
+        queries = [Query(_PROJECT_ID, deviceId=d, seriesName=s)
+                   for d, s in sorted(points) for _ in range(0, 3)]
+        ret = service.getDataMany(queries, maxConcurrency=4)
+        self.assertEqual(len(queries), len(ret))
+        for q in queries:
+            did = q.getUrl().split("/")[1]
+            name = q.getUrl().split("/")[2]
+            self.assertEqual(len(points[(did, name)]), results.countPoints(ret[q]))
+        self.assertTrue(requester.maxInFlight > 1)
+        self.assertTrue(requester.maxInFlight <= 4)
+
+    def test_getDataManyErrors(self):
+        dummy = DummyBackend()
+        service = ExportService(_TOKEN, requester=request.DummyRequester(dummy))
+        self.assertEqual({}, service.getDataMany([]))
+        self.assertRaises(ValueError, service.getDataMany, [None])
+
+        class Failing(ExportService):
+            def _getData(self, query, strict):
+                if query.getLimit() == 1:
+                    raise request.Error("failed")
+                return {"ok": True}
+
+        service = Failing(_TOKEN, requester=request.DummyRequester(dummy))
+        good = Query(_PROJECT_ID)
+        bad = Query(_PROJECT_ID).limit(1)
+        self.assertRaises(request.Error, service.getDataMany, [good, bad])
+        ret = service.getDataMany([good, bad], raiseOnError=False)
+        self.assertEqual({"ok": True}, ret[good])
+        self.assertTrue(isinstance(ret[bad], request.Error))
+
+    def test_getDataManyBadStatus(self):
+        backend = dummy_backend.ExportBackend(dummy_backend.makePoints(_POINTS))
+        service = ExportService("wrong", requester=request.DummyRequester(backend))
+        qry = Query(_PROJECT_ID)
+        self.assertRaises(request.UnknownCodeError, service.getDataMany, [qry])
+        ret = service.getDataMany([qry], raiseOnError=False)
+        self.assertTrue(isinstance(ret[qry], request.UnknownCodeError))
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def test_getDataCached(self):
+        backend = dummy_backend.ExportBackend(dummy_backend.makePoints(_POINTS))
+        qcache = cache.LRUCache(ttl=60)
+        service = ExportService(_TOKEN, requester=request.DummyRequester(backend),
+                                cache=qcache)
+        first = service.getData(Query(_PROJECT_ID).limit(2).fromTime(0))
+        # same parameters set in another order, by another service
+        other = ExportService(_TOKEN, requester=request.DummyRequester(backend),
+                              cache=qcache)
+        second = other.getData(Query(_PROJECT_ID).fromTime(0).limit(2))
+        self.assertEqual(first, second)
+        self.assertEqual(1, len(backend.queries))
+        self.assertEqual(1, qcache.stats()["hits"])
+
+        other.getData(Query(_PROJECT_ID).fromTime(0).limit(3))
+        self.assertEqual(2, len(backend.queries))
+
+    def test_getDataCachedPerToken(self):
+        backend = dummy_backend.ExportBackend(dummy_backend.makePoints(_POINTS))
+        qcache = cache.LRUCache(ttl=60)
+        resps = []
+        for token in [_TOKEN, "othertoken", _TOKEN]:
+            service = ExportService(token, requester=request.DummyRequester(backend),
+                                    cache=qcache)
+            resps.append(service.getData(Query(_PROJECT_ID).limit(2)))
+        # the other token is checked by the backend (and refused)
+        self.assertEqual(2, backend.calls)
+        self.assertEqual(403, resps[1]["status_code"])
+        self.assertEqual(resps[0], resps[2])
+        self.assertEqual(1, qcache.stats()["hits"])
+
+    def test_getDataErrorNotCached(self):
+        dummy = DummyBackend()
+        qcache = cache.LRUCache()
+        service = ExportService("badtoken", requester=request.DummyRequester(dummy),
+                                cache=qcache)
+        service.getData(Query(_PROJECT_ID))
+        service.getData(Query(_PROJECT_ID))
+        self.assertEqual(2, dummy.calls)
+        self.assertEqual(0, len(qcache))
+
+
+class TestGetColumns(unittest.TestCase):
+
+    def test_getColumns(self):
+        backend = dummy_backend.ExportBackend(dummy_backend.makePoints(_POINTS))
+        service = ExportService(_TOKEN, requester=request.DummyRequester(backend))
+        q = Query(_PROJECT_ID, deviceId="dev1", seriesName="a",
+                  timeUnit=query.TimeUnit.MICROSECONDS)
+        cols = service.getColumns(q, useNumpy=False)
+        self.assertEqual(1, len(cols))
+        self.assertEqual([t * 1000 for t, _ in dummy_backend.makePoints(_POINTS)[("dev1", "a")]],
+                         list(cols[0].times))
+        self.assertEqual([float(v) for _, v in dummy_backend.makePoints(_POINTS)[("dev1", "a")]],
+                         list(cols[0].values))
+
+    def test_getColumnsError(self):
+        service = ExportService("badtoken", requester=request.DummyRequester(DummyBackend()))
+        self.assertRaises(request.UnknownCodeError, service.getColumns, Query(_PROJECT_ID))
+        self.assertRaises(ValueError, service.getColumns, None)
+
+
+class TestGetDataSplit(unittest.TestCase):
+
+    def _collect(self, resp):
+        ret = {}
+        for did, name, t, v in results.iterPoints(resp):
+            ret.setdefault((did, name), []).append((t, v))
+        return ret
+
+    def test_getDataSplitParts(self):
+        requester = ConcurrentExportRequester(dummy_backend.makePoints(_POINTS))
+        service = ExportService(_TOKEN, requester=requester)
+        q = Query(_PROJECT_ID).inTimeRange(0, 99)
+        resp = service.getDataSplit(q, parts=4, maxConcurrency=4)
+        self.assertEqual(dummy_backend.makePoints(_POINTS), self._collect(resp))
+        self.assertEqual([(0, 24), (25, 49), (50, 74), (75, 99)],
+                         sorted((p["from"], p["to"]) for p in requester.queries))
+        self.assertTrue(requester.maxInFlight > 1)
+        self.assertEqual(1, len([d for d in resp["result"] if d["device_id"] == "dev1"]))
+
+    def test_getDataSplitWindowLimit(self):
+        requester = ConcurrentExportRequester(dummy_backend.makePoints(_POINTS), delay=0)
+        service = ExportService(_TOKEN, requester=requester)
+        q = Query(_PROJECT_ID).inTimeRange(0, 99).limit(4)
+        resp = service.getDataSplit(q, window=30)
+        self.assertEqual(4, len(requester.queries))
+        want = dict((k, v[:4]) for k, v in dummy_backend.makePoints(_POINTS).items())
+        self.assertEqual(want, self._collect(resp))
+
+    def test_getDataSplitBadArgs(self):
+        service = ExportService(_TOKEN, requester=request.DummyRequester(DummyBackend()))
+        q = Query(_PROJECT_ID).fromTime(0)
+        self.assertRaises(ValueError, service.getDataSplit, q)
+        self.assertRaises(ValueError, service.getDataSplit, q, parts=2, window=10)
+        self.assertRaises(ValueError, service.getDataSplit, q, parts=0)
+        self.assertRaises(ValueError, service.getDataSplit, Query(_PROJECT_ID), parts=2)
+
+    def test_getDataSplitError(self):
+        service = ExportService("wrong", requester=request.DummyRequester(DummyBackend()))
+        self.assertRaises(request.UnknownCodeError, service.getDataSplit,
+                          Query(_PROJECT_ID).inTimeRange(0, 10), parts=2)
@@ -282,3 +282,113 @@ class TestImportService(unittest.TestCase):
         self.assertEqual("time", sources["fields"][0])
         self.assertEqual("t", sources["fields"][1])
         self.assertEqual(10, len(sources["data"]))
+
+    def test_importBatchHooks(self):
+        spans = []
+        def hook(name, secs, info):
+            spans.append((name, info))
+
+        dummy = DummyBackend()
+        service = ImportService(_TOKEN, requester=request.DummyRequester(dummy))
+        service.addHook(hook)
+
+        LIMIT = ImportService._BATCH_SIZE
+        batch = DataStore(["t"])
+        for i in range(0, LIMIT + 1):
+            batch.add(i, {"t": i})
+        success, _ = service.importBatch(_PROJECT_ID, _DEVICE_ID, batch)
+        self.assertTrue(success)
+
+        names = [s[0] for s in spans]
+        self.assertEqual(["imports.build", "imports.chunk", "imports.chunk"], names)
+        self.assertEqual(2, spans[0][1]["chunks"])
+        self.assertEqual(LIMIT, spans[1][1]["rows"])
+        self.assertEqual(1, spans[2][1]["rows"])
+        self.assertEqual(1, spans[2][1]["index"])
+
+        service.removeHook(hook)
+        service.importBatch(_PROJECT_ID, _DEVICE_ID, batch)
+        self.assertEqual(3, len(spans))
+
+    def _failingBackend(self, failAt, raiseError=False):
+        class FailingBackend(DummyBackend):
+
+            def importData(self, body, isBatch):
+                self.imports = getattr(self, "imports", 0) + 1
+                if self.imports == failAt:
+                    if raiseError:
+                        raise IOError("connection lost")
+                    return {dummy_backend._STATUS_CODE: 500}
+                return DummyBackend.importData(self, body, isBatch)
+
+        return FailingBackend()
+
+    def test_importBatchPartial(self):
+        LIMIT = ImportService._BATCH_SIZE
+        dummy = self._failingBackend(2)
+        service = ImportService(_TOKEN, requester=request.DummyRequester(dummy))
+
+        batch = DataStore(["t"])
+        total = LIMIT * 2 + 10
+        for i in range(0, total):
+            batch.add(i, {"t": i})
+        result = service.importBatch(_PROJECT_ID, _DEVICE_ID, batch)
+        success, extra = result
+        self.assertFalse(success)
+        self.assertEqual(500, extra.status_code)
+        self.assertTrue(result.isPartial())
+        self.assertEqual(1, result.ackedChunks)
+        self.assertEqual(3, result.totalChunks)
+        self.assertEqual(LIMIT, result.acked)
+        self.assertEqual(total - LIMIT, result.remaining.numRows())
+        self.assertEqual(LIMIT * 1000, result.remaining.rows()[0]["time"])
+        # stops at the first failure
+        self.assertEqual(2, dummy.calls)
+
+        result = service.importBatch(_PROJECT_ID, _DEVICE_ID, result.remaining)
+        self.assertTrue(result.success)
+        self.assertEqual(2, result.ackedChunks)
+        self.assertEqual(total - LIMIT, result.acked)
+        self.assertTrue(result.remaining is None)
+        self.assertFalse(result.isPartial())
+
+    def test_importBatchPartialError(self):
+        LIMIT = ImportService._BATCH_SIZE
+        dummy = self._failingBackend(2, raiseError=True)
+        service = ImportService(_TOKEN, requester=request.DummyRequester(dummy))
+
+        batch = DataStore(["t"])
+        for i in range(0, LIMIT + 1):
+            batch.add(i, {"t": i})
+        try:
+            service.importBatch(_PROJECT_ID, _DEVICE_ID, batch)
+            self.assertTrue(False)
+        except imports.PartialImportError as e:
+            self.assertTrue(isinstance(e.cause, IOError))
+            self.assertEqual(1, e.result.ackedChunks)
+            self.assertEqual(1, e.result.remaining.numRows())
+
+        # nothing accepted: original error propagates
+        dummy = self._failingBackend(1, raiseError=True)
+        service = ImportService(_TOKEN, requester=request.DummyRequester(dummy))
+        try:
+            service.importBatch(_PROJECT_ID, _DEVICE_ID, batch)
+            self.assertTrue(False)
+        except IOError:
+            pass
+
+    def test_importDataPartial(self):
+        LIMIT = ImportService._BATCH_SIZE
+        dummy = self._failingBackend(2)
+        service = ImportService(_TOKEN, requester=request.DummyRequester(dummy))
+
+        dataset = {"t": makeLinearDataSeries(LIMIT * 2 + 5)}
+        result = service.importData(_PROJECT_ID, _DEVICE_ID, dataset)
+        self.assertFalse(result.success)
+        self.assertTrue(result.isPartial())
+        self.assertEqual(LIMIT, result.acked)
+        self.assertEqual(LIMIT + 5, len(result.remaining["t"]))
+
+        result = service.importData(_PROJECT_ID, _DEVICE_ID, result.remaining)
+        self.assertTrue(result.success)
+        self.assertEqual(LIMIT + 5, result.acked)
@@ -1,3 +1,6 @@
+import threading
+import requests
+from iobeam.resources import results
 from iobeam.utils import utils
 from tests.http import request
 from time import time
@@ -154,3 +157,131 @@ class DummyBackend(request.DummyRequest):
         self.lastHeaders = None
         self.lastJson = None
         self.calls = 0
+
+
+class ExportBackend(DummyBackend):
+    """Backend that answers export queries from an in-memory data set.
+
+    `points` maps (deviceId, seriesName) to a list of (msec time, value),
+    sorted by time. Supports the from, to, limit, and timefmt parameters.
+    """
+
+    _DIVISORS = {"sec": 0.001, "msec": 1, "usec": 1000}
+
+    def __init__(self, points, projectId=1):
+        DummyBackend.__init__(self)
+        self.points = points
+        self.projectId = projectId
+        self.queries = []
+
+    def getData(self):
+        params = dict(self.lastParams or {})
+        self.queries.append(params)
+        parts = self.lastUrl.split("/exports/")[1].split("/")
+        did, series = parts[1], parts[2]
+        fmt = params.get("timefmt", "msec")
+        mult = self._DIVISORS[fmt]
+
+        devices = {}
+        for (d, s) in sorted(self.points):
+            if (did != "all" and d != did) or (series != "all" and s != series):
+                continue
+            pts = [(t, v) for t, v in self.points[(d, s)]
+                   if ("from" not in params or t >= params["from"]) and
+                   ("to" not in params or t <= params["to"])]
+            if "limit" in params:
+                pts = pts[:params["limit"]]
+            data = [{"time": int(t * mult), "value": v} for t, v in pts]
+            devices.setdefault(d, []).append({"name": s, "data": data})
+
+        result = [{"project_id": self.projectId, "device_id": d, "sources": devices[d]}
+                  for d in sorted(devices)]
+        return {_STATUS_CODE: 200, "result": result, "timefmt": fmt}
+
+
+class RecordingRequester(request.DummyRequester):
+    """Requester that records imports, safe to use from threads.
+
+    Each request gets its own DummyBackend. Imports for devices in
+    `failDevices` get a 500 response, and while `down` is True every
+    request fails as if the network were cut.
+    """
+
+    def __init__(self, failDevices=None):
+        request.DummyRequester.__init__(self, None)
+        self.failDevices = failDevices or set()
+        self.down = False
+        self.bodies = []
+        self.imported = []  # times of the rows of accepted batch imports
+        self.probes = 0
+        self.lock = threading.Lock()
+
+    def _make(self, method, url):
+        requester = self
+
+        class Recording(DummyBackend):
+
+            def dummyExecute(self, url, params=None, headers=None, json=None):
+                if url.endswith("/devices/timestamp"):
+                    with requester.lock:
+                        requester.probes += 1
+                if requester.down:
+                    raise requests.exceptions.ConnectionError("network is down")
+                return DummyBackend.dummyExecute(self, url, params=params,
+                                                 headers=headers, json=json)
+
+            def importData(self, body, isBatch):
+                with requester.lock:
+                    requester.bodies.append(body)
+                if body["device_id"] in requester.failDevices:
+                    return {_STATUS_CODE: 500}
+                ret = DummyBackend.importData(self, body, isBatch)
+                if isBatch and ret[_STATUS_CODE] == 200:
+                    with requester.lock:
+                        requester.imported.extend(r[0] for r in body["sources"]["data"])
+                return ret
+
+        r = Recording()
+        r.method = method
+        r.url = url
+        return r
+
+    def get(self, url):
+        return self._make("GET", url)
+
+    def post(self, url):
+        return self._make("POST", url)
+
+    def rows(self):
+        """Return (deviceId, row dict) of every batch import body sent."""
+        ret = []
+        for body in self.bodies:
+            fields = body["sources"]["fields"]
+            for row in body["sources"]["data"]:
+                ret.append((body["device_id"], dict(zip(fields, row))))
+        return ret
+
+
+def makePoints(spec):
+    """Build the data set of an ExportBackend.
+
+    `spec` maps (deviceId, seriesName) to (start, stop, step, scale); the
+    series gets a point (t, t * scale) for each t in range(start, stop, step).
+    """
+    return dict((key, [(t, t * scale) for t in range(start, stop, step)])
+                for key, (start, stop, step, scale) in spec.items())
+
+
+def makeResponse(points, timefmt="msec"):
+    """Build an export response from (deviceId, seriesName, time, value).
+
+    Series are listed in the order they first appear in `points`.
+    """
+    series = []
+    byKey = {}
+    for did, name, t, v in points:
+        if (did, name) not in byKey:
+            byKey[(did, name)] = []
+            series.append((did, name, byKey[(did, name)]))
+        byKey[(did, name)].append({"time": t, "value": v})
+    return results.makeResponse({"timefmt": timefmt}, series)
@@ -26,6 +26,7 @@ class DummyRequester(object):
         self.lastUrl = url
         self._request.method = "GET"
         self._request.url = url
+        self._request.params = {}
         return self._request
 
     def post(self, url):
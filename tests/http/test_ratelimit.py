@@ -0,0 +1,98 @@
+import sys
+import unittest
+if sys.version_info > (3, 2):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+from iobeam.http import ratelimit
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def timer(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.slept.append(secs)
+        self.now += secs
+
+
+def _makeLimiter(clock, **kwargs):
+    limiter = ratelimit.RateLimiter(**kwargs)
+    limiter._sleep = clock.sleep
+    limiter._random = lambda: 0.5
+    return limiter
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_constructorBad(self):
+        self.assertRaises(ValueError, ratelimit.TokenBucket, 0)
+        self.assertRaises(ValueError, ratelimit.TokenBucket, None)
+        self.assertRaises(ValueError, ratelimit.TokenBucket, 1, burst=0)
+
+    def test_reserve(self):
+        clock = FakeClock()
+        with patch.object(ratelimit.utils, "timer", clock.timer):
+            bucket = ratelimit.TokenBucket(2, burst=4)
+            for _ in range(0, 4):
+                self.assertEqual(0, bucket.reserve(1))
+            self.assertEqual(0.5, bucket.reserve(1))
+            self.assertEqual(1.0, bucket.reserve(1))
+
+            clock.now += 10  # refills only up to capacity
+            self.assertEqual(0, bucket.reserve(4))
+            self.assertEqual(5.0, bucket.reserve(10))  # large amounts go in debt
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_constructorBad(self):
+        self.assertRaises(ValueError, ratelimit.RateLimiter, requestsPerSec=0)
+        self.assertRaises(ValueError, ratelimit.RateLimiter, bytesPerSec=-1)
+        self.assertRaises(ValueError, ratelimit.RateLimiter, maxRetries=-1)
+        self.assertRaises(ValueError, ratelimit.RateLimiter, startupJitter=-1)
+
+    def test_acquire(self):
+        clock = FakeClock()
+        with patch.object(ratelimit.utils, "timer", clock.timer):
+            limiter = _makeLimiter(clock, requestsPerSec=1, bytesPerSec=100,
+                                   startupJitter=4)
+            limiter.acquire(10)
+            self.assertEqual([2.0], clock.slept)  # startup jitter only once
+            limiter.acquire(10)  # buckets refilled while waiting
+            self.assertEqual(1, len(clock.slept))
+            limiter.acquire(10)
+            self.assertAlmostEqual(1.0, clock.slept[1])  # requests/sec
+            limiter.acquire(250)
+            self.assertAlmostEqual(1.5, clock.slept[2])  # bytes/sec
+
+    def test_throttled(self):
+        clock = FakeClock()
+        with patch.object(ratelimit.utils, "timer", clock.timer):
+            limiter = _makeLimiter(clock, backoff=1.0, maxBackoff=3.0)
+            self.assertEqual(0.5, limiter.throttled(0))
+            self.assertEqual(1.0, limiter.throttled(1))
+            self.assertEqual(1.5, limiter.throttled(5))  # capped
+            self.assertEqual(2.0, limiter.throttled(0, retryAfter=2))
+
+            limiter.acquire()
+            self.assertEqual([2.0], clock.slept)
+            limiter.acquire()
+            self.assertEqual(1, len(clock.slept))
+
+    def test_retryAfterSeconds(self):
+        class Resp(object):
+            def __init__(self, headers):
+                self.headers = headers
+
+        self.assertEqual(3.0, ratelimit.retryAfterSeconds(Resp({"Retry-After": "3"})))
+        self.assertIsNone(ratelimit.retryAfterSeconds(Resp({})))
+        self.assertIsNone(ratelimit.retryAfterSeconds(
+            Resp({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})))
+        self.assertIsNone(ratelimit.retryAfterSeconds(object()))
@@ -0,0 +1,169 @@
+import json
+import sys
+import unittest
+if sys.version_info > (3, 2):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+from iobeam.http import ratelimit
+from iobeam.http import request
+
+Request = request.Request
+Requester = request.Requester
+
+
+class DummyResponse(object):
+
+    def __init__(self, status, body, headers=None):
+        self.status_code = status
+        self.content = json.dumps(body).encode("utf-8")
+        self.headers = headers or {}
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class DummySession(object):
+
+    def __init__(self, status=200, body=None):
+        self.status = status
+        self.body = body if body is not None else {}
+        self.lastKwargs = None
+
+    def get(self, url, **kwargs):
+        self.lastKwargs = kwargs
+        return DummyResponse(self.status, self.body)
+
+    def post(self, url, **kwargs):
+        self.lastKwargs = kwargs
+        return DummyResponse(self.status, self.body)
+
+
+class TestRequest(unittest.TestCase):
+
+    def test_executeNoHooks(self):
+        session = DummySession()
+        r = Request("POST", "http://test/imports", session)
+        r.setBody({"a": 1})
+        r.execute()
+        self.assertEqual({"a": 1}, session.lastKwargs["json"])
+        self.assertEqual(200, r.getResponseCode())
+
+    def test_executeWithHooks(self):
+        spans = []
+        def hook(name, secs, info):
+            spans.append((name, secs, info))
+
+        session = DummySession(body={"ok": True})
+        r = Request("POST", "http://test/imports", session, hooks=[hook])
+        r.setBody({"a": 1})
+        r.execute()
+        self.assertEqual({"ok": True}, r.getResponse())
+
+        names = [s[0] for s in spans]
+        self.assertEqual(["http.encode", "http.send", "http.parse"], names)
+        for s in spans:
+            self.assertTrue(s[1] >= 0)
+        payload = session.lastKwargs["data"]
+        self.assertEqual({"a": 1}, json.loads(payload))
+        self.assertEqual(len(payload), spans[0][2]["bytes"])
+        self.assertEqual(len(payload), spans[1][2]["bytesSent"])
+        self.assertEqual(len(json.dumps({"ok": True})), spans[1][2]["bytesReceived"])
+        self.assertEqual(200, spans[1][2]["status"])
+
+    def test_brokenHookIgnored(self):
+        def hook(name, secs, info):
+            raise Exception("broken")
+
+        session = DummySession()
+        r = Request("GET", "http://test/exports", session, hooks=[hook])
+        r.execute()
+        self.assertEqual(200, r.getResponseCode())
+
+    def test_requesterHooks(self):
+        spans = []
+        def hook(name, secs, info):
+            spans.append(name)
+
+        requester = Requester(baseUrl="http://test/")
+        requester._session = DummySession()
+        requester.addHook(hook)
+        requester.addHook(hook)
+        requester.get(requester.makeEndpoint("exports")).execute()
+        self.assertEqual(["http.send"], spans)
+
+        requester.removeHook(hook)
+        requester.get(requester.makeEndpoint("exports")).execute()
+        self.assertEqual(["http.send"], spans)
+
+    def _limiter(self, slept, maxRetries=3):
+        limiter = ratelimit.RateLimiter(maxRetries=maxRetries)
+        limiter._sleep = slept.append
+        limiter._random = lambda: 1.0
+        return limiter
+
+    def test_executeRetriesThrottled(self):
+        class ThrottlingSession(DummySession):
+            def __init__(self, statuses):
+                DummySession.__init__(self)
+                self.statuses = statuses
+                self.calls = 0
+
+            def post(self, url, **kwargs):
+                self.lastKwargs = kwargs
+                self.calls += 1
+                status = self.statuses.pop(0) if self.statuses else 200
+                return DummyResponse(status, {}, headers={"Retry-After": "0"})
+
+        slept = []
+        session = ThrottlingSession([429, 503])
+        requester = Requester(baseUrl="http://test/")
+        requester._session = session
+        requester.setRateLimiter(self._limiter(slept))
+        self.assertTrue(requester.rateLimiter() is not None)
+        r = requester.post(requester.makeEndpoint("imports")).setBody({"a": 1})
+        r.execute()
+        self.assertEqual(200, r.getResponseCode())
+        self.assertEqual(3, session.calls)
+        self.assertEqual({"a": 1}, json.loads(session.lastKwargs["data"]))
+
+        # gives up after maxRetries, returning the throttled response
+        session = ThrottlingSession([429, 429, 429])
+        r = Request("POST", "http://test/imports", session,
+                    limiter=self._limiter(slept, maxRetries=1))
+        r.execute()
+        self.assertEqual(429, r.getResponseCode())
+        self.assertEqual(2, session.calls)
+
+    def test_scoped(self):
+        def hook(name, secs, info):
+            pass
+
+        requester = Requester(baseUrl="http://test/")
+        scoped = requester.scoped()
+        self.assertEqual(requester.makeEndpoint("x"), scoped.makeEndpoint("x"))
+        self.assertTrue(scoped._session is requester._session)
+        scoped.addHook(hook)
+        scoped.setRateLimiter(ratelimit.RateLimiter())
+        self.assertEqual([], requester._hooks)
+        self.assertTrue(requester.rateLimiter() is None)
+        self.assertTrue(scoped.scoped()._session is requester._session)
+        with patch.object(request.requests, "Session") as mm:
+            requester.scoped()
+            self.assertEqual(0, mm.call_count)
+
+        # the pool belongs to the shared session
+        scoped.ensurePoolSize(requester._poolSize + 5)
+        self.assertEqual(scoped._poolSize + 5, requester._poolSize)
+
+    def test_ensurePoolSize(self):
+        requester = Requester(baseUrl="http://test/")
+        default = requester._poolSize
+        requester.ensurePoolSize(default - 1)
+        self.assertEqual(default, requester._poolSize)
+        requester.ensurePoolSize(default + 5)
+        self.assertEqual(default + 5, requester._poolSize)
+        adapter = requester._session.get_adapter("https://test/")
+        self.assertEqual(default + 5, adapter._pool_maxsize)
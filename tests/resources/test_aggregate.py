@@ -0,0 +1,68 @@
+import unittest
+
+from iobeam.resources import aggregate
+from tests.http import dummy_backend
+
+
+_response = dummy_backend.makeResponse
+
+
+class TestAggregate(unittest.TestCase):
+
+    def test_badArgs(self):
+        self.assertRaises(ValueError, aggregate.Aggregator, 0)
+        self.assertRaises(ValueError, aggregate.Aggregator, 10, step=0)
+        self.assertRaises(ValueError, aggregate.Aggregator, 10, step=20)
+        self.assertRaises(ValueError, aggregate.Aggregator, "10")
+
+    def test_fixedWindows(self):
+        resp = _response([("d", "a", t, t) for t in range(0, 25)] +
+                         [("d", "b", 3, "on"), ("d", "b", 1, "off")])
+        stats = aggregate.aggregate(resp, 10)
+        self.assertEqual([("a", 0), ("a", 10), ("a", 20), ("b", 0)],
+                         [(s.name, s.start) for s in stats])
+        first = stats[0].asDict()
+        self.assertEqual(10, first["count"])
+        self.assertEqual(45, first["sum"])
+        self.assertEqual(0, first["min"])
+        self.assertEqual(9, first["max"])
+        self.assertEqual(4.5, first["mean"])
+        self.assertEqual(9, first["last"])
+        self.assertEqual(10, first["end"])
+        self.assertEqual(5, stats[2].count)
+
+        strings = stats[3]
+        self.assertEqual(2, strings.count)
+        self.assertEqual("on", strings.last)  # newest time, not last added
+        self.assertIsNone(strings.mean)
+        self.assertIsNone(strings.sum)
+
+    def test_rollingWindows(self):
+        resp = _response([("d", "a", t, 1) for t in range(0, 10)])
+        stats = aggregate.aggregate(resp, 4, step=2)
+        self.assertEqual([(-2, 2), (0, 4), (2, 4), (4, 4), (6, 4), (8, 2)],
+                         [(s.start, s.count) for s in stats])
+
+    def test_multiplePages(self):
+        pages = [_response([("d", "a", t, t) for t in range(0, 15)]),
+                 _response([("d", "a", t, t) for t in range(15, 30)])]
+        agg = aggregate.Aggregator(10).addResults(pages)
+        self.assertEqual([10, 10, 10], [s.count for s in agg.windows()])
+        self.assertEqual([0], [s.start for s in agg.flush(before=15)])
+        self.assertEqual([10, 20], [s.start for s in agg.windows()])
+
+    def test_iterAggregate(self):
+        seen = []
+
+        def pages():
+            for start in range(0, 30, 7):
+                pts = [("d", "a", t, t) for t in range(start, min(start + 7, 30))]
+                seen.append(start)
+                yield _response(pts)
+
+        gen = aggregate.iterAggregate(pages(), 10)
+        first = next(gen)
+        self.assertEqual((0, 10), (first.start, first.count))
+        self.assertEqual([0, 7], seen)  # yielded before later pages are fetched
+        rest = list(gen)
+        self.assertEqual([(10, 10), (20, 10)], [(s.start, s.count) for s in rest])
@@ -0,0 +1,185 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from iobeam.resources import budget
+from iobeam.resources import data
+
+BufferBudget = budget.BufferBudget
+Policy = budget.BackpressurePolicy
+
+# One row of a single column store: time + value
+_ROW = 2 * data.DataStore._EST_BYTES_PER_VALUE
+
+
+def _fill(store, start, count):
+    for i in range(start, start + count):
+        store.add(i, {"a": i})
+
+
+class TestBufferBudget(unittest.TestCase):
+
+    def test_constructorBad(self):
+        self.assertRaises(ValueError, BufferBudget, 0)
+        self.assertRaises(ValueError, BufferBudget, "100")
+        self.assertRaises(ValueError, BufferBudget, 100, policy="block")
+        self.assertRaises(ValueError, BufferBudget, 100, timeout=-1)
+        self.assertRaises(ValueError, BufferBudget, 100, policy=Policy.SPILL)
+
+    def test_trackAndRelease(self):
+        b = BufferBudget(10 * _ROW)
+        store = data.DataStore(["a"])
+        _fill(store, 0, 2)
+        b.track(store)
+        self.assertEqual(2 * _ROW, b.used())
+
+        _fill(store, 2, 3)
+        self.assertEqual(5 * _ROW, b.used())
+        self.assertEqual(0.5, b.occupancy())
+
+        snap = store.swap()
+        self.assertEqual(0, b.used())
+        store.restore(snap)
+        self.assertEqual(5 * _ROW, b.used())
+
+        store.clear()
+        self.assertEqual(0, b.used())
+        _fill(store, 0, 1)
+        b.untrack(store)
+        self.assertEqual(0, b.used())
+        self.assertIsNone(store._budget)
+
+    def test_dropNewest(self):
+        full = []
+        b = BufferBudget(3 * _ROW, policy=Policy.DROP_NEWEST,
+                         onFull=lambda: full.append(1))
+        store = data.DataStore(["a"])
+        b.track(store)
+        _fill(store, 0, 5)
+        self.assertEqual([0, 1, 2], [r["time"] // 1000 for r in store.rows()])
+        stats = b.stats()
+        self.assertEqual(2, stats["droppedRows"])
+        self.assertEqual(1.0, stats["occupancy"])
+        self.assertEqual(2, len(full))
+
+    def test_dropOldest(self):
+        b = BufferBudget(3 * _ROW, policy=Policy.DROP_OLDEST)
+        old = data.DataStore(["a"])
+        new = data.DataStore(["a"])
+        b.track(old)
+        b.track(new)
+        _fill(old, 0, 2)
+        time.sleep(0.01)
+        _fill(new, 10, 3)
+
+        self.assertEqual(0, old.numRows())
+        self.assertEqual(3, new.numRows())
+        self.assertEqual(2, b.stats()["droppedRows"])
+        self.assertEqual(3 * _ROW, b.used())
+
+        _fill(new, 20, 1)
+        self.assertEqual([11, 12, 20], [r["time"] // 1000 for r in new.rows()])
+
+    def test_dropOldestConcurrentStore(self):
+        b = BufferBudget(2 * _ROW, policy=Policy.DROP_OLDEST)
+        store = data.ConcurrentDataStore(["a"])
+        b.track(store)
+        _fill(store, 0, 4)
+        self.assertEqual([2, 3], [r["time"] // 1000 for r in store.rows()])
+        self.assertEqual(2 * _ROW, b.used())
+
+    def test_block(self):
+        b = BufferBudget(2 * _ROW, policy=Policy.BLOCK, timeout=0.05)
+        store = data.DataStore(["a"])
+        b.track(store)
+        _fill(store, 0, 2)
+        self.assertRaises(budget.BufferFullError, store.add, 2, {"a": 2})
+        self.assertEqual(2, store.numRows())
+
+        # A send from another thread frees space for a blocked producer
+        b.timeout = 5
+        timer = threading.Timer(0.05, store.swap)
+        timer.start()
+        store.add(2, {"a": 2})
+        timer.join()
+        self.assertEqual([2], [r["time"] // 1000 for r in store.rows()])
+
+    def test_blockWithNothingSending(self):
+        b = BufferBudget(2 * _ROW, policy=Policy.BLOCK, onFull=lambda: False)
+        store = data.DataStore(["a"])
+        b.track(store)
+        _fill(store, 0, 2)
+        start = time.time()
+        self.assertRaises(budget.BufferFullError, store.add, 2, {"a": 2})
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(2, store.numRows())
+
+    def test_dropOldestUntracked(self):
+        # rows outside a store cannot be dropped to make room
+        b = BufferBudget(2 * _ROW, policy=Policy.DROP_OLDEST)
+        self.assertTrue(b.admit(None, _ROW))
+        self.assertTrue(b.admit(None, _ROW))
+        self.assertFalse(b.admit(None, _ROW))
+        self.assertEqual(1, b.stats()["droppedRows"])
+
+        store = data.DataStore(["a"])
+        b.track(store)
+        b.release(_ROW)
+        _fill(store, 0, 1)
+        self.assertTrue(b.admit(None, _ROW))
+        self.assertEqual(0, store.numRows())
+
+    def test_spill(self):
+        path = tempfile.mkdtemp()
+        try:
+            b = BufferBudget(3 * _ROW, policy=Policy.SPILL, spillPath=path)
+            store = data.DataStore(["a"])
+            b.track(store)
+            _fill(store, 0, 7)
+
+            self.assertEqual(1, store.numRows())
+            self.assertEqual(6, b.stats()["spilledRows"])
+            spilled, added = store.spilled()
+            self.assertEqual(6, spilled)
+            self.assertTrue(added is not None)
+            self.assertEqual(0, b.stats()["droppedRows"])
+            self.assertEqual(1, len(os.listdir(path)))
+
+            snap = store.swap()
+            self.assertEqual(list(range(7)), [r["time"] // 1000 for r in snap.rows()])
+            self.assertEqual(added, snap.firstAddedTime())
+            self.assertEqual((0, None), store.spilled())
+            self.assertEqual(0, b.stats()["spilledRows"])
+            self.assertEqual(0, len(os.listdir(path)))
+            self.assertEqual(0, b.used())
+
+            _fill(store, 0, 5)
+            store.clear()
+            self.assertEqual(0, len(os.listdir(path)))
+        finally:
+            shutil.rmtree(path)
+
+    def test_spillKeyedPerStore(self):
+        path = tempfile.mkdtemp()
+        try:
+            b = BufferBudget(2 * _ROW, policy=Policy.SPILL, spillPath=path)
+            first = data.DataStore(["a"])
+            b.track(first)
+            _fill(first, 0, 3)
+            self.assertEqual(2, first.spilled()[0])
+
+            # a store created after another is dropped must not see its spill
+            b.untrack(first)
+            del first
+            second = data.DataStore(["a"])
+            b.track(second)
+            self.assertEqual((0, None), second.spilled())
+            _fill(second, 10, 3)
+            self.assertEqual(2, second.spilled()[0])
+            self.assertEqual([10, 11, 12],
+                             [r["time"] // 1000 for r in second.swap().rows()])
+        finally:
+            shutil.rmtree(path)
@@ -0,0 +1,61 @@
+import unittest
+
+from iobeam.resources import columns
+from iobeam.resources import data
+from tests.http import dummy_backend
+
+TimeUnit = data.TimeUnit
+
+
+def _response(timefmt="msec"):
+    return dummy_backend.makeResponse(
+        [("d1", "a", 1000, 1.5), ("d1", "a", 2000, 2), ("d1", "s", 3000, "on")],
+        timefmt=timefmt)
+
+
+class TestColumns(unittest.TestCase):
+
+    def test_decodeColumns(self):
+        cols = columns.decodeColumns(_response(), useNumpy=False)
+        self.assertEqual(2, len(cols))
+        a = cols[0]
+        self.assertEqual(("d1", "a"), (a.deviceId, a.name))
+        self.assertEqual(2, len(a))
+        self.assertEqual("q", a.times.typecode)
+        self.assertEqual([1000, 2000], list(a.times))
+        self.assertEqual("d", a.values.typecode)
+        self.assertEqual([1.5, 2.0], list(a.values))
+        self.assertEqual(TimeUnit.MILLISECONDS, a.timeUnit)
+        # non-numeric values stay a list
+        self.assertEqual(["on"], cols[1].values)
+
+    def test_decodeColumnsNormalizesTime(self):
+        cols = columns.decodeColumns(_response(), timeUnit=TimeUnit.SECONDS, useNumpy=False)
+        self.assertEqual([1, 2], list(cols[0].times))
+        self.assertEqual(TimeUnit.SECONDS, cols[0].timeUnit)
+
+        cols = columns.decodeColumns(_response("sec"), timeUnit=TimeUnit.MICROSECONDS,
+                                     useNumpy=False)
+        self.assertEqual([1000000000, 2000000000], list(cols[0].times))
+
+        cols = columns.decodeColumns(_response("usec"), useNumpy=False)
+        self.assertEqual(TimeUnit.MICROSECONDS, cols[0].timeUnit)
+        self.assertEqual([1000, 2000], list(cols[0].times))
+
+    def test_decodeColumnsEmpty(self):
+        self.assertEqual([], columns.decodeColumns(None, useNumpy=False))
+        self.assertEqual([], columns.decodeColumns({"result": []}, useNumpy=False))
+
+    @unittest.skipIf(columns.hasNumpy(), "numpy is installed")
+    def test_noNumpy(self):
+        self.assertRaises(ValueError, columns.decodeColumns, _response(), useNumpy=True)
+        cols = columns.decodeColumns(_response())
+        self.assertEqual([1000, 2000], list(cols[0].times))
+
+    @unittest.skipIf(not columns.hasNumpy(), "numpy is not installed")
+    def test_numpy(self):
+        cols = columns.decodeColumns(_response(), useNumpy=True)
+        self.assertEqual("int64", str(cols[0].times.dtype))
+        self.assertEqual("float64", str(cols[0].values.dtype))
+        self.assertEqual([1000, 2000], cols[0].times.tolist())
+        self.assertEqual(["on"], cols[1].values.tolist())
@@ -1,3 +1,4 @@
+import threading
 import unittest
 
 from iobeam.resources import data
@@ -203,6 +204,91 @@ class TestDataStore(unittest.TestCase):
         for (t, d) in cases:
             verify(t, d)
 
+    def test_sizeAndAge(self):
+        columns = ["series1", "series2"]
+        ds = data.DataStore(columns)
+        self.assertEqual(0, ds.numRows())
+        self.assertEqual(0, ds.estimatedSize())
+        self.assertTrue(ds.firstAddedTime() is None)
+
+        ds.add(0, {"series1": 1})
+        ds.add(1, {"series2": 2})
+        self.assertEqual(2, ds.numRows())
+        self.assertTrue(ds.estimatedSize() > 0)
+        added = ds.firstAddedTime()
+        self.assertTrue(added is not None)
+        ds.add(2, {"series2": 2})
+        self.assertEqual(added, ds.firstAddedTime())
+
+        ds.clear()
+        self.assertEqual(0, ds.numRows())
+        self.assertTrue(ds.firstAddedTime() is None)
+
+    def test_priority(self):
+        ds = data.DataStore(["a"])
+        self.assertEqual(data.Priority.NORMAL, ds.priority())
+        self.assertRaises(ValueError, data.DataStore, ["a"], priority=0)
+
+        ds = data.ConcurrentDataStore(["a"], priority=data.Priority.HIGH)
+        ds.add(0, {"a": 1})
+        ds.add(1, {"a": 2})
+        self.assertEqual(data.Priority.HIGH, ds.priority())
+        self.assertEqual(data.Priority.HIGH, ds.slice(1).priority())
+        self.assertEqual(data.Priority.HIGH, ds.swap().priority())
+
+    def test_swapAndRestore(self):
+        columns = ["series1"]
+        ds = data.DataStore(columns)
+        for i in range(0, 3):
+            ds.add(i, {"series1": i})
+        added = ds.firstAddedTime()
+
+        snap = ds.swap()
+        self.assertEqual(0, ds.numRows())
+        self.assertTrue(ds.firstAddedTime() is None)
+        self.assertEqual(3, snap.numRows())
+        self.assertEqual(columns, snap.columns())
+        self.assertEqual(added, snap.firstAddedTime())
+
+        ds.add(10, {"series1": 10})
+        ds.restore(snap)
+        self.assertEqual(4, ds.numRows())
+        times = [r["time"] for r in ds.rows()]
+        self.assertEqual([0, 1000, 2000, 10000], times)
+        self.assertEqual(added, ds.firstAddedTime())
+
+        ds.restore(None)
+        ds.restore(data.DataStore(columns))
+        self.assertEqual(4, ds.numRows())
+
+    def test_slice(self):
+        ds = data.DataStore(["series1"])
+        for i in range(0, 5):
+            ds.add(i, {"series1": i})
+        part = ds.slice(3)
+        self.assertEqual(2, part.numRows())
+        self.assertEqual(3000, part.rows()[0]["time"])
+        part = ds.slice(1, 3)
+        self.assertEqual([1000, 2000], [r["time"] for r in part.rows()])
+        self.assertEqual(5, ds.numRows())
+
+    def test_swapConcurrentAdds(self):
+        ds = data.DataStore(["series1"])
+        total = 20000
+        taken = []
+
+        def produce():
+            for i in range(0, total):
+                ds.add(i, {"series1": i})
+
+        t = threading.Thread(target=produce)
+        t.start()
+        while t.is_alive():
+            taken.append(ds.swap().numRows())
+        t.join()
+        taken.append(ds.swap().numRows())
+        self.assertEqual(total, sum(taken))
+
     def test_hasSameColumns(self):
         columns = ["a", "b", "c"]
         ds = data.DataStore(columns)
@@ -235,6 +321,90 @@ class TestDataStore(unittest.TestCase):
         self.assertEqual(2, len(batches[2].rows()))
 
 
+class TestConcurrentDataStore(unittest.TestCase):
+
+    def test_addAndRows(self):
+        ds = data.ConcurrentDataStore(["series1", "series2"])
+        self.assertTrue(isinstance(ds, data.DataStore))
+        self.assertEqual(0, ds.numRows())
+        self.assertTrue(ds.firstAddedTime() is None)
+
+        ds.add(2, {"series1": 2})
+        ds.add(1, {"series2": 1})
+        self.assertEqual(2, ds.numRows())
+        self.assertEqual(4, len(ds))
+        self.assertTrue(ds.firstAddedTime() is not None)
+        rows = ds.rows()
+        self.assertEqual([1000, 2000], [r["time"] for r in rows])
+        self.assertEqual(None, rows[0]["series1"])
+
+        try:
+            ds.add(3, {"bad": 3})
+            self.assertTrue(False)
+        except ValueError:
+            pass
+
+        ds.clear()
+        self.assertEqual(0, ds.numRows())
+        self.assertTrue(ds.firstAddedTime() is None)
+
+    def test_manyProducers(self):
+        ds = data.ConcurrentDataStore(["series1"])
+        perThread = 2000
+        numThreads = 8
+        taken = []
+
+        def produce(offset):
+            for i in range(0, perThread):
+                ds.add(offset + i, {"series1": i})
+
+        threads = [threading.Thread(target=produce, args=(t * perThread,))
+                   for t in range(0, numThreads)]
+        for t in threads:
+            t.start()
+        while any(t.is_alive() for t in threads):
+            taken.append(ds.swap())
+        for t in threads:
+            t.join()
+        taken.append(ds.swap())
+
+        self.assertEqual(perThread * numThreads, sum(s.numRows() for s in taken))
+        for snap in taken:
+            times = [r["time"] for r in snap.rows()]
+            self.assertEqual(sorted(times), times)
+        # buffers of finished threads are dropped once empty
+        self.assertEqual(0, len(ds._buffers))
+
+    def test_swapAndRestore(self):
+        ds = data.ConcurrentDataStore(["series1"])
+        ds.add(1, {"series1": 1})
+        snap = ds.swap()
+        self.assertFalse(isinstance(snap, data.ConcurrentDataStore))
+        ds.add(2, {"series1": 2})
+        ds.restore(snap)
+        self.assertEqual([1000, 2000], [r["time"] for r in ds.rows()])
+        self.assertEqual(2, len(ds.split(1)))
+
+
+class TestMergeStores(unittest.TestCase):
+
+    def test_mergeStores(self):
+        self.assertTrue(data.mergeStores([]) is None)
+        self.assertTrue(data.mergeStores(None) is None)
+
+        a = data.DataStore(["x", "y"])
+        a.add(0, {"x": 1, "y": 2})
+        b = data.DataStore(["y", "z"])
+        b.add(1, {"z": 3})
+        merged = data.mergeStores([a, b])
+        self.assertEqual(["x", "y", "z"], merged.columns())
+        rows = merged.rows()
+        self.assertEqual(2, len(rows))
+        self.assertEqual({"time": 0, "x": 1, "y": 2, "z": None}, rows[0])
+        self.assertEqual({"time": 1000, "x": None, "y": None, "z": 3}, rows[1])
+        self.assertEqual(a.firstAddedTime(), merged.firstAddedTime())
+
+
 class TestDataSeries(unittest.TestCase):
 
     def test_constructorNonePoints(self):
@@ -0,0 +1,59 @@
+import unittest
+
+from iobeam.resources import columns
+from iobeam.resources import join
+from tests.http import dummy_backend
+
+Match = join.Match
+
+
+def _response():
+    return dummy_backend.makeResponse(
+        [("d1", "temp", t, t * 10) for t in (0, 10, 20, 30)] +
+        [("d1", "hum", t, t) for t in (0, 12, 19, 40)])
+
+
+class TestJoin(unittest.TestCase):
+
+    def test_exactOuter(self):
+        table = join.join(_response())
+        self.assertEqual(["temp", "hum"], table.names())
+        self.assertEqual([0, 10, 12, 19, 20, 30, 40], list(table.times))
+        self.assertEqual([0, 100, None, None, 200, 300, None], table.column("temp"))
+        self.assertEqual([0, None, 12, 19, None, None, 40], table.column("hum"))
+        self.assertEqual((12, None, 12), list(table.rows())[2])
+        self.assertEqual(7, len(table))
+
+    def test_asof(self):
+        table = join.join(_response(), match=Match.ASOF, base="temp")
+        self.assertEqual([0, 10, 20, 30], list(table.times))
+        self.assertEqual([0, 0, 19, 19], table.column("hum"))
+
+        table = join.join(_response(), match=Match.ASOF, base="temp", tolerance=5)
+        self.assertEqual([0, None, 19, None], table.column("hum"))
+
+    def test_nearest(self):
+        table = join.join(_response(), match=Match.NEAREST, base=0)
+        self.assertEqual([0, 12, 19, 40], table.column("hum"))
+        table = join.join(_response(), match=Match.NEAREST, base="hum", tolerance=2)
+        self.assertEqual([0, 100, 200, None], table.column("temp"))
+
+    def test_unsortedAndRepeats(self):
+        a = columns.SeriesColumns("d1", "a", [5, 1, 3], [50, 10, 30], None)
+        b = columns.SeriesColumns("d2", "a", [1, 1, 4], ["x", "y", "z"], None)
+        table = join.join([a, b], match=Match.ASOF, base=0)
+        self.assertEqual(["d1/a", "d2/a"], table.names())
+        self.assertEqual([1, 3, 5], list(table.times))
+        self.assertEqual([10, 30, 50], table.column("d1/a"))
+        self.assertEqual(["y", "y", "z"], table.column("d2/a"))
+
+    def test_badArgs(self):
+        self.assertRaises(ValueError, join.join, _response(), match="exact")
+        self.assertRaises(ValueError, join.join, _response(), tolerance=-1)
+        self.assertRaises(ValueError, join.join, _response(), base="missing")
+        self.assertRaises(ValueError, join.join, _response(), base=5)
+
+    def test_empty(self):
+        table = join.join({"result": []})
+        self.assertEqual(0, len(table))
+        self.assertEqual([], table.names())
@@ -215,3 +215,32 @@ class TestQuery(unittest.TestCase):
 
         # Failure case: non-int
         self._checkInvalid(q.equals, "junk")
+
+    def test_copyAndRange(self):
+        q = query.Query(_PROJECT_ID, deviceId=_DEVICE_ID, seriesName=_SERIES,
+                        timeUnit=TimeUnit.SECONDS).inTimeRange(1, 5).limit(10)
+        self.assertEqual(TimeUnit.SECONDS, q.getTimeUnit())
+        self.assertEqual(10, q.getLimit())
+        self.assertEqual((1000, 5000), q.getMillisRange())
+
+        c = q.copy()
+        self.assertEqual(q.getUrl(), c.getUrl())
+        self.assertEqual(q.getParams(), c.getParams())
+        c.limit(5)
+        self.assertEqual(10, q.getLimit())
+
+        r = q.withMillisRange(2000, None)
+        self.assertEqual((2000, None), r.getMillisRange())
+        self.assertEqual((1000, 5000), q.getMillisRange())
+        self.assertEqual((None, None), query.Query(_PROJECT_ID).getMillisRange())
+
+    def test_withTarget(self):
+        q = query.Query(_PROJECT_ID, deviceId=_DEVICE_ID, seriesName=_SERIES).limit(10)
+        self.assertEqual(_DEVICE_ID, q.getDeviceId())
+        self.assertEqual(_SERIES, q.getSeriesName())
+
+        t = q.withTarget(None, "other")
+        self.assertEqual("{}/all/other".format(_PROJECT_ID), t.getUrl())
+        self.assertEqual(q.getParams(), t.getParams())
+        self.assertIsNone(t.getDeviceId())
+        self.assertEqual(_SERIES, q.getSeriesName())
@@ -0,0 +1,59 @@
+import unittest
+
+from iobeam.resources import results
+
+_RESPONSE = {
+    "timefmt": "msec",
+    "result": [
+        {"project_id": 1, "device_id": "dev1", "sources": [
+            {"name": "a", "data": [{"time": 1, "value": 10}, {"time": 2, "value": 20}]},
+            {"name": "b", "data": [{"time": 1, "value": 5}]}
+        ]},
+        {"project_id": 1, "device_id": "dev2", "sources": [
+            {"name": "a", "data": []}
+        ]}
+    ]
+}
+
+
+class TestResults(unittest.TestCase):
+
+    def test_iterSeries(self):
+        series = list(results.iterSeries(_RESPONSE))
+        self.assertEqual([("dev1", "a"), ("dev1", "b"), ("dev2", "a")],
+                         [(d, n) for d, n, _ in series])
+        self.assertEqual([], list(results.iterSeries(None)))
+        self.assertEqual([], list(results.iterSeries({})))
+
+    def test_iterPoints(self):
+        pts = list(results.iterPoints(_RESPONSE))
+        self.assertEqual([("dev1", "a", 1, 10), ("dev1", "a", 2, 20),
+                          ("dev1", "b", 1, 5)], pts)
+        self.assertEqual(6, len(list(results.iterPoints([_RESPONSE, _RESPONSE]))))
+        self.assertEqual(3, results.countPoints(_RESPONSE))
+
+    def test_makeResponse(self):
+        resp = results.makeResponse(_RESPONSE, [
+            ("dev2", "c", [{"time": 3, "value": 1}]),
+            ("dev3", "a", [{"time": 4, "value": 2}])
+        ])
+        self.assertEqual("msec", resp["timefmt"])
+        self.assertEqual(["dev2", "dev3"], [d["device_id"] for d in resp["result"]])
+        self.assertEqual(1, resp["result"][0]["project_id"])
+        self.assertEqual([("dev2", "c", 3, 1), ("dev3", "a", 4, 2)],
+                         list(results.iterPoints(resp)))
+        # template is untouched
+        self.assertEqual(3, results.countPoints(_RESPONSE))
+
+    def test_mergeResponses(self):
+        later = results.makeResponse(_RESPONSE, [
+            ("dev1", "a", [{"time": 3, "value": 30}]),
+            ("dev2", "c", [{"time": 4, "value": 1}])
+        ])
+        resp = results.mergeResponses([_RESPONSE, later])
+        self.assertEqual("msec", resp["timefmt"])
+        self.assertEqual([("dev1", "a", 1, 10), ("dev1", "a", 2, 20),
+                          ("dev1", "a", 3, 30), ("dev1", "b", 1, 5),
+                          ("dev2", "c", 4, 1)], list(results.iterPoints(resp)))
+        self.assertEqual(3, results.countPoints(_RESPONSE))
+        self.assertEqual([], results.mergeResponses([])["result"])
@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iobeam.resources import sinks
+from tests.http import dummy_backend
+
+
+def _response(points):
+    return dummy_backend.makeResponse([("d1", "a", t, v) for t, v in points])
+
+
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _read(self, path):
+        with open(path, "r") as f:
+            return f.read()
+
+    def test_csvSinkBuffered(self):
+        path = os.path.join(self.path, "out.csv")
+        sink = sinks.CsvSink(path, bufferRows=2)
+        sink.writeResponse(_response([(1, 1.5), (2, 2)]))
+        self.assertEqual(2, sink.rowsWritten)
+        sink.write("d1", "b", 3, "on")
+        self.assertEqual(1, sink.pending())
+        self.assertEqual("device_id,series,time,value\nd1,a,1,1.5\nd1,a,2,2\n", self._read(path))
+        sink.close()
+        self.assertTrue(self._read(path).endswith("d1,b,3,on\n"))
+        sink.close()  # no-op
+
+    def test_jsonLinesSink(self):
+        path = os.path.join(self.path, "out.jsonl")
+        with sinks.JsonLinesSink(path) as sink:
+            sink.writeResponse(_response([(1, 1.5)]))
+        rows = [json.loads(l) for l in self._read(path).splitlines()]
+        self.assertEqual([{"device_id": "d1", "series": "a", "time": 1, "value": 1.5}], rows)
+
+    def test_truncateAppend(self):
+        path = os.path.join(self.path, "out.csv")
+        sink = sinks.CsvSink(path)
+        sink.write("d1", "a", 1, 1)
+        sink.flush()
+        pos = sink.tell()
+        sink.write("d1", "a", 2, 2)
+        sink.close()
+
+        sink = sinks.CsvSink(path, append=True)
+        sink.truncate(pos)
+        sink.write("d1", "a", 3, 3)
+        sink.close()
+        self.assertEqual("device_id,series,time,value\nd1,a,1,1\nd1,a,3,3\n", self._read(path))
+
+    def test_makeSink(self):
+        self.assertRaises(ValueError, sinks.makeSink, "xml", os.path.join(self.path, "x"))
+        self.assertRaises(ValueError, sinks.CsvSink, os.path.join(self.path, "x"), bufferRows=0)
+        sink = sinks.makeSink("jsonl", os.path.join(self.path, "x.jsonl"), bufferRows=5)
+        self.assertTrue(isinstance(sink, sinks.JsonLinesSink))
+        self.assertEqual(5, sink.bufferRows)
+        sink.close()
+
+    @unittest.skipIf(sinks.hasParquet(), "pyarrow is installed")
+    def test_parquetUnavailable(self):
+        self.assertRaises(ValueError, sinks.ParquetSink, os.path.join(self.path, "pq"))
+
+    @unittest.skipIf(not sinks.hasParquet(), "pyarrow is not installed")
+    def test_parquetSink(self):
+        import pyarrow.parquet
+        path = os.path.join(self.path, "pq")
+        with sinks.ParquetSink(path, bufferRows=2) as sink:
+            sink.writeResponse(_response([(1, 1), (2, 2), (3, 3)]))
+            self.assertEqual(1, sink.tell())
+        self.assertEqual(2, sink.tell())
+        sink.truncate(1)
+        self.assertEqual(1, sink.tell())
+        table = pyarrow.parquet.read_table(os.path.join(path, "part-00000.parquet"))
+        self.assertEqual([1, 2], table.column("time").to_pylist())
+
+    def test_checkpoint(self):
+        cp = sinks.Checkpoint(os.path.join(self.path, "cp"))
+        self.assertIsNone(cp.load())
+        cp.save(10, {("d1", "a"): 5})
+        self.assertEqual((10, [["d1", "a", 5]]), cp.load())
+        cp.clear()
+        self.assertIsNone(cp.load())
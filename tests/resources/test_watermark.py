@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from iobeam.endpoints import exports
+from iobeam.resources import query
+from iobeam.resources import results
+from iobeam.resources import watermark
+from tests.http import dummy_backend
+from tests.http import request
+
+_TOKEN = "dummy"
+
+
+class TestWatermark(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.points = {
+            ("dev1", "a"): [(t, t) for t in range(0, 100, 10)],
+            ("dev2", "a"): [(t, t) for t in range(0, 50, 25)]
+        }
+        self.backend = dummy_backend.ExportBackend(self.points)
+        self.service = exports.ExportService(
+            _TOKEN, requester=request.DummyRequester(self.backend))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _poll(self, mark, qry):
+        resp = self.service.getData(mark.apply(qry))
+        return list(results.iterPoints(mark.advance(resp)))
+
+    def test_incremental(self):
+        mark = watermark.Watermark()
+        qry = query.Query(1).fromTime(0)
+        self.assertEqual(12, len(self._poll(mark, qry)))
+        self.assertEqual(90, mark.get("dev1", "a"))
+        self.assertEqual(25, mark.get("dev2", "a"))
+
+        self.assertEqual([], self._poll(mark, qry))
+        self.assertEqual(25, self.backend.queries[-1]["from"])
+
+        self.points[("dev1", "a")].append((95, 1))
+        self.points[("dev2", "a")].append((60, 2))
+        self.assertEqual([("dev1", "a", 95, 1), ("dev2", "a", 60, 2)],
+                         self._poll(mark, qry))
+
+        mark.reset()
+        self.assertEqual({}, mark.marks())
+        self.assertEqual(14, len(self._poll(mark, qry)))
+
+    def test_laterFromKept(self):
+        mark = watermark.Watermark()
+        self._poll(mark, query.Query(1).fromTime(0).toTime(30))
+        qry = mark.apply(query.Query(1).fromTime(80))
+        self.assertEqual((80, None), qry.getMillisRange())
+
+    def test_persisted(self):
+        path = os.path.join(self.path, "mark.json")
+        mark = watermark.Watermark(path=path)
+        self._poll(mark, query.Query(1))
+        self.assertTrue(os.path.isfile(path))
+
+        loaded = watermark.Watermark(path=path)
+        self.assertEqual(mark.marks(), loaded.marks())
+        self.assertEqual([], self._poll(loaded, query.Query(1)))
+        self.assertRaises(ValueError, watermark.Watermark, path=path,
+                          timeUnit=query.TimeUnit.SECONDS)
+
+    def test_timeUnit(self):
+        mark = watermark.Watermark(timeUnit=query.TimeUnit.MICROSECONDS)
+        self.assertRaises(ValueError, mark.apply, query.Query(1))
+        qry = query.Query(1, timeUnit=query.TimeUnit.MICROSECONDS)
+        self.assertEqual(12, len(self._poll(mark, qry)))
+        self.assertEqual(90000, mark.get("dev1", "a"))
+        self.assertEqual(25, mark.apply(qry).getMillisRange()[0])
+        self.assertEqual([], self._poll(mark, qry))
+
+    def _pollEach(self, mark, qry):
+        pts = []
+        for q in mark.applyEach(qry):
+            pts.extend(results.iterPoints(mark.advance(self.service.getData(q))))
+        return pts
+
+    def test_applyEachPerSeries(self):
+        mark = watermark.Watermark(groupMillis=10)
+        qry = query.Query(1).fromTime(0)
+        self.assertEqual(1, len(mark.applyEach(qry)))
+        self.assertEqual(12, len(self._pollEach(mark, qry)))
+
+        # the stale dev2 is fetched alone from its mark, the rest from dev1's
+        qrys = mark.applyEach(qry)
+        self.assertEqual(["1/dev2/a", "1/all/all"], [q.getUrl() for q in qrys])
+        self.assertEqual([(25, 89), (90, None)], [q.getMillisRange() for q in qrys])
+
+        self.points[("dev1", "a")].append((95, 1))
+        self.points[("dev2", "a")].append((60, 2))
+        self.points[("dev3", "a")] = [(5, 3), (97, 4)]
+        self.assertEqual([("dev2", "a", 60, 2), ("dev1", "a", 95, 1),
+                          ("dev3", "a", 97, 4)], self._pollEach(mark, qry))
+        self.assertEqual([], self._pollEach(mark, qry))
+
+    def test_applyEachGroups(self):
+        mark = watermark.Watermark(groupMillis=10)
+        for did, t in (("d1", 0), ("d2", 5), ("d3", 50), ("d4", 100)):
+            mark.set(did, "a", t)
+        mark.set("other", "b", 1000)
+        qrys = mark.applyEach(query.Query(1, seriesName="a").fromTime(20).toTime(200))
+        # d1 and d2 are fetched together, but only after the query's start
+        self.assertEqual(["1/all/a", "1/all/a", "1/all/a"], [q.getUrl() for q in qrys])
+        self.assertEqual([(20, 49), (50, 99), (100, 200)],
+                         [q.getMillisRange() for q in qrys])
+
+        qrys = mark.applyEach(query.Query(1, deviceId="d3"))
+        self.assertEqual([("1/d3/all", (50, None))],
+                         [(q.getUrl(), q.getMillisRange()) for q in qrys])
+        self.assertRaises(ValueError, watermark.Watermark, groupMillis=-1)
+        self.assertRaises(ValueError, mark.applyEach,
+                          query.Query(1, timeUnit=query.TimeUnit.SECONDS))
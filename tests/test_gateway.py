@@ -0,0 +1,179 @@
+import shutil
+import tempfile
+import unittest
+import sys
+if sys.version_info > (3, 2):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+from iobeam import iobeam
+from iobeam.endpoints import imports
+from iobeam.resources import data
+from tests.http import dummy_backend
+from tests.http import request
+
+DummyBackend = dummy_backend.DummyBackend
+RecordingRequester = dummy_backend.RecordingRequester
+
+
+class TestGatewayClient(unittest.TestCase):
+
+    def _makeGateway(self, backend=None, maxConcurrency=4, path=None):
+        with patch.object(iobeam.GatewayClient, "_checkToken"):
+            return iobeam.GatewayClient(1, "dummy", backend,
+                                        maxConcurrency=maxConcurrency, path=path)
+
+    def test_constructorBad(self):
+        for bad in [0, -1, None, "2"]:
+            try:
+                self._makeGateway(maxConcurrency=bad)
+                self.assertTrue(False)
+            except ValueError:
+                pass
+
+    def test_buildGateway(self):
+        builder = iobeam.ClientBuilder(1, "dummy").autoFlush(maxRows=10)
+        with patch.object(iobeam.GatewayClient, "_checkToken"):
+            gw = builder.buildGateway(maxConcurrency=2)
+        self.assertTrue(isinstance(gw, iobeam.GatewayClient))
+        self.assertTrue(gw._flusher.isRunning())
+        self.assertTrue(gw.close())
+
+        builder = iobeam.ClientBuilder(1, "dummy").setDeviceId("dev")
+        try:
+            builder.buildGateway()
+            self.assertTrue(False)
+        except ValueError:
+            pass
+
+    def test_createDataStore(self):
+        gw = self._makeGateway()
+        ds = gw.createDataStore("dev1", ["a"])
+        self.assertEqual(ds, gw.createDataStore("dev1", ["a"]))
+        self.assertNotEqual(ds, gw.createDataStore("dev2", ["a"]))
+        self.assertEqual(sorted(["dev1", "dev2"]), sorted(gw.devices()))
+        try:
+            gw.createDataStore("bad id!", ["a"])
+            self.assertTrue(False)
+        except ValueError:
+            pass
+
+        gw.addDataStore("dev3", data.DataStore(["b"]))
+        self.assertEqual(3, len(gw.devices()))
+        self.assertEqual(1, len(gw.removeDevice("dev3")))
+        self.assertEqual(2, len(gw.devices()))
+
+    def test_registerDevice(self):
+        dummy = DummyBackend()
+        gw = self._makeGateway(backend=request.DummyRequester(dummy))
+        gw._checkToken = lambda: None
+        d = gw.registerDevice("dev1")
+        self.assertEqual("dev1", d.deviceId)
+        d = gw.registerDevice("dev1")
+        self.assertEqual("dev1", d.deviceId)
+        self.assertEqual(2, dummy.calls)
+
+    def test_registerDevices(self):
+        dummy = DummyBackend()
+        gw = self._makeGateway(backend=request.DummyRequester(dummy),
+                               maxConcurrency=1)
+        gw._checkToken = lambda: None
+        gw.registerDevice("dev1", deviceName="name1")
+        ret = gw.registerDevices([("dev1", "name1"), ("dev2", "name2")])
+        self.assertTrue(all(r.ok() for r in ret))
+        self.assertTrue(ret[0].existed)
+        self.assertFalse(ret[1].existed)
+        self.assertEqual(3, dummy.calls)
+
+    def test_registerUsesRegistry(self):
+        path = tempfile.mkdtemp()
+        try:
+            dummy = DummyBackend()
+            gw = self._makeGateway(backend=request.DummyRequester(dummy),
+                                   maxConcurrency=1, path=path)
+            gw._checkToken = lambda: None
+            gw.registerDevice("dev1", deviceName="name1")
+            gw.registerDevices([("dev2", "name2"), ("dev3", "name3")])
+            self.assertEqual(3, dummy.calls)
+
+            # A restarted gateway makes no registration calls
+            gw = self._makeGateway(backend=request.DummyRequester(dummy),
+                                   maxConcurrency=1, path=path)
+            self.assertEqual("name1", gw.registerDevice("dev1").deviceName)
+            ret = gw.registerDevices(["dev1", "dev2", "dev3"])
+            self.assertTrue(all(r.ok() and r.existed for r in ret))
+            self.assertEqual(3, dummy.calls)
+
+            gw._checkToken = lambda: None
+            ret = gw.registerDevices(["dev3", ("dev4", "name4")])
+            self.assertTrue(ret[0].existed)
+            self.assertFalse(ret[1].existed)
+            self.assertEqual(4, dummy.calls)
+        finally:
+            shutil.rmtree(path)
+
+    def test_send(self):
+        backend = RecordingRequester()
+        gw = self._makeGateway(backend=backend)
+        gw._checkToken = lambda: None
+
+        numDevices = 20
+        for i in range(0, numDevices):
+            did = "dev{}".format(i)
+            gw.createDataStore(did, ["a"]).add(0, {"a": i})
+            gw.createDataStore(did, ["b", "c"]).add(1, {"b": i})
+        rows, _, _ = gw._pendingStats()
+        self.assertEqual(numDevices * 2, rows)
+
+        gw.send()
+        # small stores for a device are merged into a single request
+        self.assertEqual(numDevices, len(backend.bodies))
+        for body in backend.bodies:
+            self.assertEqual(["time", "a", "b", "c"], body["sources"]["fields"])
+            self.assertEqual(2, len(body["sources"]["data"]))
+        self.assertEqual(0, gw._pendingStats()[0])
+
+    def test_sendPriorityDevicesFirst(self):
+        backend = RecordingRequester()
+        gw = self._makeGateway(backend=backend, maxConcurrency=1)
+        gw._checkToken = lambda: None
+        gw.createDataStore("dev1", ["a"]).add(0, {"a": 1})
+        gw.createDataStore("dev2", ["b"], priority=data.Priority.LOW).add(0, {"b": 1})
+        gw.createDataStore("dev3", ["c"], priority=data.Priority.HIGH).add(0, {"c": 1})
+        gw.send()
+        self.assertEqual(["dev3", "dev1", "dev2"],
+                         [b["device_id"] for b in backend.bodies])
+
+    def test_sendLargeNotMerged(self):
+        backend = RecordingRequester()
+        gw = self._makeGateway(backend=backend)
+        gw._checkToken = lambda: None
+        limit = imports.ImportService._BATCH_SIZE
+        a = gw.createDataStore("dev", ["a"])
+        b = gw.createDataStore("dev", ["b"])
+        for i in range(0, limit):
+            a.add(i, {"a": i})
+        b.add(0, {"b": 0})
+        gw.send()
+        self.assertEqual(2, len(backend.bodies))
+
+    def test_sendFailureRestores(self):
+        backend = RecordingRequester(failDevices=set(["bad"]))
+        gw = self._makeGateway(backend=backend)
+        gw._checkToken = lambda: None
+
+        good = gw.createDataStore("good", ["a"])
+        bad1 = gw.createDataStore("bad", ["a"])
+        bad2 = gw.createDataStore("bad", ["b"])
+        good.add(0, {"a": 0})
+        bad1.add(0, {"a": 0})
+        bad2.add(0, {"b": 0})
+        try:
+            gw.send()
+            self.assertTrue(False)
+        except Exception as e:
+            self.assertTrue("bad" in str(e))
+        self.assertEqual(0, good.numRows())
+        self.assertEqual(1, bad1.numRows())
+        self.assertEqual(1, bad2.numRows())
@@ -1,13 +1,21 @@
+import os
+import shutil
+import tempfile
 import unittest
 import sys
+import threading
+import time
 if sys.version_info > (3, 2):
     from unittest.mock import patch
 else:
     from mock import patch
 
+import requests
+
 from iobeam import iobeam
 from iobeam.endpoints import devices
 from iobeam.resources import data
+from iobeam.utils import offline
 from tests.http import dummy_backend
 from tests.http import request
 
@@ -41,6 +49,86 @@ class TestClientBuilder(unittest.TestCase):
         for t in bads:
             verify(1, t)
 
+    def test_autoFlushInvalid(self):
+        builder = iobeam.ClientBuilder(1, "dummy")
+        bads = [{}, {"maxRows": 0}, {"maxAge": -1}]
+        for kwargs in bads:
+            try:
+                builder.autoFlush(**kwargs)
+                self.assertTrue(False)
+            except ValueError:
+                pass
+
+    def test_buildAutoFlush(self):
+        builder = iobeam.ClientBuilder(1, "dummy").setDeviceId("test") \
+            .autoFlush(maxRows=10)
+        with patch.object(iobeam._Client, "_checkToken"):
+            client = builder.build()
+        self.assertTrue(client._flusher is not None)
+        self.assertTrue(client._flusher.isRunning())
+        self.assertTrue(client.close())
+        self.assertTrue(client._flusher is None)
+
+    def test_buildBufferBudget(self):
+        builder = iobeam.ClientBuilder(1, "dummy").setDeviceId("test")
+        self.assertRaises(ValueError, builder.bufferBudget, 0)
+        builder.bufferBudget(1024, policy=iobeam.BackpressurePolicy.DROP_OLDEST)
+        with patch.object(iobeam._Client, "_checkToken"):
+            client = builder.build()
+        stats = client.bufferStats()
+        self.assertEqual(1024, stats["maxBytes"])
+        self.assertEqual(0, stats["usedBytes"])
+
+    def test_buildRateLimit(self):
+        builder = iobeam.ClientBuilder(1, "dummy").setDeviceId("test") \
+            .setBackend("http://ratelimit.test/").rateLimit(requestsPerSec=5)
+        self.assertRaises(ValueError, builder.rateLimit, requestsPerSec=0)
+        with patch.object(iobeam._Client, "_checkToken"):
+            client = builder.build()
+        limiter = client._importService.requester().rateLimiter()
+        self.assertTrue(isinstance(limiter, iobeam.RateLimiter))
+        self.assertTrue(limiter is client._deviceService.requester().rateLimiter())
+        client.setRateLimiter(None)
+        self.assertTrue(client._importService.requester().rateLimiter() is None)
+
+    def test_hooksAndLimiterPerClient(self):
+        def hook(name, secs, info):
+            pass
+
+        builder = iobeam.ClientBuilder(1, "dummy").setDeviceId("test") \
+            .setBackend("http://perclient.test/")
+        with patch.object(iobeam._Client, "_checkToken"):
+            first = builder.build()
+            second = builder.build()
+        first.addHook(hook)
+        first.setRateLimiter(iobeam.RateLimiter(requestsPerSec=1))
+
+        shared = iobeam.request.getRequester(url="http://perclient.test/")
+        mine = first._importService.requester()
+        other = second._importService.requester()
+        self.assertTrue(mine is first._deviceService.requester())
+        self.assertFalse(mine is other)
+        self.assertEqual([hook], mine._hooks)
+        self.assertEqual([], other._hooks)
+        self.assertEqual([], shared._hooks)
+        self.assertTrue(other.rateLimiter() is None)
+        self.assertTrue(shared.rateLimiter() is None)
+        # connections are still pooled per backend
+        self.assertTrue(mine._session is shared._session)
+
+    def test_buildTokenRefresh(self):
+        builder = iobeam.ClientBuilder(1, "dummy").refreshTokenInBackground(10)
+        with patch.object(iobeam._Client, "_checkToken"):
+            with patch.object(iobeam.base.refresher.TokenRefresher, "_run"):
+                client = builder.build()
+                self.assertTrue(client._refresher is not None)
+                self.assertTrue(client.close())
+        try:
+            builder.refreshTokenInBackground(-1)
+            self.assertTrue(False)
+        except ValueError:
+            pass
+
     def test_chainable(self):
         builder = iobeam.ClientBuilder(1, "dummy")
         self.assertEqual(builder, builder.saveToDisk())
@@ -298,6 +386,29 @@ class TestClient(unittest.TestCase):
         client.registerDevice(deviceId="dummy", setOnDupe=True)
         self.assertTrue("dummy", client.getDeviceId())
 
+    def test_registerUsesRegistry(self):
+        path = tempfile.mkdtemp()
+        try:
+            dummy = DummyBackend()
+            with patch.object(iobeam._Client, "_checkToken"):
+                client = iobeam._Client(path, 1, "dummy", request.DummyRequester(dummy))
+            client._checkToken = checkTokenNone
+            client.registerDevice(deviceId="dev1", deviceName="name1")
+            self.assertEqual(1, dummy.calls)
+            with open(os.path.join(path, iobeam._DEVICE_ID_FILE)) as f:
+                self.assertEqual("dev1", f.read())
+
+            # Restart with a different active device; dev1 is still known
+            os.remove(os.path.join(path, iobeam._DEVICE_ID_FILE))
+            with patch.object(iobeam._Client, "_checkToken"):
+                client = iobeam._Client(path, 1, "dummy", request.DummyRequester(dummy))
+            client._checkToken = checkTokenNone
+            client.registerDevice(deviceId="dev1", setOnDupe=True)
+            self.assertEqual("dev1", client.getDeviceId())
+            self.assertEqual(1, dummy.calls)
+        finally:
+            shutil.rmtree(path)
+
     def test_registerBadIds(self):
         def check(client, deviceId):
             try:
@@ -360,6 +471,251 @@ class TestClient(unittest.TestCase):
         # 2: 'fields' and 'data', batch format
         self.assertEqual(2, len(dummy.lastJson["sources"]))
 
+    def test_addHook(self):
+        spans = []
+        def hook(name, secs, info):
+            spans.append(name)
+
+        dummy = DummyBackend()
+        backend = request.DummyRequester(dummy)
+        client = self._makeTempClient(backend=backend, deviceId="fake")
+        client._checkToken = checkTokenNone
+        client.addHook(hook)
+
+        store = client.createDataStore(["test"])
+        store.add(0, {"test": 0})
+        client.send()
+        self.assertEqual(["imports.build", "imports.chunk"], spans)
+
+        client.removeHook(hook)
+        store.add(0, {"test": 0})
+        client.send()
+        self.assertEqual(2, len(spans))
+
+    def test_pendingStats(self):
+        client = self._makeTempClient(deviceId="fake")
+        self.assertEqual((0, 0, None), client._pendingStats())
+
+        store = client.createDataStore(["a", "b"])
+        store.add(0, {"a": 1})
+        client.addDataPoint("c", iobeam.DataPoint(1))
+        rows, size, oldest = client._pendingStats()
+        self.assertEqual(2, rows)
+        self.assertTrue(size > 0)
+        self.assertTrue(oldest is not None)
+
+    def test_bufferBudget(self):
+        dummy = DummyBackend()
+        client = self._makeTempClient(backend=request.DummyRequester(dummy),
+                                      deviceId="fake")
+        client._checkToken = checkTokenNone
+        self.assertIsNone(client.bufferStats())
+        store = client.createDataStore(["a"])
+        store.add(0, {"a": 0})
+
+        b = iobeam.BufferBudget(4 * iobeam._POINT_BYTES,
+                                policy=iobeam.BackpressurePolicy.DROP_NEWEST)
+        client.setBufferBudget(b)
+        self.assertEqual(1, client.bufferStats()["usedBytes"] // iobeam._POINT_BYTES)
+
+        # stores created later and legacy points share the budget
+        other = client.createDataStore(["b"])
+        other.add(0, {"b": 0})
+        client.addDataPoint("c", iobeam.DataPoint(1, timestamp=1))
+        client.addDataPoint("c", iobeam.DataPoint(1, timestamp=1))  # dupe
+        client.addDataPoint("c", iobeam.DataPoint(2, timestamp=2))
+        client.addDataPoint("c", iobeam.DataPoint(3, timestamp=3))
+        stats = client.bufferStats()
+        self.assertEqual(1.0, stats["occupancy"])
+        self.assertEqual(1, stats["droppedRows"])
+
+        client.send()
+        self.assertEqual(0, client.bufferStats()["usedBytes"])
+
+        client.setBufferBudget(None)
+        self.assertIsNone(store._budget)
+        self.assertIsNone(b.onFull)
+
+    def test_bufferBudgetRequestsFlush(self):
+        client = self._makeTempClient(deviceId="fake")
+        requested = []
+
+        class Flusher(object):
+            def requestFlush(self):
+                requested.append(1)
+
+        client._flusher = Flusher()
+        client.setBufferBudget(iobeam.BufferBudget(
+            1, policy=iobeam.BackpressurePolicy.DROP_NEWEST))
+        client.createDataStore(["a"]).add(0, {"a": 0})
+        self.assertEqual(1, len(requested))
+        client._flusher = None
+
+    def test_bufferBudgetBlockWithoutFlusher(self):
+        client = self._makeTempClient(deviceId="fake")
+        client.setBufferBudget(iobeam.BufferBudget(
+            iobeam._POINT_BYTES, policy=iobeam.BackpressurePolicy.BLOCK))
+        store = client.createDataStore(["a"])
+        store.add(0, {"a": 0})
+        self.assertRaises(iobeam.budget.BufferFullError, store.add, 1, {"a": 1})
+        self.assertRaises(iobeam.budget.BufferFullError, client.addDataPoint, "b",
+                          iobeam.DataPoint(1, timestamp=1))
+
+    def _recordingBackend(self, onImport=None):
+        class Recording(DummyBackend):
+            def __init__(self):
+                DummyBackend.__init__(self)
+                self.sent = []
+
+            def importData(self, body, isBatch):
+                fields = body["sources"]["fields"]
+                self.sent.append((fields[1], len(body["sources"]["data"])))
+                if onImport is not None:
+                    onImport()
+                return DummyBackend.importData(self, body, isBatch)
+        return Recording()
+
+    def test_sendPriorityOrder(self):
+        dummy = self._recordingBackend()
+        client = self._makeTempClient(backend=request.DummyRequester(dummy),
+                                      deviceId="fake")
+        client._checkToken = checkTokenNone
+        low = client.createDataStore(["low"], priority=iobeam.Priority.LOW)
+        normal = client.createDataStore(["normal"])
+        high = client.createDataStore(["high"], priority=iobeam.Priority.HIGH)
+        self.assertTrue(high is client.createDataStore(["high"], priority=iobeam.Priority.HIGH))
+        self.assertFalse(high is client.createDataStore(["high"]))
+        for s, name in [(low, "low"), (normal, "normal"), (high, "high")]:
+            s.add(0, {name: 1})
+
+        client.send()
+        self.assertEqual([("high", 1), ("normal", 1), ("low", 1)], dummy.sent)
+
+    def test_sendHighBetweenLowChunks(self):
+        added = []
+
+        def addUrgent():
+            if len(added) == 0:
+                added.append(1)
+                high.add(1, {"high": 1})
+
+        dummy = self._recordingBackend(onImport=addUrgent)
+        client = self._makeTempClient(backend=request.DummyRequester(dummy),
+                                      deviceId="fake")
+        client._checkToken = checkTokenNone
+        high = client.createDataStore(["high"], priority=iobeam.Priority.HIGH)
+        low = client.createDataStore(["low"], priority=iobeam.Priority.LOW)
+        for i in range(0, 2500):
+            low.add(i, {"low": i})
+
+        client.send()
+        self.assertEqual(4, len(dummy.sent))
+        self.assertEqual(("high", 1), dummy.sent[1])
+        self.assertEqual(2500, sum(n for name, n in dummy.sent if name == "low"))
+
+    def test_sendLowPriorityShare(self):
+        dummy = self._recordingBackend()
+        client = self._makeTempClient(backend=request.DummyRequester(dummy),
+                                      deviceId="fake")
+        client._checkToken = checkTokenNone
+        self.assertRaises(ValueError, client.setLowPriorityShare, 1.5)
+        client.setLowPriorityShare(0.2)
+        high = client.createDataStore(["high"], priority=iobeam.Priority.HIGH)
+        low = client.createDataStore(["low"], priority=iobeam.Priority.LOW)
+        for i in range(0, 8):
+            high.add(i, {"high": i})
+        for i in range(0, 10):
+            low.add(i, {"low": i})
+
+        client.send()
+        self.assertEqual([("high", 8), ("low", 2)], dummy.sent)
+        self.assertEqual(8, low.numRows())
+        self.assertEqual(2000, low.rows()[0]["time"])
+
+        # nothing more urgent pending, so the rest goes
+        client.send()
+        self.assertEqual(("low", 8), dummy.sent[-1])
+        self.assertEqual(0, low.numRows())
+
+    def test_autoFlush(self):
+        dummy = DummyBackend()
+        backend = request.DummyRequester(dummy)
+        client = self._makeTempClient(backend=backend, deviceId="fake")
+        client._checkToken = checkTokenNone
+        client.startAutoFlush(maxRows=3, checkInterval=0.01)
+
+        store = client.createDataStore(["test"])
+        for i in range(0, 3):
+            store.add(i, {"test": i})
+        for _ in range(0, 200):
+            if dummy.calls > 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(1, dummy.calls)
+
+        store.add(5, {"test": 5})
+        self.assertTrue(client.close(drain=True))
+        self.assertEqual(2, dummy.calls)
+        self.assertEqual(0, len(store))
+
+    def test_autoFlushDrainsSpilledRows(self):
+        path = tempfile.mkdtemp()
+        try:
+            dummy = DummyBackend()
+            client = self._makeTempClient(backend=request.DummyRequester(dummy),
+                                          deviceId="fake")
+            client._checkToken = checkTokenNone
+            client.setBufferBudget(iobeam.BufferBudget(
+                2 * iobeam._POINT_BYTES, policy=iobeam.BackpressurePolicy.SPILL,
+                spillPath=path))
+            store = client.createDataStore(["test"])
+            for i in range(0, 3):
+                store.add(i, {"test": i})
+            self.assertEqual(3, client._pendingStats()[0])
+
+            # only spilled rows are left once the in-memory ones are gone
+            store._takeAll()
+            self.assertEqual(0, store.numRows())
+            rows, size, oldest = client._pendingStats()
+            self.assertEqual(2, rows)
+            self.assertTrue(size > 0)
+            self.assertTrue(oldest is not None)
+
+            client.startAutoFlush(maxRows=100, checkInterval=60)
+            self.assertTrue(client.close(drain=True))
+            self.assertEqual(1, dummy.calls)
+            self.assertEqual(0, client._pendingStats()[0])
+            self.assertEqual(0, len(os.listdir(path)))
+        finally:
+            shutil.rmtree(path)
+
+    def test_checkTokenRefreshes(self):
+        dummy = DummyBackend()
+        backend = request.DummyRequester(dummy)
+        client = self._makeTempClient(backend=backend, deviceId="fake")
+        with patch.object(iobeam.utils, "isExpiredToken", return_value=True):
+            client._checkToken()
+        self.assertEqual(dummy_backend.NEW_TOKEN, client.projectToken)
+        self.assertEqual(dummy_backend.NEW_TOKEN, client._importService.token)
+        self.assertEqual(dummy_backend.NEW_TOKEN, client._deviceService.token)
+
+        with patch.object(iobeam.utils, "isExpiredToken", return_value=False):
+            client._checkToken()
+        self.assertEqual(1, dummy.calls)
+
+    def test_tokenRefreshLifecycle(self):
+        client = self._makeTempClient(deviceId="fake")
+        with patch.object(iobeam.base.refresher.TokenRefresher, "_run"):
+            client.startTokenRefresh(margin=10)
+            self.assertTrue(client._refresher is not None)
+            self.assertTrue(client.close())
+        self.assertTrue(client._refresher is None)
+        try:
+            client.startTokenRefresh(margin=-1)
+            self.assertTrue(False)
+        except ValueError:
+            pass
+
     def test_addDataStore(self):
         dummy = DummyBackend()
         backend = request.DummyRequester(dummy)
@@ -381,6 +737,15 @@ class TestClient(unittest.TestCase):
         self.assertEqual(ds, ds2)
 
 
+    def test_createConcurrentDataStore(self):
+        client = self._makeTempClient(deviceId="fake")
+        ds = client.createDataStore(["col1"])
+        cds = client.createDataStore(["col1"], concurrent=True)
+        self.assertTrue(isinstance(cds, iobeam.ConcurrentDataStore))
+        self.assertNotEqual(ds, cds)
+        self.assertEqual(cds, client.createDataStore(["col1"], concurrent=True))
+        self.assertEqual(2, len(client._batches))
+
     def test_sendWithBatch(self):
         dummy = DummyBackend()
         backend = request.DummyRequester(dummy)
@@ -404,6 +769,116 @@ class TestClient(unittest.TestCase):
         # 2: 'fields' and 'data', batch format
         self.assertEqual(2, len(dummy.lastJson["sources"]))
 
+    def test_sendFailureKeepsRows(self):
+        dummy = DummyBackend()
+        backend = request.DummyRequester(dummy)
+        client = self._makeTempClient(backend=backend, deviceId="fake")
+        client._checkToken = checkTokenNone
+
+        temp = client.createDataStore(["test"])
+        temp.add(iobeam.Timestamp(0), {"test": 0})
+        temp.add(iobeam.Timestamp(1), {"test": 11})
+        with patch.object(client._importService, "importBatch",
+                          return_value=(False, "error")):
+            self.assertRaises(Exception, client.send)
+        self.assertEqual(2, temp.numRows())
+
+        with patch.object(client._importService, "importBatch",
+                          side_effect=IOError("network down")):
+            self.assertRaises(IOError, client.send)
+        self.assertEqual(2, temp.numRows())
+
+        client.send()
+        self.assertEqual(0, temp.numRows())
+        self.assertEqual(1, dummy.calls)
+
+    def test_sendResumesAfterPartialFailure(self):
+        client = self._makeTempClient(deviceId="fake")
+        client._checkToken = checkTokenNone
+        store = client.createDataStore(["test"])
+        for i in range(0, 10):
+            store.add(i, {"test": i})
+        client.addDataPoint("legacy", iobeam.DataPoint(1, timestamp=1))
+
+        def partial(pid, did, batch):
+            return iobeam.imports.ImportResult(
+                False, "error", ackedChunks=1, totalChunks=2, acked=6,
+                remaining=batch.slice(6))
+
+        with patch.object(client._importService, "importBatch",
+                          side_effect=partial):
+            self.assertRaises(Exception, client.send)
+        self.assertEqual(4, store.numRows())
+        self.assertEqual(6000, store.rows()[0]["time"])
+        # legacy points were not attempted, so they are kept
+        self.assertEqual(1, len(client._dataset["legacy"]))
+
+        sent = []
+        def record(pid, did, batch):
+            sent.append(batch.numRows())
+            return iobeam.imports.ImportResult(True, None)
+
+        with patch.object(client._importService, "importBatch",
+                          side_effect=record):
+            client.send()
+        self.assertEqual([4, 1], sent)
+        self.assertEqual(0, len(client._dataset))
+
+    def test_sendChunksFromOneSwap(self):
+        client = self._makeTempClient(deviceId="fake")
+        client._checkToken = checkTokenNone
+        store = client.createDataStore(["test"], concurrent=True)
+        for i in range(0, 25):
+            store.add(i, {"test": i})
+        swaps = []
+        realSwap = store.swap
+
+        def swap():
+            swaps.append(1)
+            return realSwap()
+
+        sent = []
+        def failThird(pid, did, batch):
+            sent.append(batch.numRows())
+            if len(sent) == 3:
+                raise Exception("down")
+            return iobeam.imports.ImportResult(True, None)
+
+        with patch.object(iobeam.imports.ImportService, "_BATCH_SIZE", 5), \
+                patch.object(store, "swap", side_effect=swap), \
+                patch.object(client._importService, "importBatch",
+                             side_effect=failThird):
+            self.assertRaises(Exception, client.send)
+        self.assertEqual([5, 5, 5], sent)
+        self.assertEqual(1, len(swaps))
+        # the failed chunk and everything after it is back, in order
+        self.assertEqual(list(range(10, 25)), [r["time"] // 1000 for r in store.rows()])
+
+    def test_sendWhileProducing(self):
+        client = self._makeTempClient(deviceId="fake")
+        client._checkToken = checkTokenNone
+        store = client.createDataStore(["test"])
+        sent = []
+
+        def importBatch(pid, did, batch):
+            sent.append(batch.numRows())
+            return (True, None)
+
+        total = 20000
+        def produce():
+            for i in range(0, total):
+                store.add(i, {"test": i})
+
+        t = threading.Thread(target=produce)
+        with patch.object(client._importService, "importBatch",
+                          side_effect=importBatch):
+            t.start()
+            while t.is_alive():
+                client.send()
+            t.join()
+            client.send()
+        self.assertEqual(total, sum(sent))
+
     def test_queryInvalid(self):
         def verify(token, qry):
             try:
@@ -429,10 +904,205 @@ class TestClient(unittest.TestCase):
             self.assertEqual(want, ret)
             mm.assert_called_once_with(qry)
 
+    def test_queryNew(self):
+        qry = iobeam.QueryReq(1).fromTime(0)
+        resp = {"result": [{"device_id": "d", "sources": [
+            {"name": "a", "data": [{"time": 10, "value": 1}, {"time": 20, "value": 2}]}]}]}
+        mark = iobeam.Watermark()
+        with patch.object(iobeam.exports.ExportService, "getData",
+                          return_value=resp) as mm:
+            ret = iobeam.pollQuery("dummy", qry, mark)
+            self.assertEqual(2, len(ret["result"][0]["sources"][0]["data"]))
+            ret = iobeam.pollQuery("dummy", qry, mark)
+            self.assertEqual([], ret["result"])
+            self.assertEqual(20, mm.call_args[0][0].getMillisRange()[0])
+        self.assertRaises(ValueError, iobeam.pollQuery, "dummy", qry, None)
+
 
     def test_makeQuery(self):
         want = {"test": "complete"}
         with patch.object(iobeam._Client, "query", return_value=want) as mm:
             ret = iobeam.makeQuery("dummy", None)
             self.assertEqual(want, ret)
-            mm.assert_called_once_with("dummy", None, None)
+            mm.assert_called_once_with("dummy", None, None, cache=None, rangeCache=None)
+
+
+class TestClientOffline(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.requester = dummy_backend.RecordingRequester()
+        with patch.object(iobeam._Client, "_checkToken"):
+            self.client = iobeam._Client(None, 1, "dummy", self.requester, deviceId="fake")
+        self.client._checkToken = checkTokenNone
+
+    def tearDown(self):
+        self.client.close(drain=False)
+        shutil.rmtree(self.path)
+
+    def _enable(self, probeInterval=3600, maxConcurrency=2):
+        self.client.enableOffline(self.path, probeInterval=probeInterval,
+                                  maxConcurrency=maxConcurrency)
+
+    def test_enableBad(self):
+        self.assertRaises(ValueError, self.client.enableOffline, self.path, probeInterval=0)
+        self.assertRaises(ValueError, self.client.enableOffline, self.path, maxConcurrency=0)
+        self.assertEqual(0, self.client.offlineBacklog())
+
+    def test_withoutOfflineRaises(self):
+        store = self.client.createDataStore(["a"])
+        store.add(1, {"a": 1})
+        self.requester.down = True
+        self.assertRaises(requests.exceptions.ConnectionError, self.client.send)
+        self.assertEqual(1, store.numRows())
+
+    def test_queueAndDrain(self):
+        self._enable()
+        store = self.client.createDataStore(["a"])
+        store.add(1, {"a": 1})
+        self.client.addDataPoint("b", iobeam.DataPoint(2, timestamp=2))
+        self.requester.down = True
+        self.client.send()
+        self.assertTrue(self.client.isOffline())
+        self.assertEqual(0, store.numRows())
+        self.assertEqual(0, len(self.client._dataset))
+        self.assertEqual(2, self.client.offlineBacklog())
+
+        # while offline and no probe is due, sends only queue data
+        store.add(3, {"a": 3})
+        self.client.send()
+        self.assertEqual(3, self.client.offlineBacklog())
+        self.assertEqual(0, self.requester.probes)
+
+        self.requester.down = False
+        self.client._lastProbe = None
+        store.add(4, {"a": 4})
+        self.client.send()
+        self.assertFalse(self.client.isOffline())
+        self.assertEqual(1, self.requester.probes)
+        self.assertEqual(0, self.client.offlineBacklog())
+        self.assertEqual(set([1000, 2000, 3000]), set(self.requester.imported[0:3]))
+        self.assertEqual(4000, self.requester.imported[3])
+
+    def test_closeWhileOffline(self):
+        self._enable()
+        self.client.startAutoFlush(maxRows=1000, checkInterval=60)
+        store = self.client.createDataStore(["a"])
+        store.add(1, {"a": 1})
+        self.requester.down = True
+        self.assertTrue(self.client.close(drain=True))
+        self.assertEqual(0, store.numRows())
+        self.assertEqual(1, len(offline.OfflineQueue(self.path)))
+        self.assertIsNone(self.client._reconnector)
+
+    def test_rejectedBatchNotRetried(self):
+        self._enable()
+        self.client.createDataStore(["a"]).add(1, {"a": 1})
+        self.requester.down = True
+        self.client.send()
+        self.requester.down = False
+        self.client._lastProbe = None
+        with patch.object(self.client._importService, "importBatch",
+                          return_value=iobeam.imports.ImportResult(False, "bad data",
+                                                                   status=400)) as mm:
+            self.client.send()
+            self.client.send()
+            self.assertEqual(1, mm.call_count)
+        self.assertEqual(0, self.client.offlineBacklog())
+        self.assertEqual(1, len(self.client._offline.rejected()))
+
+    def test_serverErrorKeepsBatchQueued(self):
+        self._enable()
+        self.client.createDataStore(["a"]).add(1, {"a": 1})
+        self.requester.down = True
+        self.client.send()
+        self.requester.down = False
+        self.client._lastProbe = None
+        with patch.object(self.client._importService, "importBatch",
+                          return_value=iobeam.imports.ImportResult(False, "busy",
+                                                                   status=503)) as mm:
+            self.client.send()
+            self.assertEqual(1, mm.call_count)
+            self.assertTrue(self.client.isOffline())
+            # backing off: no retry until the next probe
+            self.client.send()
+            self.assertEqual(1, mm.call_count)
+        self.assertEqual(1, self.client.offlineBacklog())
+        self.assertEqual([], self.client._offline.rejected())
+
+        self.client._lastProbe = None
+        self.client._reconnect()
+        self.assertEqual(0, self.client.offlineBacklog())
+        self.assertEqual([1000], self.requester.imported)
+
+    def test_corruptBatchRejected(self):
+        self._enable()
+        self.client.createDataStore(["a"]).add(1, {"a": 1})
+        self.requester.down = True
+        self.client.send()
+        self.requester.down = False
+        entry = self.client._offline.entries()[0]
+        with open(entry, "w") as f:
+            f.write("{not json")
+        self.client._lastProbe = None
+        self.client._reconnect()
+        self.assertEqual(0, self.client.offlineBacklog())
+        self.assertEqual(1, len(self.client._offline.rejected()))
+
+    def test_queueSurvivesRestart(self):
+        self._enable()
+        self.client.createDataStore(["a"]).add(1, {"a": 1})
+        self.requester.down = True
+        self.client.send()
+        self.client.close(drain=False)
+
+        self.requester.down = False
+        with patch.object(iobeam._Client, "_checkToken"):
+            client = iobeam._Client(None, 1, "dummy", self.requester, deviceId="fake")
+        client._checkToken = checkTokenNone
+        client.enableOffline(self.path, probeInterval=3600)
+        self.assertEqual(1, client.offlineBacklog())
+        client.send()
+        client.close(drain=False)
+        self.assertEqual([1000], self.requester.imported)
+
+    def test_drainInTimeOrder(self):
+        self._enable(maxConcurrency=1)
+        store = self.client.createDataStore(["a"])
+        self.requester.down = True
+        for t in [5, 1, 3]:
+            store.add(t, {"a": t})
+            self.client.send()
+        self.requester.down = False
+        self.client._reconnect()
+        self.assertEqual([], self.requester.imported)  # probe not due yet
+        self.client._lastProbe = None
+        self.client._reconnect()
+        self.assertEqual([1000, 3000, 5000], self.requester.imported)
+        self.assertEqual(0, self.client.offlineBacklog())
+
+    def test_reconnectInBackground(self):
+        self._enable(probeInterval=0.01)
+        self.client.createDataStore(["a"]).add(1, {"a": 1})
+        self.requester.down = True
+        self.client.send()
+        self.requester.down = False
+        for _ in range(0, 200):
+            if self.client.offlineBacklog() == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(0, self.client.offlineBacklog())
+        self.assertFalse(self.client.isOffline())
+        self.assertEqual([1000], self.requester.imported)
+
+    def test_builder(self):
+        builder = iobeam.ClientBuilder(1, "dummy").setDeviceId("fake") \
+            .offlineMode(self.path, probeInterval=60, maxConcurrency=2)
+        self.assertRaises(ValueError, builder.offlineMode, self.path, probeInterval=0)
+        self.assertRaises(ValueError, builder.offlineMode, self.path, maxConcurrency=0)
+        with patch.object(iobeam._Client, "_checkToken"):
+            client = builder.build()
+        self.assertEqual(2, client._drainConcurrency)
+        self.assertTrue(client._reconnector.isRunning())
+        self.assertTrue(client.close(drain=False))
+        self.assertIsNone(client._reconnector)
@@ -0,0 +1,104 @@
+import sys
+import unittest
+if sys.version_info > (3, 2):
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+from iobeam.utils import cache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def timer(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_badArgs(self):
+        self.assertRaises(ValueError, cache.LRUCache, maxEntries=0)
+        self.assertRaises(ValueError, cache.LRUCache, maxBytes=-1)
+        self.assertRaises(ValueError, cache.LRUCache, ttl=0)
+
+    def test_getPut(self):
+        c = cache.LRUCache()
+        self.assertIsNone(c.get("a"))
+        c.put("a", {"x": [1, 2]})
+        self.assertEqual({"x": [1, 2]}, c.get("a"))
+        stats = c.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(0.5, stats["hitRate"])
+        self.assertEqual(1, stats["entries"])
+
+    def test_valuesCopied(self):
+        c = cache.LRUCache()
+        value = {"x": [1]}
+        c.put("a", value)
+        value["x"].append(2)
+        got = c.get("a")
+        self.assertEqual({"x": [1]}, got)
+        got["x"].append(3)
+        self.assertEqual({"x": [1]}, c.get("a"))
+
+    def test_maxEntriesLRU(self):
+        c = cache.LRUCache(maxEntries=2)
+        c.put("a", 1)
+        c.put("b", 2)
+        c.get("a")  # b is now least recently used
+        c.put("c", 3)
+        self.assertEqual(2, len(c))
+        self.assertEqual(1, c.get("a"))
+        self.assertIsNone(c.get("b"))
+        self.assertEqual(3, c.get("c"))
+        self.assertEqual(1, c.stats()["evictions"])
+
+    def test_maxBytes(self):
+        c = cache.LRUCache(maxBytes=10)
+        c.put("a", "1234")  # 6 bytes as JSON
+        c.put("b", "12")  # 4 bytes
+        self.assertEqual(10, c.stats()["bytes"])
+        c.put("c", "1")
+        self.assertIsNone(c.get("a"))
+        self.assertEqual(7, c.stats()["bytes"])
+
+        # too big to ever fit
+        c.put("d", "12345678901")
+        self.assertIsNone(c.get("d"))
+        self.assertEqual("12", c.get("b"))
+
+    def test_replace(self):
+        c = cache.LRUCache(maxBytes=100)
+        c.put("a", "1234")
+        c.put("a", "12")
+        self.assertEqual(1, len(c))
+        self.assertEqual(4, c.stats()["bytes"])
+        self.assertEqual("12", c.get("a"))
+
+    def test_ttl(self):
+        clock = FakeClock()
+        with patch.object(cache.utils, "timer", clock.timer):
+            c = cache.LRUCache(ttl=5)
+            c.put("a", 1)
+            clock.now += 4.9
+            self.assertEqual(1, c.get("a"))
+            clock.now += 0.1
+            self.assertIsNone(c.get("a"))
+        stats = c.stats()
+        self.assertEqual(1, stats["expirations"])
+        self.assertEqual(0, stats["entries"])
+
+    def test_invalidateClear(self):
+        c = cache.LRUCache()
+        c.put("a", 1)
+        c.put("b", 2)
+        c.invalidate("a")
+        c.invalidate("missing")
+        self.assertIsNone(c.get("a"))
+        c.clear()
+        self.assertEqual(0, len(c))
+        self.assertEqual(0, c.stats()["bytes"])
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from iobeam.endpoints import imports
+from iobeam.resources import data
+from iobeam.utils import offline
+
+
+class TestOfflineQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _store(self, times, priority=data.Priority.NORMAL):
+        store = data.DataStore(["a", "b"], priority=priority)
+        for t in times:
+            store.add(t, {"a": t})
+        return store
+
+    def test_putLoadRemove(self):
+        q = offline.OfflineQueue(os.path.join(self.path, "queue"))
+        self.assertEqual(0, len(q))
+        q.put("d1", self._store([]))
+        self.assertEqual(0, len(q))
+
+        first = q.put("d1", self._store([30, 40]))
+        q.put("d2", self._store([10, 20], priority=data.Priority.HIGH))
+        entries = q.entries()
+        self.assertEqual(2, len(entries))
+        self.assertEqual(first, entries[1])
+
+        did, store = q.load(entries[0])
+        self.assertEqual("d2", did)
+        self.assertEqual(data.Priority.HIGH, store.priority())
+        self.assertEqual(["a", "b"], store.columns())
+        self.assertEqual([{"time": 10000, "a": 10, "b": None},
+                          {"time": 20000, "a": 20, "b": None}], store.rows())
+
+        q.remove(entries[0])
+        q.remove(entries[0])
+        self.assertEqual(1, len(offline.OfflineQueue(q.path)))
+
+    def test_reject(self):
+        q = offline.OfflineQueue(self.path)
+        self.assertEqual([], q.rejected())
+        entry = q.put("d1", self._store([10]))
+        q.reject(entry)
+        self.assertEqual(0, len(q))
+        self.assertEqual(1, len(q.rejected()))
+        self.assertEqual("d1", q.load(q.rejected()[0])[0])
+
+    def test_isNetworkError(self):
+        self.assertTrue(offline.isNetworkError(requests.exceptions.ConnectionError()))
+        self.assertTrue(offline.isNetworkError(requests.exceptions.Timeout()))
+        self.assertFalse(offline.isNetworkError(ValueError()))
+        self.assertFalse(offline.isNetworkError(IOError("disk full")))
+        self.assertFalse(offline.isNetworkError(OSError("permission denied")))
+        result = imports.ImportResult(False, None)
+        self.assertTrue(offline.isNetworkError(
+            imports.PartialImportError(result, requests.exceptions.ConnectionError())))
+        self.assertFalse(offline.isNetworkError(
+            imports.PartialImportError(result, Exception("500"))))
+
+    def test_isPermanentStatus(self):
+        for status in [400, 403, 404, 422]:
+            self.assertTrue(offline.isPermanentStatus(status))
+        for status in [None, 200, 401, 408, 429, 500, 503]:
+            self.assertFalse(offline.isPermanentStatus(status))
+
+    def test_isTransientError(self):
+        self.assertTrue(offline.isTransientError(requests.exceptions.ConnectionError()))
+        self.assertTrue(offline.isTransientError(offline.ServerUnavailableError(503, "busy")))
+        self.assertFalse(offline.isTransientError(ValueError()))
+
+    def test_loadCorrupt(self):
+        path = os.path.join(self.path, "corrupt.json")
+        with open(path, "w") as f:
+            f.write("{not json")
+        self.assertRaises(offline.UnreadableBatchError, offline.OfflineQueue.load, path)
+        self.assertRaises(offline.UnreadableBatchError, offline.OfflineQueue.load,
+                          os.path.join(self.path, "missing.json"))
@@ -0,0 +1,164 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from iobeam.endpoints import exports
+from iobeam.resources import query
+from iobeam.resources import results
+from iobeam.utils import rangecache
+from tests.http import dummy_backend
+from tests.http import request
+
+_TOKEN = "dummy"
+
+
+class TestIntervalSet(unittest.TestCase):
+
+    def test_addMerges(self):
+        s = rangecache.IntervalSet()
+        s.add(10, 20)
+        s.add(30, 40)
+        self.assertEqual([(10, 20), (30, 40)], s.intervals())
+        s.add(21, 25)  # adjacent
+        self.assertEqual([(10, 25), (30, 40)], s.intervals())
+        s.add(0, 35)
+        self.assertEqual([(0, 40)], s.intervals())
+        s.add(50, 60)
+        s.add(45, 45)
+        self.assertEqual([(0, 40), (45, 45), (50, 60)], s.intervals())
+        self.assertRaises(ValueError, s.add, 5, 4)
+
+    def test_gaps(self):
+        s = rangecache.IntervalSet([(10, 20), (30, 40)])
+        self.assertEqual([(0, 9), (21, 29), (41, 50)], s.gaps(0, 50))
+        self.assertEqual([(21, 29)], s.gaps(15, 35))
+        self.assertEqual([], s.gaps(12, 18))
+        self.assertEqual([(100, 200)], s.gaps(100, 200))
+        self.assertTrue(s.covers(30, 40))
+        self.assertFalse(s.covers(30, 41))
+
+
+# (deviceId, series) -> (start, stop, step, scale), see dummy_backend.makePoints
+_POINTS = {
+    ("dev1", "a"): (0, 1000, 10, 2),
+    ("dev2", "a"): (5, 1000, 50, 1)
+}
+
+
+class TestRangeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.backend = dummy_backend.ExportBackend(dummy_backend.makePoints(_POINTS))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _service(self, cache):
+        return exports.ExportService(_TOKEN, requester=request.DummyRequester(self.backend),
+                                     rangeCache=cache)
+
+    def _expected(self, start, end, mult=1):
+        ret = {}
+        for key, pts in dummy_backend.makePoints(_POINTS).items():
+            ret[key] = [(t * mult, v) for t, v in pts if start <= t <= end]
+        return ret
+
+    def _collect(self, resp):
+        ret = {}
+        for did, name, t, v in results.iterPoints(resp):
+            ret.setdefault((did, name), []).append((t, v))
+        return ret
+
+    def test_badArgs(self):
+        self.assertRaises(ValueError, rangecache.RangeCache, None)
+        self.assertRaises(ValueError, rangecache.RangeCache, os.path.join(self.path, "x"))
+        self.assertRaises(ValueError, rangecache.RangeCache, self.path, lag=-1)
+
+    def test_fetchesGapsOnly(self):
+        cache = rangecache.RangeCache(self.path)
+        service = self._service(cache)
+        resp = service.getData(query.Query(1).inTimeRange(100, 300))
+        self.assertEqual(self._expected(100, 300), self._collect(resp))
+        self.assertEqual(1, len(self.backend.queries))
+
+        resp = service.getData(query.Query(1).inTimeRange(200, 500))
+        self.assertEqual(self._expected(200, 500), self._collect(resp))
+        self.assertEqual(2, len(self.backend.queries))
+        self.assertEqual(301, self.backend.queries[-1]["from"])
+        self.assertEqual(500, self.backend.queries[-1]["to"])
+
+        # covered entirely, even by a new cache instance on the same path
+        other = self._service(rangecache.RangeCache(self.path))
+        resp = other.getData(query.Query(1).inTimeRange(150, 450))
+        self.assertEqual(self._expected(150, 450), self._collect(resp))
+        self.assertEqual(2, len(self.backend.queries))
+
+        resp = service.getData(query.Query(1).inTimeRange(0, 600))
+        self.assertEqual(self._expected(0, 600), self._collect(resp))
+        self.assertEqual([(0, 99), (501, 600)],
+                         [(q["from"], q["to"]) for q in self.backend.queries[-2:]])
+        self.assertEqual({"queries": 3, "requests": 4, "hits": 0}, cache.stats())
+
+    def test_separateStreams(self):
+        service = self._service(rangecache.RangeCache(self.path))
+        service.getData(query.Query(1).inTimeRange(0, 100))
+        resp = service.getData(query.Query(1, deviceId="dev1").inTimeRange(0, 100))
+        self.assertEqual(2, len(self.backend.queries))
+        self.assertEqual([("dev1", "a")], list(self._collect(resp).keys()))
+
+        q = query.Query(1, timeUnit=query.TimeUnit.MICROSECONDS).inTimeRange(0, 100000)
+        resp = service.getData(q)
+        self.assertEqual(3, len(self.backend.queries))
+        self.assertEqual(self._expected(0, 100, mult=1000), self._collect(resp))
+        resp = service.getData(q)
+        self.assertEqual(3, len(self.backend.queries))
+        self.assertEqual("usec", resp["timefmt"])
+        self.assertEqual(self._expected(0, 100, mult=1000), self._collect(resp))
+
+    def test_separateTokens(self):
+        cache = rangecache.RangeCache(self.path)
+        self._service(cache).getData(query.Query(1).inTimeRange(0, 100))
+        other = exports.ExportService("othertoken",
+                                      requester=request.DummyRequester(self.backend),
+                                      rangeCache=cache)
+        self.assertRaises(request.UnknownCodeError, other.getData,
+                          query.Query(1).inTimeRange(0, 100))
+        self.assertEqual(2, self.backend.calls)
+
+    def test_newSegmentPerFetch(self):
+        service = self._service(rangecache.RangeCache(self.path))
+        service.getData(query.Query(1).inTimeRange(0, 100))
+        first = sorted(os.listdir(self.path))
+        contents = dict((n, open(os.path.join(self.path, n)).read()) for n in first)
+        service.getData(query.Query(1).inTimeRange(50, 200))
+        names = sorted(os.listdir(self.path))
+        self.assertEqual(2, len(first))
+        self.assertEqual(3, len(names))
+        # the earlier segment is not rewritten
+        segment = [n for n in first if n.count(".") > 1][0]
+        self.assertEqual(contents[segment], open(os.path.join(self.path, segment)).read())
+
+    def test_limitNotCached(self):
+        service = self._service(rangecache.RangeCache(self.path))
+        service.getData(query.Query(1).inTimeRange(0, 100).limit(2))
+        service.getData(query.Query(1).inTimeRange(0, 100).limit(2))
+        self.assertEqual(2, len(self.backend.queries))
+
+    def test_recentNotCovered(self):
+        cache = rangecache.RangeCache(self.path, lag=10 ** 15)
+        service = self._service(cache)
+        resp = service.getData(query.Query(1).inTimeRange(0, 100))
+        self.assertEqual(self._expected(0, 100), self._collect(resp))
+        service.getData(query.Query(1).inTimeRange(0, 100))
+        self.assertEqual(2, len(self.backend.queries))
+
+    def test_clear(self):
+        cache = rangecache.RangeCache(self.path)
+        service = self._service(cache)
+        service.getData(query.Query(1).inTimeRange(0, 100))
+        cache.clear()
+        self.assertEqual([], os.listdir(self.path))
+        service.getData(query.Query(1).inTimeRange(0, 100))
+        self.assertEqual(2, len(self.backend.queries))
@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from iobeam.resources import device
+from iobeam.utils import registry
+
+_PROJECT_ID = 1
+
+DeviceRegistry = registry.DeviceRegistry
+
+
+class TestDeviceRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_empty(self):
+        reg = DeviceRegistry(self.path)
+        self.assertIsNone(reg.get(_PROJECT_ID, "dev1"))
+        self.assertFalse(reg.contains(_PROJECT_ID, "dev1"))
+        self.assertEqual([], reg.devices(_PROJECT_ID))
+        self.assertFalse(os.path.exists(os.path.join(self.path, registry.REGISTRY_FILE)))
+
+    def test_addAndPersist(self):
+        reg = DeviceRegistry(self.path)
+        reg.add(device.Device(_PROJECT_ID, "dev1", deviceName="name1"))
+        reg.addAll([device.Device(_PROJECT_ID, "dev2"), device.Device(2, "dev1")])
+
+        dev = reg.get(_PROJECT_ID, "dev1")
+        self.assertEqual("dev1", dev.deviceId)
+        self.assertEqual("name1", dev.deviceName)
+        self.assertEqual(_PROJECT_ID, dev.projectId)
+
+        # New instance reads what was written
+        reg2 = DeviceRegistry(self.path)
+        self.assertTrue(reg2.contains(_PROJECT_ID, "dev2"))
+        self.assertTrue(reg2.contains(2, "dev1"))
+        self.assertFalse(reg2.contains(2, "dev2"))
+        ids = sorted(d.deviceId for d in reg2.devices(_PROJECT_ID))
+        self.assertEqual(["dev1", "dev2"], ids)
+
+        # No temp files left behind
+        self.assertEqual([registry.REGISTRY_FILE], os.listdir(self.path))
+
+    def test_mergesOtherWriters(self):
+        reg1 = DeviceRegistry(self.path)
+        reg2 = DeviceRegistry(self.path)
+        reg1.add(device.Device(_PROJECT_ID, "dev1"))
+        reg2.add(device.Device(_PROJECT_ID, "dev2"))
+
+        with open(os.path.join(self.path, registry.REGISTRY_FILE)) as f:
+            onDisk = json.load(f)
+        self.assertEqual(["dev1", "dev2"], sorted(onDisk[str(_PROJECT_ID)]))
+
+    def test_remove(self):
+        reg = DeviceRegistry(self.path)
+        reg.add(device.Device(_PROJECT_ID, "dev1"))
+        self.assertTrue(reg.remove(_PROJECT_ID, "dev1"))
+        self.assertFalse(reg.remove(_PROJECT_ID, "dev1"))
+        self.assertFalse(DeviceRegistry(self.path).contains(_PROJECT_ID, "dev1"))
+
+    def test_corruptFile(self):
+        with open(os.path.join(self.path, registry.REGISTRY_FILE), "w") as f:
+            f.write("{not json")
+        reg = DeviceRegistry(self.path)
+        self.assertIsNone(reg.get(_PROJECT_ID, "dev1"))
+        reg.add(device.Device(_PROJECT_ID, "dev1"))
+        self.assertTrue(DeviceRegistry(self.path).contains(_PROJECT_ID, "dev1"))
@@ -1,4 +1,7 @@
+import os
+import shutil
 import sys
+import tempfile
 import unittest
 if sys.version_info > (3, 2):
     from unittest.mock import patch
@@ -40,6 +43,22 @@ class TestUtilsFuncs(unittest.TestCase):
             self.assertTrue(utils.isExpiredToken(token))
 
 
+    def test_getTokenExpiryCached(self):
+        token = "eyJ0eXAiOiJKV1QiLCJhbGciOiJIUzI1NiIsImtpZCI6MTB9.eyJ1aWQiOjAsInBpZCI6NywiZXhwIjoxNDQ5MjM0NjYwLCJwbXMiOjN9.nosecret="
+        expiry = 1449234660 * 1000
+        self.assertEqual(expiry, utils.getTokenExpiry(token))
+        with patch.object(utils.jwt, "decode") as mm:
+            self.assertEqual(expiry, utils.getTokenExpiry(token))
+            with patch.object(utils.time, "time", return_value=0):
+                self.assertFalse(utils.isExpiredToken(token))
+            self.assertEqual(0, mm.call_count)
+
+        try:
+            utils.getTokenExpiry("not a token")
+            self.assertTrue(False)
+        except ValueError:
+            pass
+
     def test_checkValidProjectId(self):
         def verify(pid, msg):
             try:
@@ -88,3 +107,15 @@ class TestUtilsFuncs(unittest.TestCase):
         # Should be valid
         utils.checkValidProjectToken("valid")
         self.assertTrue(True)
+
+    def test_atomicWrite(self):
+        path = tempfile.mkdtemp()
+        try:
+            p = os.path.join(path, "file")
+            utils.atomicWrite(p, "first")
+            utils.atomicWrite(p, "second")
+            with open(p) as f:
+                self.assertEqual("second", f.read())
+            self.assertEqual(["file"], os.listdir(path))
+        finally:
+            shutil.rmtree(path)
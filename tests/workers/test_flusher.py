@@ -0,0 +1,112 @@
+import threading
+import time
+import unittest
+
+from iobeam.workers import flusher
+
+AutoFlusher = flusher.AutoFlusher
+
+
+class DummyTarget(object):
+
+    def __init__(self, rows=0, size=0, oldest=None, fail=False):
+        self.rows = rows
+        self.size = size
+        self.oldest = oldest
+        self.fail = fail
+        self.sends = 0
+        self.sent = threading.Event()
+
+    def _pendingStats(self):
+        return (self.rows, self.size, self.oldest)
+
+    def send(self):
+        self.sends += 1
+        self.sent.set()
+        if self.fail:
+            raise Exception("send failed")
+        self.rows = 0
+        self.size = 0
+        self.oldest = None
+
+
+class TestAutoFlusher(unittest.TestCase):
+
+    def test_constructorBad(self):
+        bads = [
+            (None, None, None, 1.0),
+            (0, None, None, 1.0),
+            (None, -1, None, 1.0),
+            (None, None, 0, 1.0),
+            (10, None, None, 0),
+            (10, None, None, None)
+        ]
+        for (rows, size, age, interval) in bads:
+            try:
+                AutoFlusher(DummyTarget(), maxRows=rows, maxBytes=size,
+                            maxAge=age, checkInterval=interval)
+                self.assertTrue(False)
+            except ValueError:
+                pass
+
+    def test_shouldFlush(self):
+        target = DummyTarget()
+        af = AutoFlusher(target, maxRows=10, maxBytes=100, maxAge=5)
+        self.assertFalse(af.shouldFlush())
+
+        target.rows = 9
+        target.size = 99
+        target.oldest = time.time()
+        self.assertFalse(af.shouldFlush())
+
+        target.rows = 10
+        self.assertTrue(af.shouldFlush())
+
+        target.rows = 1
+        target.size = 100
+        self.assertTrue(af.shouldFlush())
+
+        target.size = 1
+        target.oldest = time.time() - 5
+        self.assertTrue(af.shouldFlush())
+
+    def test_backgroundFlush(self):
+        target = DummyTarget()
+        af = AutoFlusher(target, maxRows=5, checkInterval=0.01)
+        af.start()
+        self.assertTrue(af.isRunning())
+        target.rows = 5
+        self.assertTrue(target.sent.wait(2))
+        self.assertTrue(af.stop(drain=True))
+        self.assertFalse(af.isRunning())
+        self.assertEqual(1, target.sends)
+
+    def test_stopDrains(self):
+        target = DummyTarget()
+        af = AutoFlusher(target, maxRows=100, checkInterval=10)
+        af.start()
+        target.rows = 1
+        self.assertTrue(af.stop(drain=True))
+        self.assertEqual(1, target.sends)
+        self.assertEqual(0, target.rows)
+
+        target.rows = 1
+        af.start()
+        self.assertTrue(af.stop(drain=False))
+        self.assertEqual(1, target.sends)
+
+    def test_requestFlush(self):
+        target = DummyTarget(rows=1)
+        af = AutoFlusher(target, maxRows=100, checkInterval=10)
+        af.start()
+        af.requestFlush()
+        self.assertTrue(target.sent.wait(2))
+        af.stop(drain=False)
+
+    def test_failureKeepsRunning(self):
+        target = DummyTarget(rows=1, fail=True)
+        af = AutoFlusher(target, maxRows=1, checkInterval=0.01)
+        af.start()
+        self.assertTrue(target.sent.wait(2))
+        self.assertTrue(af.isRunning())
+        self.assertFalse(af.stop(drain=True))
@@ -0,0 +1,45 @@
+import threading
+import time
+import unittest
+
+from iobeam.workers import pool
+
+
+class TestRunAll(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual([], pool.runAll([], 4))
+
+    def test_orderAndErrors(self):
+        def ok(val):
+            return lambda: val
+
+        def bad():
+            raise ValueError("bad")
+
+        for workers in [1, 4]:
+            tasks = [ok(0), bad, ok(2)]
+            results = pool.runAll(tasks, workers)
+            self.assertEqual(3, len(results))
+            self.assertEqual((0, None), results[0])
+            self.assertTrue(results[1][0] is None)
+            self.assertTrue(isinstance(results[1][1], ValueError))
+            self.assertEqual((2, None), results[2])
+
+    def test_boundedConcurrency(self):
+        lock = threading.Lock()
+        state = {"running": 0, "max": 0}
+
+        def task():
+            with lock:
+                state["running"] += 1
+                state["max"] = max(state["max"], state["running"])
+            time.sleep(0.01)
+            with lock:
+                state["running"] -= 1
+            return True
+
+        results = pool.runAll([task] * 12, 3)
+        self.assertEqual(12, len([r for r, _ in results if r]))
+        self.assertTrue(state["max"] <= 3)
+        self.assertTrue(state["max"] > 1)
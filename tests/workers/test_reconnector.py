@@ -0,0 +1,48 @@
+import threading
+import unittest
+
+from iobeam.workers import reconnector
+
+Reconnector = reconnector.Reconnector
+
+
+class DummyTarget(object):
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+        self.called = threading.Event()
+
+    def _reconnect(self):
+        self.calls += 1
+        self.called.set()
+        if self.fail:
+            raise Exception("reconnect failed")
+
+
+class TestReconnector(unittest.TestCase):
+
+    def test_constructorBad(self):
+        for interval in [0, -1, None]:
+            self.assertRaises(ValueError, Reconnector, DummyTarget(), probeInterval=interval)
+
+    def test_reconnects(self):
+        target = DummyTarget(fail=True)
+        r = Reconnector(target, probeInterval=0.01)
+        r.start()
+        r.start()
+        self.assertTrue(target.called.wait(2))
+        target.called.clear()
+        self.assertTrue(target.called.wait(2))  # keeps going after a failure
+        self.assertTrue(r.isRunning())
+        self.assertTrue(r.stop(timeout=2))
+        self.assertFalse(r.isRunning())
+        self.assertTrue(target.calls >= 2)
+
+    def test_stopBeforeFirstCheck(self):
+        target = DummyTarget()
+        r = Reconnector(target, probeInterval=60)
+        r.start()
+        self.assertTrue(r.stop(timeout=2))
+        self.assertEqual(0, target.calls)
+        self.assertTrue(r.stop())
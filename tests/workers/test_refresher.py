@@ -0,0 +1,82 @@
+import threading
+import time
+import unittest
+
+import jwt
+
+from iobeam.utils import utils
+from iobeam.workers import refresher
+
+TokenRefresher = refresher.TokenRefresher
+
+
+def makeToken(expSecs):
+    token = jwt.encode({"exp": int(expSecs)}, "secret")
+    if not isinstance(token, str):
+        token = token.decode("utf-8")
+    return token
+
+
+class DummyTarget(object):
+
+    def __init__(self, token, newToken=None, fail=False):
+        self.projectToken = token
+        self.newToken = newToken
+        self.fail = fail
+        self.refreshes = 0
+        self.refreshed = threading.Event()
+
+    def _refreshIfNeeded(self, force):
+        self.refreshes += 1
+        self.refreshed.set()
+        if self.fail:
+            raise Exception("refresh failed")
+        self.projectToken = self.newToken
+
+
+class TestTokenRefresher(unittest.TestCase):
+
+    def test_constructorBad(self):
+        for (margin, retry) in [(-1, 60), (None, 60), (60, 0), (60, None)]:
+            try:
+                TokenRefresher(DummyTarget(None), margin=margin, retryInterval=retry)
+                self.assertTrue(False)
+            except ValueError:
+                pass
+
+    def test_secondsUntilRefresh(self):
+        fudge = utils.EXPIRY_FUDGE / 1000.0
+        exp = time.time() + fudge + 7200
+        r = TokenRefresher(DummyTarget(makeToken(exp)), margin=3600)
+        wait = r.secondsUntilRefresh()
+        self.assertTrue(3500 < wait <= 3600)
+
+    def test_refreshesExpiring(self):
+        fudge = utils.EXPIRY_FUDGE / 1000.0
+        newToken = makeToken(time.time() + fudge + 7 * 24 * 3600)
+        target = DummyTarget(makeToken(time.time()), newToken=newToken)
+        r = TokenRefresher(target, margin=60)
+        r.start()
+        self.assertTrue(target.refreshed.wait(2))
+        self.assertTrue(r.stop(timeout=2))
+        self.assertEqual(1, target.refreshes)
+        self.assertEqual(newToken, target.projectToken)
+
+    def test_failedRefreshRetries(self):
+        target = DummyTarget(makeToken(time.time()), fail=True)
+        r = TokenRefresher(target, margin=60, retryInterval=0.01)
+        r.start()
+        self.assertTrue(target.refreshed.wait(2))
+        for _ in range(0, 200):
+            if target.refreshes > 1:
+                break
+            time.sleep(0.01)
+        self.assertTrue(r.stop(timeout=2))
+        self.assertTrue(target.refreshes > 1)
+
+    def test_nonJwtToken(self):
+        r = TokenRefresher(DummyTarget("dummy"))
+        r.start()
+        r._thread.join(2)
+        self.assertFalse(r.isRunning())
+        self.assertTrue(r.stop())
@@ -0,0 +1,71 @@
+import threading
+import unittest
+
+from iobeam.workers import worker
+
+
+class CountingWorker(worker.Worker):
+
+    def __init__(self, firstWait=0, wait=60, rounds=None):
+        worker.Worker.__init__(self, "test-worker")
+        self.first = firstWait
+        self.wait = wait
+        self.rounds = rounds
+        self.calls = []
+        self.called = threading.Event()
+
+    def _firstWait(self):
+        return self.first
+
+    def _runOnce(self, woken):
+        self.calls.append(woken)
+        self.called.set()
+        if self.rounds is not None and len(self.calls) >= self.rounds:
+            return None
+        return self.wait
+
+
+class TestWorker(unittest.TestCase):
+
+    def test_runsAndStops(self):
+        w = CountingWorker(wait=0.01)
+        w.start()
+        w.start()
+        self.assertTrue(w.called.wait(2))
+        w.called.clear()
+        self.assertTrue(w.called.wait(2))
+        self.assertTrue(w.isRunning())
+        self.assertTrue(w.stop(timeout=2))
+        self.assertFalse(w.isRunning())
+        self.assertTrue(w.stop())
+
+    def test_wake(self):
+        w = CountingWorker(firstWait=60)
+        w.start()
+        w._wake()
+        self.assertTrue(w.called.wait(2))
+        self.assertTrue(w.stop(timeout=2))
+        self.assertEqual([True], w.calls)
+
+    def test_endsWhenRunOnceReturnsNone(self):
+        w = CountingWorker(wait=0, rounds=3)
+        w.start()
+        w._thread.join(2)
+        self.assertFalse(w.isRunning())
+        self.assertEqual(3, len(w.calls))
+        self.assertTrue(w.stop())
+
+    def test_stopBeforeFirstRound(self):
+        w = CountingWorker(firstWait=60)
+        w.start()
+        self.assertTrue(w.stop(timeout=2))
+        self.assertEqual([], w.calls)
+
+        # restarting runs again
+        w.first = 0
+        w.start()
+        self.assertTrue(w.called.wait(2))
+        self.assertTrue(w.stop(timeout=2))
+
+    def test_runOnceRequired(self):
+        self.assertRaises(NotImplementedError, worker.Worker("w")._runOnce, False)